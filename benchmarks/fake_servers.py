@@ -0,0 +1,462 @@
+"""
+Local stand-ins for the Anthropic and ElevenLabs APIs and for bucket
+storage, so the pipeline can be benchmarked without spending credits.
+
+Each server injects configurable latency, jitter and error rates and
+records per-endpoint request counts and service times.
+"""
+import ast
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from aiohttp import web
+
+from storage_backend import MemoryStorage
+
+# Silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, mono, no CRC.
+# All-zero side info and main data decode to 1152 samples of silence.
+MP3_FRAME = b"\xff\xfb\x90\xc0" + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+SPOKEN_CHARS_PER_SECOND = 15
+
+NARRATIVE_LINE = re.compile(r'^Slide (\d+) \((.*)\): "(.*)"\s*$', re.MULTILINE | re.DOTALL)
+
+
+class LatencyProfile:
+    """Latency, jitter and error injection for one fake endpoint."""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        seed: Optional[int] = None
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+
+    def delay_seconds(self) -> float:
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+class RequestLog:
+    """Thread-safe per-endpoint request counts and service times."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.bytes_in = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, status: int, bytes_in: int = 0) -> None:
+        with self._lock:
+            self.counts[endpoint] += 1
+            self.latencies[endpoint].append(seconds)
+            self.bytes_in[endpoint] += bytes_in
+            if status >= 400:
+                self.errors[endpoint] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counts": dict(self.counts),
+                "errors": dict(self.errors),
+                "bytes_in": dict(self.bytes_in),
+                "latencies": {k: list(v) for k, v in self.latencies.items()}
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.latencies.clear()
+            self.bytes_in.clear()
+
+
+def synthetic_script(slide_number: int, words: int) -> str:
+    sentence = f"This is the narration for slide {slide_number}, explaining the key idea in plain terms."
+    per_sentence = len(sentence.split())
+    return " ".join([sentence] * max(1, words // per_sentence))
+
+
+def _message_text(body: dict) -> str:
+    """Text of the last user message, whether sent as a string or as content blocks."""
+    content = body["messages"][-1]["content"]
+    if isinstance(content, str):
+        return content
+    return "\n".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def _count_slides(prompt: str) -> int:
+    """Number of slides in a narrative request, from the slide list or slide markers."""
+    _, _, payload = prompt.partition("\n\n")
+    try:
+        slides = ast.literal_eval(payload.strip())
+        if isinstance(slides, list):
+            return len(slides)
+    except (ValueError, SyntaxError):
+        pass
+    return max(1, len(re.findall(r"^--- Slide \d+", prompt, re.MULTILINE)))
+
+
+def _first_slide_number(prompt: str) -> int:
+    match = re.search(r"^--- Slide (\d+)", prompt, re.MULTILINE)
+    return int(match.group(1)) if match else 1
+
+
+class FakeAnthropic:
+    """
+    Serves POST /v1/messages in the Messages API shape.
+
+    Narrative requests get one 'Slide X (Title): "Script"' block per slide
+    in the request; JSON conversion requests get the matching JSON.
+
+    Prompt caching is modelled on the system blocks: the prefix up to the
+    last cache_control breakpoint is reported as a cache write the first
+    time it is seen and as a cache read afterwards, if it is at least
+    MIN_CACHEABLE_TOKENS long.
+
+    Message Batches (/v1/messages/batches) are answered the same way;
+    a batch reports in_progress for batch_seconds after it is created.
+    """
+
+    MIN_CACHEABLE_TOKENS = 1024
+
+    def __init__(self, profile: LatencyProfile, log: RequestLog, script_words: int = 120, batch_seconds: float = 1.0):
+        self.profile = profile
+        self.log = log
+        self.script_words = script_words
+        self.batch_seconds = batch_seconds
+        self._cached_prefixes = set()
+        self._message_batches = {}
+
+    def _prompt_cache_usage(self, body: dict) -> tuple:
+        """(cache_creation_input_tokens, cache_read_input_tokens) for a request."""
+        system = body.get("system")
+        if not isinstance(system, list):
+            return 0, 0
+        breakpoints = [i for i, block in enumerate(system) if block.get("cache_control")]
+        if not breakpoints:
+            return 0, 0
+        prefix = json.dumps([body.get("model"), [block.get("text") for block in system[:breakpoints[-1] + 1]]])
+        tokens = len(prefix) // 4
+        if tokens < self.MIN_CACHEABLE_TOKENS:
+            return 0, 0
+        if prefix in self._cached_prefixes:
+            return 0, tokens
+        self._cached_prefixes.add(prefix)
+        return tokens, 0
+
+    def routes(self):
+        return [
+            web.post("/v1/messages", self.handle_messages),
+            web.post("/v1/messages/batches", self.handle_batch_create),
+            web.get("/v1/messages/batches/{batch_id}", self.handle_batch_retrieve),
+            web.get("/v1/messages/batches/{batch_id}/results", self.handle_batch_results),
+        ]
+
+    async def _respond_text(self, body: dict) -> str:
+        prompt = _message_text(body)
+        if prompt.startswith("Convert this to JSON"):
+            narrative = prompt.partition("\n\n")[2]
+            slides = [
+                {"slide": int(m.group(1)), "title": m.group(2), "script": m.group(3)}
+                for m in NARRATIVE_LINE.finditer(narrative)
+            ]
+            return json.dumps({"slides": slides})
+
+        first = _first_slide_number(prompt)
+        blocks = []
+        for slide_number in range(first, first + _count_slides(prompt)):
+            script = synthetic_script(slide_number, self.script_words).replace('"', "'")
+            blocks.append(f'Slide {slide_number} (Synthetic slide {slide_number}): "{script}"')
+        return "\n\n".join(blocks)
+
+    async def handle_messages(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        raw = await request.read()
+        body = json.loads(raw)
+        await asyncio.sleep(self.profile.delay_seconds())
+
+        if self.profile.should_fail():
+            status = self.profile.error_status
+            self.log.record("anthropic.messages", time.monotonic() - started, status, len(raw))
+            return web.json_response(
+                {"type": "error", "error": {"type": "rate_limit_error", "message": "fake throttle"}},
+                status=status,
+                headers={"retry-after": "1"}
+            )
+
+        self.log.record("anthropic.messages", time.monotonic() - started, 200, len(raw))
+        return web.json_response(await self._message(body, len(raw)))
+
+    async def _message(self, body: dict, request_bytes: int) -> dict:
+        text = await self._respond_text(body)
+        cache_creation, cache_read = self._prompt_cache_usage(body)
+        input_tokens = request_bytes // 4 - cache_creation - cache_read
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": input_tokens,
+                "output_tokens": len(text) // 4,
+                "cache_creation_input_tokens": cache_creation,
+                "cache_read_input_tokens": cache_read
+            }
+        }
+
+    def _batch_object(self, request: web.Request, batch_id: str) -> dict:
+        batch = self._message_batches[batch_id]
+        ended = time.time() >= batch["ends_at"]
+        succeeded = sum(1 for entry in batch["results"] if entry["result"]["type"] == "succeeded")
+        created_at = datetime.fromtimestamp(batch["created_at"], timezone.utc).isoformat()
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else len(batch["results"]),
+                "succeeded": succeeded if ended else 0,
+                "errored": len(batch["results"]) - succeeded if ended else 0,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": created_at,
+            "expires_at": created_at,
+            "ended_at": datetime.fromtimestamp(batch["ends_at"], timezone.utc).isoformat() if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{request.scheme}://{request.host}/v1/messages/batches/{batch_id}/results" if ended else None
+        }
+
+    async def handle_batch_create(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        raw = await request.read()
+        body = json.loads(raw)
+        results = []
+        for item in body["requests"]:
+            if self.profile.should_fail():
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "overloaded_error", "message": "fake"}}}
+            else:
+                message = await self._message(item["params"], len(json.dumps(item["params"])))
+                result = {"type": "succeeded", "message": message}
+            results.append({"custom_id": item["custom_id"], "result": result})
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        now = time.time()
+        self._message_batches[batch_id] = {"results": results, "created_at": now, "ends_at": now + self.batch_seconds}
+        self.log.record("anthropic.batches", time.monotonic() - started, 200, len(raw))
+        return web.json_response(self._batch_object(request, batch_id))
+
+    async def handle_batch_retrieve(self, request: web.Request) -> web.Response:
+        batch_id = request.match_info["batch_id"]
+        if batch_id not in self._message_batches:
+            return web.json_response({"type": "error", "error": {"type": "not_found_error", "message": batch_id}}, status=404)
+        return web.json_response(self._batch_object(request, batch_id))
+
+    async def handle_batch_results(self, request: web.Request) -> web.Response:
+        batch = self._message_batches.get(request.match_info["batch_id"])
+        if batch is None or time.time() < batch["ends_at"]:
+            return web.json_response({"type": "error", "error": {"type": "not_found_error", "message": "no results"}}, status=404)
+        body = "\n".join(json.dumps(entry) for entry in batch["results"]) + "\n"
+        return web.Response(text=body, content_type="application/binary")
+
+
+class FakeElevenLabs:
+    """
+    Serves the ElevenLabs endpoints the pipeline uses: streaming TTS,
+    knowledge-base upload and agent creation.
+
+    TTS returns silent MP3 frames whose duration follows the text length,
+    and latency scales with the number of characters synthesized and,
+    when upload_bytes_per_second is set, with the request body size.
+    """
+
+    def __init__(
+        self,
+        profile: LatencyProfile,
+        log: RequestLog,
+        ms_per_char: float = 0.0,
+        upload_bytes_per_second: Optional[float] = None
+    ):
+        self.profile = profile
+        self.log = log
+        self.ms_per_char = ms_per_char
+        self.upload_bytes_per_second = upload_bytes_per_second
+
+    def routes(self):
+        return [
+            web.post("/v1/text-to-speech/{voice_id}/stream", self.handle_tts),
+            web.post("/v1/convai/knowledge-base", self.handle_knowledge_base),
+            web.post("/v1/convai/agents/create", self.handle_agent)
+        ]
+
+    async def _maybe_fail(self, endpoint: str, started: float, bytes_in: int) -> Optional[web.Response]:
+        if not self.profile.should_fail():
+            return None
+        status = self.profile.error_status
+        self.log.record(endpoint, time.monotonic() - started, status, bytes_in)
+        return web.json_response({"detail": "fake throttle"}, status=status, headers={"retry-after": "1"})
+
+    async def handle_tts(self, request: web.Request) -> web.StreamResponse:
+        started = time.monotonic()
+        raw = await request.read()
+        body = json.loads(raw)
+        text = body.get("text") or ""
+        upload_seconds = len(raw) / self.upload_bytes_per_second if self.upload_bytes_per_second else 0.0
+        await asyncio.sleep(self.profile.delay_seconds() + len(text) * self.ms_per_char / 1000 + upload_seconds)
+
+        failure = await self._maybe_fail("elevenlabs.tts", started, len(raw))
+        if failure is not None:
+            return failure
+
+        frames = max(1, int(len(text) / SPOKEN_CHARS_PER_SECOND / MP3_FRAME_SECONDS))
+        response = web.StreamResponse(status=200, headers={"Content-Type": "audio/mpeg"})
+        await response.prepare(request)
+        chunk_frames = 64
+        for start in range(0, frames, chunk_frames):
+            await response.write(MP3_FRAME * min(chunk_frames, frames - start))
+        await response.write_eof()
+        self.log.record("elevenlabs.tts", time.monotonic() - started, 200, len(raw))
+        return response
+
+    async def handle_knowledge_base(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        raw = await request.read()
+        await asyncio.sleep(self.profile.delay_seconds())
+        failure = await self._maybe_fail("elevenlabs.knowledge_base", started, len(raw))
+        if failure is not None:
+            return failure
+        self.log.record("elevenlabs.knowledge_base", time.monotonic() - started, 200, len(raw))
+        return web.json_response({"id": f"kb_{uuid.uuid4().hex[:12]}", "name": "presentation"})
+
+    async def handle_agent(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        raw = await request.read()
+        await asyncio.sleep(self.profile.delay_seconds())
+        failure = await self._maybe_fail("elevenlabs.agents", started, len(raw))
+        if failure is not None:
+            return failure
+        self.log.record("elevenlabs.agents", time.monotonic() - started, 200, len(raw))
+        return web.json_response({"agent_id": f"agent_{uuid.uuid4().hex[:12]}"})
+
+
+class ServerThread:
+    """
+    Runs an aiohttp app on 127.0.0.1 in a background thread with its own
+    event loop, so both async pipeline code and blocking requests-based
+    code can call it.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._runner = None
+
+    async def _start(self) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes(self.routes)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    def start(self) -> str:
+        self._thread.start()
+        self.url = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self.url
+
+    def stop(self) -> None:
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+class FakeBucketStorage(MemoryStorage):
+    """
+    MemoryStorage with bucket-like round-trip latency, jitter and error
+    injection on every operation, plus per-operation counts.
+    """
+
+    def __init__(self, profile: LatencyProfile, log: RequestLog):
+        super().__init__()
+        self.profile = profile
+        self.log = log
+
+    def _round_trip(self, operation: str, size: int = 0) -> None:
+        started = time.monotonic()
+        time.sleep(self.profile.delay_seconds())
+        if self.profile.should_fail():
+            self.log.record(f"storage.{operation}", time.monotonic() - started, 503, size)
+            raise ConnectionError(f"fake storage {operation} failure")
+        self.log.record(f"storage.{operation}", time.monotonic() - started, 200, size)
+
+    def read_bytes(self, path: str) -> bytes:
+        self._round_trip("read")
+        return super().read_bytes(path)
+
+    def write_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> None:
+        self._round_trip("write", len(data))
+        super().write_bytes(path, data, content_type=content_type)
+
+    def create_if_absent(self, path: str, data: bytes, content_type: Optional[str] = None) -> bool:
+        self._round_trip("write", len(data))
+        return super().create_if_absent(path, data, content_type=content_type)
+
+    def read_with_generation(self, path: str):
+        self._round_trip("read")
+        return super().read_with_generation(path)
+
+    def replace_if_generation(self, path: str, data: bytes, generation: str, content_type: Optional[str] = None) -> bool:
+        self._round_trip("write", len(data))
+        return super().replace_if_generation(path, data, generation, content_type=content_type)
+
+    def exists(self, path: str) -> bool:
+        self._round_trip("exists")
+        return super().exists(path)
+
+    def delete(self, path: str) -> None:
+        self._round_trip("delete")
+        super().delete(path)
+
+    def list_objects(self, prefix: str):
+        self._round_trip("list")
+        return super().list_objects(prefix)
+
+    def set_metadata(self, path: str, metadata: dict) -> None:
+        self._round_trip("metadata")
+        super().set_metadata(path, metadata)
@@ -0,0 +1,383 @@
+"""
+Offline end-to-end benchmark for the presentation pipeline.
+
+Runs PDF extraction, script generation, audio generation and the
+knowledge-base upload against local fake Anthropic/ElevenLabs servers
+and an in-memory bucket with injected latency, so a full run costs no
+API credits. Writes a JSON report with wall time, per-stage p50/p95/p99,
+peak RSS and request counts, and can compare it against a baseline.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --compare bench.json --max-regression 0.2
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout
+from typing import List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "functions"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import (  # noqa: E402
+    FakeAnthropic,
+    FakeBucketStorage,
+    FakeElevenLabs,
+    LatencyProfile,
+    RequestLog,
+    ServerThread,
+)
+from event_loop import run  # noqa: E402
+from memory_profile import MB, track_memory  # noqa: E402
+from tracing import trace_presentation  # noqa: E402
+
+SYNTHETIC_SIZES = (10, 50, 200)
+STAGES = ("extract", "script", "audio", "script_and_audio", "knowledge_base")
+
+
+def synthetic_pdf(slide_count: int) -> bytes:
+    """
+    Build a minimal PDF with one page of Helvetica text per slide, so the
+    extraction stage runs on real PDF bytes without a PDF library.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for n in range(1, slide_count + 1):
+        lines = [f"Slide {n}: Synthetic topic {n}"] + [
+            f"Point {k}: supporting detail {k} for topic {n}" for k in range(1, 6)
+        ]
+        text_ops = " ".join(f"({line}) Tj 0 -24 Td" for line in lines)
+        stream = f"BT /F1 18 Tf 72 720 Td {text_ops} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 720 540] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+
+def load_decks(include_assets: bool, sizes) -> List[tuple]:
+    """(deck_name, pdf_bytes) for every asset PDF and each synthetic size."""
+    decks = []
+    if include_assets:
+        for path in sorted(glob.glob(os.path.join(REPO_ROOT, "assets", "**", "*.pdf"), recursive=True)):
+            with open(path, "rb") as f:
+                decks.append((os.path.splitext(os.path.basename(path))[0], f.read()))
+    for size in sizes:
+        decks.append((f"synthetic_{size}", synthetic_pdf(size)))
+    return decks
+
+
+class PeakRSSSampler:
+    """Samples resident set size from /proc in a background thread."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _sample(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self.peak_bytes = max(self.peak_bytes, self._sample())
+            self._stopped.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stopped.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self._sample())
+        return False
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": round(pick(0.50), 4),
+        "p95": round(pick(0.95), 4),
+        "p99": round(pick(0.99), 4),
+    }
+
+
+def run_stage(deck_result: dict, stage: str, func, quiet: bool):
+    """Time one stage, recording its duration and whether it produced output."""
+    started = time.perf_counter()
+    try:
+        if quiet:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                value = func()
+        else:
+            value = func()
+        status = "ok" if value is not None else "failed"
+        error = None
+    except Exception as e:
+        value, status, error = None, "error", f"{type(e).__name__}: {e}"
+        if not quiet:
+            traceback.print_exc()
+    deck_result["stages"][stage] = {
+        "seconds": round(time.perf_counter() - started, 4),
+        "status": status,
+    }
+    if error:
+        deck_result["stages"][stage]["error"] = error
+    return value
+
+
+def benchmark_deck(name: str, pdf_bytes: bytes, storage, anthropic_url: str, args) -> dict:
+    from anthropic import AsyncAnthropic
+
+    from pdf_extract import extract_slides
+    from pdf_processor import generate_script, generate_script_and_audio, process_audio
+
+    presentation_id = f"bench_{name}".replace(" ", "_")
+    result = {"deck": name, "pdf_bytes": len(pdf_bytes), "stages": {}}
+    started = time.perf_counter()
+
+    slides = run_stage(result, "extract", lambda: extract_slides(pdf_bytes), args.quiet)
+    result["slides"] = len(slides or [])
+    if slides and args.max_slides:
+        slides = slides[:args.max_slides]
+        result["slides"] = len(slides)
+
+    script = None
+    audio_options = {"output_format": args.audio_format} if args.audio_format else {}
+    claude_client = AsyncAnthropic(api_key="bench", base_url=anthropic_url, max_retries=args.sdk_retries)
+    if slides and (args.sequential or args.skip_audio):
+        script = run_stage(result, "script", lambda: run(generate_script(
+            presentation_id=presentation_id,
+            pdf_slides=slides,
+            claude_client=claude_client,
+            storage_client=storage,
+            fixed_batch_size=args.fixed_batch_size,
+        )), args.quiet)
+
+        if script is not None and not args.skip_audio:
+            run_stage(result, "audio", lambda: run(process_audio(
+                presentation_id=presentation_id,
+                storage_client=storage,
+                script_data=script,
+                **audio_options,
+            )), args.quiet)
+    elif slides:
+        def overlapped():
+            nonlocal script
+            script, audio_path = run(generate_script_and_audio(
+                presentation_id=presentation_id,
+                pdf_slides=slides,
+                claude_client=claude_client,
+                storage_client=storage,
+                fixed_batch_size=args.fixed_batch_size,
+                **audio_options,
+            ))
+            return audio_path
+        run_stage(result, "script_and_audio", overlapped, args.quiet)
+
+    if script is not None and not args.skip_knowledge_base:
+        def upload():
+            from knowledge_base import handle_knowledge_base_upload
+            body, status = handle_knowledge_base_upload(f"presentations/{presentation_id}/script.json", storage)
+            return body if status == 200 else None
+        run_stage(result, "knowledge_base", upload, args.quiet)
+
+    result["wall_seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def summarize(deck_results: List[dict], request_log: RequestLog) -> dict:
+    stage_summary = {}
+    for stage in STAGES:
+        runs = [d["stages"][stage] for d in deck_results if stage in d["stages"]]
+        stage_summary[stage] = percentiles([r["seconds"] for r in runs if r["status"] == "ok"])
+        stage_summary[stage]["failed"] = sum(1 for r in runs if r["status"] != "ok")
+
+    log = request_log.snapshot()
+    requests_summary = {
+        endpoint: {
+            "count": log["counts"][endpoint],
+            "errors": log["errors"].get(endpoint, 0),
+            "bytes_in": log["bytes_in"].get(endpoint, 0),
+            "latency": percentiles(log["latencies"][endpoint]),
+        }
+        for endpoint in sorted(log["counts"])
+    }
+    return {"stages": stage_summary, "requests": requests_summary}
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Stages and totals that are slower than the baseline by more than max_regression."""
+    regressions = []
+
+    def check(label: str, current: Optional[float], previous: Optional[float]) -> None:
+        if not current or not previous:
+            return
+        change = (current - previous) / previous
+        marker = "REGRESSION" if change > max_regression else "ok"
+        print(f"  {label:<28} {previous:9.3f}s -> {current:9.3f}s  {change:+7.1%}  {marker}", file=sys.stderr)
+        if change > max_regression:
+            regressions.append(label)
+
+    print(f"Comparing against baseline (threshold {max_regression:.0%}):", file=sys.stderr)
+    check("wall_seconds", report.get("wall_seconds"), baseline.get("wall_seconds"))
+    for stage in STAGES:
+        for q in ("p50", "p95"):
+            check(
+                f"{stage}.{q}",
+                report["summary"]["stages"].get(stage, {}).get(q),
+                baseline.get("summary", {}).get("stages", {}).get(stage, {}).get(q),
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", help="Baseline JSON report to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline, as a fraction (default 0.2)")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SYNTHETIC_SIZES),
+                        help="Synthetic deck sizes in slides")
+    parser.add_argument("--no-assets", action="store_true", help="Skip the PDFs under assets/")
+    parser.add_argument("--max-slides", type=int, default=0, help="Truncate every deck to this many slides")
+    parser.add_argument("--claude-latency-ms", type=float, default=800.0)
+    parser.add_argument("--tts-latency-ms", type=float, default=300.0)
+    parser.add_argument("--tts-ms-per-char", type=float, default=0.5)
+    parser.add_argument("--storage-latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter", type=float, default=0.25, help="Jitter as a fraction of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of API calls answered with 429")
+    parser.add_argument("--script-words", type=int, default=120, help="Words per generated slide script")
+    parser.add_argument("--sdk-retries", type=int, default=0,
+                        help="Anthropic SDK max_retries (the pipeline retries through RetryPolicy)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixed-batch-size", type=int,
+                        help="Send fixed-size slide batches instead of token-packed ones (3 was the old size)")
+    parser.add_argument("--skip-audio", action="store_true")
+    parser.add_argument("--audio-format", choices=["mp3", "wav", "flac", "opus"],
+                        help="Audio output format (default: the pipeline's AUDIO_OUTPUT_FORMAT)")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Generate the whole script before starting audio instead of overlapping them")
+    parser.add_argument("--skip-knowledge-base", action="store_true")
+    parser.add_argument("--quiet", action="store_true", help="Silence pipeline logging")
+    parser.add_argument("--memory-budget-mb", type=float,
+                        help="Memory budget per deck (default: MEMORY_BUDGET_MB or the container limit)")
+    parser.add_argument("--trace", help="Append pipeline spans to this JSON lines file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.trace:
+        os.environ["TRACE_OUTPUT"] = args.trace
+    request_log = RequestLog()
+
+    def profile(latency_ms: float, seed_offset: int) -> LatencyProfile:
+        return LatencyProfile(
+            latency_ms=latency_ms,
+            jitter_ms=latency_ms * args.jitter,
+            error_rate=args.error_rate,
+            seed=args.seed + seed_offset,
+        )
+
+    anthropic = FakeAnthropic(profile(args.claude_latency_ms, 1), request_log, script_words=args.script_words)
+    elevenlabs = FakeElevenLabs(profile(args.tts_latency_ms, 2), request_log, ms_per_char=args.tts_ms_per_char)
+    storage_profile = LatencyProfile(
+        latency_ms=args.storage_latency_ms,
+        jitter_ms=args.storage_latency_ms * args.jitter,
+        seed=args.seed + 3,
+    )
+
+    decks = load_decks(not args.no_assets, args.sizes)
+    deck_results = []
+    with ServerThread(anthropic.routes()) as anthropic_server, \
+            ServerThread(elevenlabs.routes()) as elevenlabs_server, \
+            PeakRSSSampler() as rss:
+        os.environ["YOUR_XI_API_KEY"] = "bench"
+        os.environ["ELEVEN_LABS_API_KEY"] = "bench"
+        os.environ["ELEVENLABS_BASE_URL"] = elevenlabs_server.url
+
+        started = time.perf_counter()
+        for name, pdf_bytes in decks:
+            storage = FakeBucketStorage(storage_profile, request_log)
+            presentation_id = f"bench_{name}".replace(" ", "_")
+            memory_budget = int(args.memory_budget_mb * MB) if args.memory_budget_mb else None
+            with trace_presentation(presentation_id, name="benchmark"), \
+                    track_memory(presentation_id, budget_bytes=memory_budget) as memory:
+                deck_result = benchmark_deck(name, pdf_bytes, storage, anthropic_server.url, args)
+            deck_result["memory"] = memory.report()
+            deck_results.append(deck_result)
+            print(f"{name}: {deck_result['slides']} slides in {deck_result['wall_seconds']:.2f}s "
+                  + " ".join(f"{stage}={r['seconds']:.2f}s/{r['status']}" for stage, r in deck_result["stages"].items()),
+                  file=sys.stderr)
+        wall_seconds = time.perf_counter() - started
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "trace")},
+        "wall_seconds": round(wall_seconds, 4),
+        "peak_rss_mb": round(rss.peak_bytes / (1024 * 1024), 1),
+        "decks": deck_results,
+        "summary": summarize(deck_results, request_log),
+    }
+
+    rendered = json.dumps(report, indent=2)
+    print(rendered)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(rendered)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Cold-start benchmark for the Cloud Functions entry points.
+
+Each entry point is started in fresh interpreters, which import what a
+new instance imports before it can handle its first event: main.py and
+the handler module it imports lazily, plus, for the PDF trigger, the
+Claude client. Reports p50/p95 per module and per entry point, and the
+slowest top-level imports from python -X importtime, so an import that
+creeps back to module level shows up as a regression.
+
+Usage (from the repository root):
+    python benchmarks/startup_benchmark.py --output startup.json
+    python benchmarks/startup_benchmark.py --compare startup.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+
+# Entry point -> (modules imported before its first event, whether it builds a Claude client)
+ENTRY_POINTS = {
+    "process_uploaded_file": (["main", "pdf_processor"], True),
+    "upload_knowledge_base": (["main", "knowledge_base"], False),
+    "process_tts": (["main", "tts_processor"], False),
+}
+
+CHILD_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {functions_dir!r})
+timings, errors = {{}}, {{}}
+started = time.perf_counter()
+for module in {modules!r}:
+    module_started = time.perf_counter()
+    try:
+        __import__(module)
+    except Exception as e:
+        errors[module] = f"{{type(e).__name__}}: {{e}}"
+    timings[module] = time.perf_counter() - module_started
+if {claude_client!r}:
+    client_started = time.perf_counter()
+    from llm_cache import get_claude_client
+    get_claude_client("startup-benchmark")
+    timings["claude_client"] = time.perf_counter() - client_started
+timings["total"] = time.perf_counter() - started
+print(json.dumps({{"timings": timings, "errors": errors}}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None}
+    ordered = sorted(values)
+    return {
+        "p50": round(statistics.median(ordered), 4),
+        "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 4),
+    }
+
+
+def slowest_imports(importtime_output: str, count: int) -> List[dict]:
+    """Top-level imports by cumulative time from python -X importtime output."""
+    imports = []
+    for line in importtime_output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # Top-level entries are indented by exactly one space
+        if match and len(match.group(3)) == 1:
+            imports.append({"module": match.group(4), "cumulative_ms": round(int(match.group(2)) / 1000, 1)})
+    return sorted(imports, key=lambda entry: -entry["cumulative_ms"])[:count]
+
+
+def run_entry_point(modules: List[str], claude_client: bool, profile: bool) -> dict:
+    script = CHILD_SCRIPT.format(functions_dir=FUNCTIONS_DIR, modules=modules, claude_client=claude_client)
+    command = [sys.executable] + (["-X", "importtime"] if profile else []) + ["-c", script]
+    env = {**os.environ, "TRACE_OUTPUT": "off"}
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True)
+    process_seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"Entry point process failed: {completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = process_seconds
+    result["importtime"] = completed.stderr if profile else None
+    return result
+
+
+def benchmark_entry_point(name: str, runs: int, top: int) -> dict:
+    modules, claude_client = ENTRY_POINTS[name]
+    samples = []
+    profile_output = None
+    for n in range(runs):
+        # The first run also records the import profile; the others are
+        # timed without -X importtime, which adds its own overhead
+        sample = run_entry_point(modules, claude_client, profile=n == 0)
+        if n == 0:
+            profile_output = sample.pop("importtime")
+        samples.append(sample)
+
+    timings: Dict[str, List[float]] = {}
+    for sample in samples:
+        for key, seconds in sample["timings"].items():
+            timings.setdefault(key, []).append(seconds)
+    return {
+        "entry_point": name,
+        "modules": modules,
+        "errors": samples[0]["errors"],
+        "import_seconds": percentiles(timings.pop("total")),
+        "process_seconds": percentiles([s["process_seconds"] for s in samples]),
+        "stages": {key: percentiles(values) for key, values in timings.items()},
+        "slowest_imports": slowest_imports(profile_output or "", top),
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Entry points whose p50 import time is slower than the baseline by more than max_regression."""
+    regressions = []
+    previous_results = {r["entry_point"]: r for r in baseline.get("entry_points", [])}
+    print(f"Comparing against baseline (threshold {max_regression:.0%}):", file=sys.stderr)
+    for result in report["entry_points"]:
+        previous = previous_results.get(result["entry_point"], {}).get("import_seconds", {}).get("p50")
+        current = result["import_seconds"]["p50"]
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        marker = "REGRESSION" if change > max_regression else "ok"
+        print(f"  {result['entry_point']:<28} {previous:9.3f}s -> {current:9.3f}s  {change:+7.1%}  {marker}",
+              file=sys.stderr)
+        if change > max_regression:
+            regressions.append(result["entry_point"])
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start import benchmark for the Cloud Functions entry points")
+    parser.add_argument("--entry-points", nargs="*", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry point")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", help="Baseline JSON report to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline, as a fraction (default 0.2)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = []
+    for name in args.entry_points:
+        result = benchmark_entry_point(name, args.runs, args.top)
+        results.append(result)
+        errors = f", unavailable: {result['errors']}" if result["errors"] else ""
+        print(f"{name}: imports p50 {result['import_seconds']['p50']:.3f}s, "
+              f"process p50 {result['process_seconds']['p50']:.3f}s{errors}", file=sys.stderr)
+
+    report = {
+        "config": {"runs": args.runs, "python": sys.version.split()[0]},
+        "entry_points": results,
+    }
+    rendered = json.dumps(report, indent=2)
+    print(rendered)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(rendered)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Payload size and request latency of TTS requests under different
+previous_text/next_text context strategies.
+
+"full" is the original behaviour (every request carries the whole script
+before and after its paragraph); the others are the bounded windows
+process_audio supports. Requests go to the fake ElevenLabs server, which
+can charge for upload size with --upload-kbps.
+
+Usage (from the repository root):
+    python benchmarks/tts_context_benchmark.py --slides 10 60 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "functions"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import aiohttp  # noqa: E402
+
+from fake_servers import FakeElevenLabs, LatencyProfile, RequestLog, ServerThread, synthetic_script  # noqa: E402
+from run_benchmarks import percentiles  # noqa: E402
+from script_stream import ScriptStream  # noqa: E402
+
+
+def full_context_payloads(paragraphs):
+    """The pre-window behaviour: the whole script on each side."""
+    return [
+        {
+            "text": paragraph,
+            "previous_text": None if i == 0 else " ".join(paragraphs[:i]),
+            "next_text": None if i == len(paragraphs) - 1 else " ".join(paragraphs[i + 1:])
+        }
+        for i, paragraph in enumerate(paragraphs)
+    ]
+
+
+def windowed_payloads(script_data, context_chars, context_sentences):
+    stream = ScriptStream.from_script(script_data, context_chars=context_chars, context_sentences=context_sentences)
+    return [
+        {"text": paragraph.text, "previous_text": paragraph.previous_text, "next_text": paragraph.next_text}
+        for paragraph in stream.take_ready()
+    ]
+
+
+async def send_all(url: str, payloads, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(session, payload):
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(
+                f"{url}/v1/text-to-speech/voice/stream",
+                json={"model_id": "eleven_multilingual_v2", **payload},
+                headers={"xi-api-key": "bench"}
+            ) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[send(session, payload) for payload in payloads])
+    return latencies, time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="TTS context window payload benchmark")
+    parser.add_argument("--slides", type=int, nargs="*", default=[10, 60, 200])
+    parser.add_argument("--script-words", type=int, default=120)
+    parser.add_argument("--context-chars", type=int, default=1000)
+    parser.add_argument("--context-sentences", type=int, default=3)
+    parser.add_argument("--tts-latency-ms", type=float, default=50.0)
+    parser.add_argument("--upload-kbps", type=float, default=2000.0,
+                        help="Simulated client upload bandwidth in kilobytes per second, 0 for unlimited")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    request_log = RequestLog()
+    elevenlabs = FakeElevenLabs(
+        LatencyProfile(latency_ms=args.tts_latency_ms),
+        request_log,
+        upload_bytes_per_second=args.upload_kbps * 1000 if args.upload_kbps else None
+    )
+    strategies = {
+        "full": lambda script, paragraphs: full_context_payloads(paragraphs),
+        f"chars_{args.context_chars}": lambda script, paragraphs: windowed_payloads(script, args.context_chars, None),
+        f"sentences_{args.context_sentences}": lambda script, paragraphs: windowed_payloads(
+            script, args.context_chars, args.context_sentences
+        ),
+    }
+
+    results = []
+    with ServerThread(elevenlabs.routes()) as server:
+        for slide_count in args.slides:
+            script = {"slides": [
+                {"slide": n, "title": f"Slide {n}", "script": synthetic_script(n, args.script_words)}
+                for n in range(1, slide_count + 1)
+            ]}
+            paragraphs = [slide["script"] for slide in script["slides"]]
+            for name, build in strategies.items():
+                started = time.perf_counter()
+                payloads = build(script, paragraphs)
+                build_seconds = time.perf_counter() - started
+                payload_bytes = sum(len(json.dumps(payload).encode("utf-8")) for payload in payloads)
+
+                latencies, wall_seconds = asyncio.run(send_all(server.url, payloads, args.concurrency))
+                result = {
+                    "slides": slide_count,
+                    "strategy": name,
+                    "requests": len(payloads),
+                    "payload_bytes": payload_bytes,
+                    "mean_payload_bytes": payload_bytes // max(1, len(payloads)),
+                    "build_ms": round(build_seconds * 1000, 2),
+                    "wall_seconds": round(wall_seconds, 3),
+                    "latency": percentiles(latencies)
+                }
+                results.append(result)
+                print(f"{slide_count:4d} slides {name:<14} {payload_bytes / 1e6:8.2f} MB "
+                      f"build {result['build_ms']:8.2f} ms  p50 {result['latency']['p50']:.3f}s  "
+                      f"wall {wall_seconds:.2f}s", file=sys.stderr)
+
+    rendered = json.dumps({"config": vars(args), "results": results}, indent=2)
+    print(rendered)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(rendered)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,408 @@
+import io
+import math
+import os
+import subprocess
+import tempfile
+import wave
+from typing import List, Optional, Tuple
+
+# Output formats process_audio can produce: extension, content type and the
+# ffmpeg codec/bitrate for the formats that are encoded from decoded audio.
+# mp3 is ElevenLabs' own output, stitched frame by frame without ffmpeg.
+AUDIO_FORMATS = {
+    "mp3": {"extension": "mp3", "content_type": "audio/mpeg"},
+    "wav": {"extension": "wav", "content_type": "audio/wav"},
+    "flac": {"extension": "flac", "content_type": "audio/flac", "codec": "flac"},
+    "opus": {"extension": "opus", "content_type": "audio/ogg", "codec": "libopus", "bitrate": "64k"},
+}
+
+# The wave module writes a plain 44-byte RIFF/fmt/data header for PCM
+WAV_HEADER_BYTES = 44
+
+
+def export_segment(segment, audio_format: str) -> bytes:
+    """Encode a decoded pydub AudioSegment in one of the AUDIO_FORMATS."""
+    options = AUDIO_FORMATS[audio_format]
+    buffer = io.BytesIO()
+    segment.export(buffer, format=audio_format, codec=options.get("codec"), bitrate=options.get("bitrate"))
+    return buffer.getvalue()
+
+
+def transcode_wav_file(wav_path: str, audio_format: str) -> str:
+    """
+    Encode a WAV file on disk with ffmpeg, streaming rather than loading it
+    into memory. Returns the path of the new temporary file.
+    """
+    from pydub.utils import get_encoder_name
+
+    options = AUDIO_FORMATS[audio_format]
+    fd, output_path = tempfile.mkstemp(suffix=f".{options['extension']}")
+    os.close(fd)
+    command = [get_encoder_name(), "-y", "-loglevel", "error", "-i", wav_path, "-acodec", options["codec"]]
+    if options.get("bitrate"):
+        command += ["-b:a", options["bitrate"]]
+    command += ["-f", audio_format, output_path]
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        os.remove(output_path)
+        raise
+    return output_path
+
+
+class StreamingWavWriter:
+    """
+    Appends decoded segments to a WAV file on disk one at a time.
+
+    The wave module writes a placeholder header and patches the frame
+    count on close, so only the segment currently being appended is held
+    in memory. The format of the first segment is used for the whole file
+    and later segments are converted to match it.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+        self.path = path
+        self.frames_written = 0
+        # Size of the file so far, i.e. where the next frame will be written
+        self.bytes_written = WAV_HEADER_BYTES
+        self._wave = None
+        self._frame_rate = None
+        self._channels = None
+        self._sample_width = None
+
+    def append(self, segment) -> int:
+        """
+        Append a pydub AudioSegment and return the index of its first frame.
+        """
+        if self._wave is None:
+            self._frame_rate = segment.frame_rate
+            self._channels = segment.channels
+            self._sample_width = segment.sample_width
+            self._wave = wave.open(self.path, "wb")
+            self._wave.setnchannels(self._channels)
+            self._wave.setsampwidth(self._sample_width)
+            self._wave.setframerate(self._frame_rate)
+        else:
+            segment = (
+                segment.set_frame_rate(self._frame_rate)
+                .set_channels(self._channels)
+                .set_sample_width(self._sample_width)
+            )
+
+        start_frame = self.frames_written
+        self._wave.writeframes(segment.raw_data)
+        self.frames_written += int(segment.frame_count())
+        self.bytes_written = WAV_HEADER_BYTES + self.frames_written * self._channels * self._sample_width
+        return start_frame
+
+    @property
+    def frame_rate(self) -> Optional[int]:
+        return self._frame_rate
+
+    def close(self) -> None:
+        """Finalize the file, patching the RIFF and data chunk sizes."""
+        if self._wave is not None:
+            self._wave.close()
+            self._wave = None
+
+    def cleanup(self) -> None:
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+
+def build_timing_index(slides: list, spans: dict, frame_rate: int) -> list:
+    """
+    Per-slide offsets into the combined audio file.
+
+    slides holds (paragraph index, slide) in script order, with None as
+    the index of a skipped slide; spans maps a paragraph index to its
+    (start frame, end frame, first byte, last byte) in the combined file,
+    the byte range (inclusive, as in an HTTP Range header) being None when
+    the file is not seekable by bytes.
+    Skipped slides are listed with an empty range at the point where the
+    next narrated slide starts, and plays_slide naming that slide.
+    """
+    index = []
+    pending_skipped = []
+    end_frame = max((span[1] for span in spans.values()), default=0)
+    for paragraph, slide in slides:
+        entry = {"slide": slide.get("slide"), "title": slide.get("title"), "skipped": paragraph is None}
+        index.append(entry)
+        if paragraph is None:
+            pending_skipped.append(entry)
+            continue
+        start, end, byte_start, byte_end = spans[paragraph]
+        entry.update({
+            "segment": paragraph,
+            "start_sample": start,
+            "end_sample": end,
+            "start_ms": round(start * 1000 / frame_rate),
+            "end_ms": round(end * 1000 / frame_rate),
+            "duration_ms": round((end - start) * 1000 / frame_rate),
+            "byte_start": byte_start,
+            "byte_end": byte_end,
+        })
+        for skipped in pending_skipped:
+            skipped.update(_skipped_range(start, byte_start, frame_rate, entry["slide"]))
+        pending_skipped = []
+    for skipped in pending_skipped:
+        skipped.update(_skipped_range(end_frame, None, frame_rate, None))
+    return index
+
+
+def _skipped_range(frame: int, byte: Optional[int], frame_rate: int, plays_slide) -> dict:
+    return {
+        "segment": None,
+        "start_sample": frame,
+        "end_sample": frame,
+        "start_ms": round(frame * 1000 / frame_rate) if frame_rate else 0,
+        "end_ms": round(frame * 1000 / frame_rate) if frame_rate else 0,
+        "duration_ms": 0,
+        "byte_start": byte,
+        "byte_end": None,
+        "plays_slide": plays_slide,
+    }
+
+
+class Mp3FormatError(ValueError):
+    """Raised when bytes that should be MPEG audio cannot be split into frames."""
+
+
+# Layer III bitrates in kbit/s by bitrate index, for MPEG-1 and MPEG-2/2.5
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (0 = MPEG-2.5, 2 = MPEG-2, 3 = MPEG-1)
+_MP3_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+
+def _mp3_frame_info(data: bytes, offset: int) -> Optional[tuple]:
+    """
+    Parse the Layer III frame header at offset.
+    Returns (frame length, sample rate, samples per frame, side info size)
+    or None if there is no valid header there.
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[offset + 1] >> 3) & 0x03
+    layer = (data[offset + 1] >> 1) & 0x03
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 0x03
+    padding = (data[offset + 2] >> 1) & 0x01
+    mono = (data[offset + 3] >> 6) == 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if mpeg1 else 576
+    length = (samples_per_frame // 8) * bitrate // sample_rate + padding
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    return length, sample_rate, samples_per_frame, side_info
+
+
+def _id3v2_size(data: bytes) -> int:
+    """Size of an ID3v2 tag at the start of data, including its footer, or 0."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def mp3_frames(data: bytes):
+    """
+    Split an MP3 stream into its audio frames without decoding it.
+
+    ID3v2/ID3v1 tags and the Xing/Info/VBRI header frame that encoders put
+    first are dropped, since they describe a single file and would be
+    wrong (or play as a glitch) in the middle of a concatenated stream.
+    Yields (frame bytes, sample rate, samples per frame).
+    """
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    offset = _id3v2_size(data)
+    first = True
+    while offset < end:
+        info = _mp3_frame_info(data, offset)
+        if info is None:
+            # Resynchronize on the next frame header, skipping stray bytes
+            next_sync = data.find(b"\xff", offset + 1, end)
+            if next_sync == -1:
+                break
+            offset = next_sync
+            continue
+        length, sample_rate, samples_per_frame, side_info = info
+        if offset + length > end:
+            break
+        frame = data[offset:offset + length]
+        offset += length
+        if first:
+            first = False
+            tag_at = 4 + side_info
+            if frame[tag_at:tag_at + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI":
+                continue
+        yield frame, sample_rate, samples_per_frame
+
+
+HLS_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+# Owner of the ID3 PRIV frame that timestamps an HLS packed-audio segment
+HLS_TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp"
+# MPEG-2 timestamps count a 90 kHz clock in 33 bits
+MPEG_CLOCK_HZ = 90000
+
+
+def _syncsafe(value: int) -> bytes:
+    """ID3v2 size: four bytes of seven bits each."""
+    return bytes((value >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def hls_timestamp_tag(start_seconds: float) -> bytes:
+    """
+    ID3v2.4 tag whose PRIV frame gives the MPEG-2 timestamp of a packed
+    audio segment's first sample, which RFC 8216 section 3.4 requires at
+    the start of every such segment.
+    """
+    timestamp = round(start_seconds * MPEG_CLOCK_HZ) & (2 ** 33 - 1)
+    payload = HLS_TIMESTAMP_OWNER + b"\x00" + timestamp.to_bytes(8, "big")
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+
+class Mp3Chunker:
+    """
+    Re-cuts a sequence of MP3 segments into chunks of about
+    target_seconds each on frame boundaries, for HLS packed audio. Each
+    chunk starts with the hls_timestamp_tag of its position in the stream.
+    """
+
+    def __init__(self, target_seconds: float):
+        self.target_seconds = target_seconds
+        self._frames = []
+        self._seconds = 0.0
+        self._start_seconds = 0.0
+
+    def add(self, data: bytes) -> List[Tuple[bytes, float]]:
+        """Add a segment and return the (chunk, duration) pairs it completed."""
+        chunks = []
+        for frame, sample_rate, samples_per_frame in mp3_frames(data):
+            self._frames.append(frame)
+            self._seconds += samples_per_frame / sample_rate
+            if self._seconds >= self.target_seconds:
+                chunks.append(self.flush())
+        return chunks
+
+    def flush(self) -> Optional[Tuple[bytes, float]]:
+        """The frames collected so far as a final, possibly short, chunk."""
+        if not self._frames:
+            return None
+        chunk = (hls_timestamp_tag(self._start_seconds) + b"".join(self._frames), self._seconds)
+        self._start_seconds += self._seconds
+        self._frames = []
+        self._seconds = 0.0
+        return chunk
+
+
+def render_hls_playlist(chunk_names: List[str], durations: List[float], target_seconds: float, ended: bool) -> str:
+    """
+    Media playlist for the chunks published so far. It is an EVENT
+    playlist (chunks are only ever appended) until ended adds ENDLIST.
+    """
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{max([math.ceil(target_seconds)] + [round(d) for d in durations])}",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+    ]
+    for name, duration in zip(chunk_names, durations):
+        lines += [f"#EXTINF:{duration:.3f},", name]
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class StreamingMp3Writer:
+    """
+    Concatenates MP3 segments into one file on disk frame by frame, with
+    no decoding or re-encoding.
+
+    Every segment must share the first segment's sample rate, which holds
+    for audio from one ElevenLabs voice/model/output format. The
+    positions returned by append count samples, like StreamingWavWriter.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".mp3")
+            os.close(fd)
+        self.path = path
+        self.frame_rate = None
+        self.frames_written = 0
+        self.bytes_written = 0
+        self._file = None
+
+    def append(self, data: bytes) -> int:
+        """
+        Append the audio frames of an MP3 segment and return the index of
+        its first sample. Raises Mp3FormatError if it holds no frames or
+        its sample rate differs from the earlier segments.
+        """
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        start_frame = self.frames_written
+        frame_count = 0
+        for frame, sample_rate, samples_per_frame in mp3_frames(data):
+            if self.frame_rate is None:
+                self.frame_rate = sample_rate
+            elif sample_rate != self.frame_rate:
+                raise Mp3FormatError(f"Segment sample rate {sample_rate} does not match {self.frame_rate}")
+            self._file.write(frame)
+            self.bytes_written += len(frame)
+            self.frames_written += samples_per_frame
+            frame_count += 1
+        if frame_count == 0:
+            raise Mp3FormatError("No MPEG audio frames found in segment")
+        return start_frame
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def cleanup(self) -> None:
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
@@ -0,0 +1,301 @@
+"""
+Bulk script generation through the Anthropic Message Batches API.
+
+For reprocessing many presentations at once (e.g. the whole lecture
+library overnight), the narrative requests of every deck are submitted
+as Message Batches instead of being sent one by one. Batches are billed
+at a discount and are not subject to the per-minute rate limits, in
+exchange for results arriving within hours instead of seconds. Once the
+batches have ended, each deck goes through process_presentation with the
+narratives it got, so JSON conversion, validation and script.json are
+the same as for a single upload; narratives that failed in the batch are
+generated there synchronously.
+
+Usage (from the functions directory):
+    python bulk_scripts.py ../assets/presentations/*.pdf --output-dir ../output
+    python bulk_scripts.py ../assets/presentations/*.pdf --resume msgbatch_...
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from event_loop import run
+from llm_cache import DiskCacheBackend, ResponseCache, TokenUsage, get_claude_client
+from pdf_extract import extract_slides
+from pdf_processor import build_deck_outline, narrative_cache_key, narrative_request, process_presentation
+from retry_policy import RetryPolicy
+from slide_batching import plan_batches
+from storage_backend import LocalStorage, StorageNotFoundError, as_storage
+from tracing import span, trace_presentation
+
+# The API takes up to 100,000 requests (256 MB) per batch; splitting
+# earlier keeps very large libraries well inside the payload limit
+MAX_REQUESTS_PER_SUBMISSION = 10000
+POLL_SECONDS = 60.0
+# Decks assembled at once after the batches end
+ASSEMBLY_CONCURRENCY = 4
+
+
+def bulk_custom_id(presentation_id: str, start_idx: int) -> str:
+    """
+    custom_id of a batch's narrative request. It only allows
+    [a-zA-Z0-9_-], so the presentation ID goes in as a hash; the same
+    batch gets the same ID however the decks were listed.
+    """
+    digest = hashlib.sha256(f"{presentation_id}:{start_idx}".encode("utf-8")).hexdigest()
+    return f"slide{start_idx + 1}_{digest[:32]}"
+
+
+def build_narrative_requests(decks: Dict[str, List[str]]) -> Tuple[dict, dict]:
+    """
+    Narrative requests for every batch of every deck, planned exactly as
+    generate_script plans them so the results line up with its batches.
+    Returns (custom_id -> request params, custom_id -> (presentation_id, start_idx)).
+    """
+    requests, request_map = {}, {}
+    for presentation_id, pdf_slides in decks.items():
+        deck_outline = build_deck_outline(pdf_slides)
+        for batch in plan_batches(pdf_slides):
+            custom_id = bulk_custom_id(presentation_id, batch.start_idx)
+            requests[custom_id] = narrative_request(batch.slides, batch.max_tokens, deck_outline)
+            request_map[custom_id] = (presentation_id, batch.start_idx)
+    return requests, request_map
+
+
+def load_bulk_job(storage, batch_ids: List[str]) -> dict:
+    """
+    The bulk_jobs/ record of the submission that batch_ids belong to.
+    Records are named after their first message batch, so any other ID
+    is looked up in each record's message_batch_ids.
+    Raises ValueError if no record lists them.
+    """
+    try:
+        return storage.read_json(f"bulk_jobs/{batch_ids[0]}.json")
+    except StorageNotFoundError:
+        pass
+    for stored in storage.list_objects("bulk_jobs/"):
+        job = storage.read_json(stored.path)
+        if set(batch_ids) <= set(job.get("message_batch_ids", [])):
+            return job
+    raise ValueError(f"No bulk_jobs/ record lists message batches {batch_ids}")
+
+
+async def submit_message_batches(
+    claude_client,
+    requests: Dict[str, dict],
+    retry_policy: Optional[RetryPolicy] = None
+) -> List[str]:
+    """Submit the requests as one or more Message Batches and return their IDs."""
+    retry_policy = retry_policy or RetryPolicy()
+    items = [{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+    batch_ids = []
+    for start in range(0, len(items), MAX_REQUESTS_PER_SUBMISSION):
+        chunk = items[start:start + MAX_REQUESTS_PER_SUBMISSION]
+        with span("claude.batch_submit", requests=len(chunk)) as submit_span:
+            message_batch = await retry_policy.call(
+                "claude.batch_submit", lambda: claude_client.messages.batches.create(requests=chunk)
+            )
+            submit_span.set(message_batch_id=message_batch.id)
+        print(f"Submitted message batch {message_batch.id} with {len(chunk)} requests")
+        batch_ids.append(message_batch.id)
+    return batch_ids
+
+
+async def wait_for_message_batches(
+    claude_client,
+    batch_ids: List[str],
+    poll_seconds: float = POLL_SECONDS,
+    timeout: Optional[float] = None,
+    retry_policy: Optional[RetryPolicy] = None
+) -> None:
+    """
+    Poll until every batch has ended.
+    Raises TimeoutError if that takes longer than timeout seconds.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    started = time.monotonic()
+    pending = list(batch_ids)
+    with span("claude.batch_wait", batches=len(batch_ids)) as wait_span:
+        while pending:
+            for batch_id in list(pending):
+                message_batch = await retry_policy.call(
+                    "claude.batch_retrieve", lambda: claude_client.messages.batches.retrieve(batch_id)
+                )
+                counts = message_batch.request_counts
+                print(f"Message batch {batch_id}: {message_batch.processing_status}, "
+                      f"{counts.succeeded} succeeded, {counts.errored} errored, {counts.processing} processing")
+                if message_batch.processing_status == "ended":
+                    pending.remove(batch_id)
+            if not pending:
+                break
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError(f"Message batches still processing after {timeout:.0f}s: {pending}")
+            await asyncio.sleep(poll_seconds)
+        wait_span.set(seconds=round(time.monotonic() - started, 1))
+
+
+async def collect_narratives(
+    claude_client,
+    batch_ids: List[str],
+    request_map: Dict[str, tuple],
+    token_usage: Optional[TokenUsage] = None
+) -> Tuple[Dict[str, Dict[int, str]], int]:
+    """
+    Read the results of ended batches. Narratives cut off at max_tokens
+    count as failed like errored or expired ones, so generate_script
+    regenerates them synchronously. Narratives are not cached here:
+    generate_script stores them in the response cache once they convert.
+    Returns (presentation_id -> start_idx -> narrative, failed request count).
+    """
+    narratives = {}
+    failed = 0
+    for batch_id in batch_ids:
+        async for entry in await claude_client.messages.batches.results(batch_id):
+            if entry.custom_id not in request_map:
+                continue
+            presentation_id, start_idx = request_map[entry.custom_id]
+            if entry.result.type != "succeeded":
+                print(f"Bulk narrative {entry.custom_id} for {presentation_id} {entry.result.type}")
+                failed += 1
+                continue
+            message = entry.result.message
+            if token_usage is not None:
+                token_usage.record(message.usage)
+            if message.stop_reason == "max_tokens":
+                print(f"Bulk narrative {entry.custom_id} for {presentation_id} was cut off at max_tokens")
+                failed += 1
+                continue
+            text = message.content[0].text
+            narratives.setdefault(presentation_id, {})[start_idx] = text
+    return narratives, failed
+
+
+async def generate_scripts_in_bulk(
+    decks: Dict[str, List[str]],  # presentation_id -> text content of its slides
+    claude_client,
+    storage_client,
+    response_cache: Optional[ResponseCache] = None,
+    poll_seconds: float = POLL_SECONDS,
+    timeout: Optional[float] = None,
+    resume_batch_ids: Optional[List[str]] = None
+) -> Dict[str, Optional[str]]:
+    """
+    Generate script.json for many presentations with one set of Message
+    Batches. Narratives already in response_cache are not resubmitted.
+    resume_batch_ids picks up batches submitted by an earlier call for
+    the same decks instead of submitting new ones; their results are
+    matched to batches through the request map saved in bulk_jobs/.
+    Returns presentation_id -> script.json path, None where it failed.
+    """
+    storage = as_storage(storage_client)
+    retry_policy = RetryPolicy()
+    requests, request_map = build_narrative_requests(decks)
+    prepared = {presentation_id: {} for presentation_id in decks}
+    token_usage = TokenUsage()
+
+    to_submit = {}
+    for custom_id, params in requests.items():
+        cached = None
+        if response_cache is not None:
+            cached = await asyncio.to_thread(response_cache.get, narrative_cache_key(params))
+        if cached is not None:
+            presentation_id, start_idx = request_map[custom_id]
+            prepared[presentation_id][start_idx] = cached
+        else:
+            to_submit[custom_id] = params
+    print(f"Bulk run: {len(decks)} decks, {len(requests)} narrative requests, "
+          f"{len(requests) - len(to_submit)} served from cache")
+
+    batch_ids = list(resume_batch_ids or [])
+    if batch_ids:
+        job = await asyncio.to_thread(load_bulk_job, storage, batch_ids)
+        if "request_map" not in job:
+            raise ValueError(f"Bulk job {job['message_batch_ids'][0]} has no request map, submit its decks again")
+        # Results of decks that are not part of this run are skipped
+        request_map = {
+            custom_id: (presentation_id, start_idx)
+            for custom_id, (presentation_id, start_idx) in job["request_map"].items()
+            if presentation_id in decks
+        }
+        batch_ids = job["message_batch_ids"]
+    elif to_submit:
+        batch_ids = await submit_message_batches(claude_client, to_submit, retry_policy)
+        # Record the submission so an interrupted run can be resumed with --resume
+        await asyncio.to_thread(storage.write_json, f"bulk_jobs/{batch_ids[0]}.json", {
+            "message_batch_ids": batch_ids,
+            "presentation_ids": list(decks),
+            "requests": len(to_submit),
+            "request_map": {custom_id: list(request_map[custom_id]) for custom_id in to_submit},
+            "submitted_at": datetime.now().isoformat()
+        }, indent=2)
+
+    failed = 0
+    if batch_ids:
+        await wait_for_message_batches(
+            claude_client, batch_ids, poll_seconds=poll_seconds, timeout=timeout, retry_policy=retry_policy
+        )
+        narratives, failed = await collect_narratives(claude_client, batch_ids, request_map, token_usage)
+        for presentation_id, deck_narratives in narratives.items():
+            prepared[presentation_id].update(deck_narratives)
+    print(f"Bulk narratives: {sum(len(n) for n in prepared.values())} ready, {failed} failed, "
+          f"usage {token_usage.stats()}")
+
+    semaphore = asyncio.Semaphore(ASSEMBLY_CONCURRENCY)
+
+    async def assemble(presentation_id: str) -> Optional[str]:
+        async with semaphore:
+            with trace_presentation(presentation_id, source="bulk"):
+                return await process_presentation(
+                    presentation_id=presentation_id,
+                    pdf_slides=decks[presentation_id],
+                    claude_client=claude_client,
+                    storage_client=storage,
+                    response_cache=response_cache,
+                    prepared_narratives=prepared[presentation_id],
+                    retry_policy=retry_policy
+                )
+
+    paths = await asyncio.gather(*[assemble(presentation_id) for presentation_id in decks])
+    return dict(zip(decks, paths))
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate scripts for many PDFs with the Message Batches API")
+    parser.add_argument("pdfs", nargs="+", help="PDF files; the file name without .pdf is the presentation ID")
+    parser.add_argument("--output-dir", default="output", help="Root of the presentations/ output tree")
+    parser.add_argument("--resume", nargs="*", metavar="MESSAGE_BATCH_ID",
+                        help="Collect batches submitted by an earlier run for the same PDFs")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+    parser.add_argument("--timeout", type=float, help="Give up waiting after this many seconds")
+    args = parser.parse_args(argv)
+
+    decks = {}
+    for pdf_path in args.pdfs:
+        text_cache = ResponseCache(DiskCacheBackend(os.path.join(os.path.dirname(pdf_path), ".pdf_text_cache")))
+        decks[os.path.splitext(os.path.basename(pdf_path))[0]] = extract_slides(pdf_path, text_cache)
+
+    claude_client = get_claude_client()
+    response_cache = ResponseCache(DiskCacheBackend(os.path.join(args.output_dir, ".claude_cache")))
+    results = run(generate_scripts_in_bulk(
+        decks,
+        claude_client,
+        LocalStorage(args.output_dir),
+        response_cache=response_cache,
+        poll_seconds=args.poll_seconds,
+        timeout=args.timeout,
+        resume_batch_ids=args.resume
+    ))
+    for presentation_id, path in results.items():
+        print(f"{presentation_id}: {path or 'failed'}")
+    return 0 if all(results.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class RequestSlot:
+    """Timing record for one request that went through an AdaptiveLimiter."""
+
+    def __init__(self, label, units: float):
+        self.label = label
+        self.units = units
+        self.status: Optional[int] = None
+        self.started_at = 0.0
+        self.queue_wait = 0.0
+        self.service_time = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "label": self.label,
+            "status": self.status,
+            "queue_wait": round(self.queue_wait, 4),
+            "service_time": round(self.service_time, 4)
+        }
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limiter whose limit follows AIMD (additive increase,
+    multiplicative decrease).
+
+    Each successful request grows the limit by 1/limit, so a full window
+    of successes adds one slot. A 429/5xx response, or a latency per unit
+    of work well above the best seen so far, multiplies the limit by
+    decrease_factor. Only requests started after the previous decrease
+    can trigger another one, so a burst of 429s halves the limit once
+    rather than once per response. Waiters are released as soon as any
+    slot frees up.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 5,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 3.0
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.best_unit_latency: Optional[float] = None
+        self.last_decrease_at = 0.0
+        self.slots = []
+        self._condition = asyncio.Condition()
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(self.min_limit, int(self.limit))
+
+    def _on_success(self, slot: RequestSlot) -> None:
+        unit_latency = slot.service_time / max(slot.units, 1)
+        if self.best_unit_latency is None or unit_latency < self.best_unit_latency:
+            self.best_unit_latency = unit_latency
+        if unit_latency > self.best_unit_latency * self.latency_tolerance:
+            self._decrease(slot)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self, slot: RequestSlot) -> None:
+        if slot.started_at < self.last_decrease_at:
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.last_decrease_at = time.monotonic()
+
+    def shed(self) -> None:
+        """
+        Lower max_limit by decrease_factor (not below min_limit), e.g. when
+        memory runs short. Unlike a throttling decrease, the limit cannot
+        grow back past it.
+        """
+        self.max_limit = max(self.min_limit, int(self.max_limit * self.decrease_factor))
+        self.limit = min(self.limit, self.max_limit)
+
+    def slot(self, label=None, units: float = 1):
+        """
+        Async context manager that holds one concurrency slot. Set
+        .status on the yielded RequestSlot to the response status code.
+        """
+        return _SlotContext(self, RequestSlot(label, units))
+
+    def stats(self) -> dict:
+        waits = sorted(s.queue_wait for s in self.slots)
+        services = sorted(s.service_time for s in self.slots)
+
+        def percentile(values, p):
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(p * len(values)))], 4)
+
+        return {
+            "final_limit": round(self.limit, 2),
+            "requests": len(self.slots),
+            "throttled": sum(1 for s in self.slots if s.status == 429 or (s.status or 0) >= 500),
+            "queue_wait_p50": percentile(waits, 0.5),
+            "queue_wait_p95": percentile(waits, 0.95),
+            "service_time_p50": percentile(services, 0.5),
+            "service_time_p95": percentile(services, 0.95),
+            "per_request": [s.to_dict() for s in self.slots]
+        }
+
+
+class _SlotContext:
+    def __init__(self, limiter: AdaptiveLimiter, slot: RequestSlot):
+        self.limiter = limiter
+        self.slot = slot
+        self._queued_at = 0.0
+
+    async def __aenter__(self) -> RequestSlot:
+        self._queued_at = time.monotonic()
+        async with self.limiter._condition:
+            await self.limiter._condition.wait_for(self.limiter._has_capacity)
+            self.limiter.in_flight += 1
+        self.slot.started_at = time.monotonic()
+        self.slot.queue_wait = self.slot.started_at - self._queued_at
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        limiter = self.limiter
+        self.slot.service_time = time.monotonic() - self.slot.started_at
+        status = self.slot.status
+        async with limiter._condition:
+            limiter.in_flight -= 1
+            if status == 429 or (status is not None and status >= 500):
+                limiter._decrease(self.slot)
+            elif exc_type is None and status is not None and status < 400:
+                limiter._on_success(self.slot)
+            limiter.slots.append(self.slot)
+            limiter._condition.notify_all()
+        return False
+
+
+class TokenBudget:
+    """
+    Token bucket holding a per-minute allowance (e.g. a provider's input
+    or output tokens per minute) shared by every caller.
+
+    acquire() waits until the amount is available, in arrival order.
+    adjust() settles the difference once the real usage is known; it can
+    leave the budget in debt, which later callers wait out.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+        self.total_wait = 0.0
+        self.consumed = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float) -> float:
+        """Take amount (capped at one minute's allowance) and return the seconds waited."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            wait = 0.0
+            if self.available < amount:
+                wait = (amount - self.available) / self.rate
+                await asyncio.sleep(wait)
+                self._refill()
+            self.available -= amount
+            self.consumed += amount
+            self.total_wait += wait
+            return wait
+
+    def adjust(self, amount: float) -> None:
+        """Charge (positive) or refund (negative) amount without waiting."""
+        self._refill()
+        self.available = min(self.capacity, self.available - amount)
+        self.consumed += amount
+
+    def stats(self) -> dict:
+        return {
+            "per_minute": self.capacity,
+            "consumed": round(self.consumed),
+            "total_wait_seconds": round(self.total_wait, 2)
+        }
@@ -0,0 +1,141 @@
+import asyncio
+import atexit
+import os
+from typing import Callable, Optional
+
+import aiohttp
+
+from retry_policy import HTTPStatusError, RetryPolicy
+from tracing import span
+
+DEFAULT_BASE_URL = "https://api.elevenlabs.io"
+
+# Connection pool shared by every ElevenLabs call made on a loop
+CONNECTION_LIMIT = 64
+CONNECTION_LIMIT_PER_HOST = 32
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 75
+# TTS streams for long paragraphs can take a while, but a stalled socket or
+# an unreachable host should fail fast
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=300, connect=10, sock_read=120)
+
+_sessions = {}  # event loop -> aiohttp.ClientSession
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Pooled session for the running event loop, created on first use.
+
+    On the shared loop (see event_loop.run) this lives as long as the
+    process, so a warm function instance keeps its open connections.
+    """
+    loop = asyncio.get_running_loop()
+    for closed_loop in [other for other in _sessions if other.is_closed()]:
+        del _sessions[closed_loop]
+
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        session = aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+        _sessions[loop] = session
+    return session
+
+
+async def close_session() -> None:
+    """Close the running loop's session, for callers that own a short-lived loop."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+@atexit.register
+def _close_sessions() -> None:
+    """Close sessions whose loop is still running (the shared loop) at exit."""
+    for loop, session in list(_sessions.items()):
+        if loop.is_running() and not session.closed:
+            try:
+                asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+            except Exception:
+                pass
+
+
+class ElevenLabsClient:
+    """
+    Async ElevenLabs API client on top of the shared pooled session.
+    Used for TTS and by both knowledge-base uploaders. Knowledge-base and
+    agent requests go through retry_policy like the TTS calls do.
+    """
+
+    def __init__(self, api_key: Optional[str], base_url: Optional[str] = None, retry_policy: Optional[RetryPolicy] = None):
+        self.api_key = api_key
+        self.base_url = (base_url or os.getenv("ELEVENLABS_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def headers(self, **extra) -> dict:
+        return {"xi-api-key": self.api_key, **extra}
+
+    async def session(self) -> aiohttp.ClientSession:
+        return await get_session()
+
+    async def _post_json(self, span_name: str, path: str, request_kwargs: Callable[[], dict]) -> dict:
+        """
+        POST and return the JSON response, retried by retry_policy.
+        request_kwargs builds the body for each attempt, since a form
+        cannot be sent twice.
+        """
+        session = await self.session()
+
+        async def attempt() -> dict:
+            with span(span_name) as request_span:
+                async with session.post(self.url(path), headers=self.headers(), **request_kwargs()) as response:
+                    request_span.set(status=response.status)
+                    if response.status >= 400:
+                        print(f"ElevenLabs {path} failed with {response.status}: {await response.text()}")
+                        raise HTTPStatusError(f"ElevenLabs {path} failed", response.status, response.headers)
+                    return await response.json()
+
+        return await self.retry_policy.call(span_name, attempt)
+
+    async def upload_knowledge_base_json(self, json_data: dict) -> dict:
+        """Upload knowledge base data from a JSON object."""
+        return await self._post_json(
+            "elevenlabs.knowledge_base", "/v1/convai/knowledge-base", lambda: {"json": json_data}
+        )
+
+    async def upload_knowledge_base_file(self, file_path: str, content_type: str = "text/plain") -> dict:
+        """Upload a local file to the knowledge base."""
+        with open(file_path, "rb") as f:
+            content = f.read()
+
+        def form() -> dict:
+            data = aiohttp.FormData()
+            data.add_field("file", content, filename=os.path.basename(file_path), content_type=content_type)
+            return {"data": data}
+
+        return await self._post_json("elevenlabs.knowledge_base", "/v1/convai/knowledge-base", form)
+
+    async def create_agent(self, knowledge_base_id: str, name: Optional[str] = None) -> dict:
+        """Create a conversational agent that answers from a knowledge base document."""
+        payload = {
+            "name": name or f"Agent for KB {knowledge_base_id}",
+            "conversation_config": {
+                "agent": {
+                    "prompt": {
+                        "knowledge_base": [{
+                            "id": knowledge_base_id,
+                            "type": "file",
+                            "name": "presentation"
+                        }]
+                    }
+                }
+            }
+        }
+        return await self._post_json("elevenlabs.agent", "/v1/convai/agents/create", lambda: {"json": payload})
@@ -0,0 +1,57 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_shared_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop that lives for the whole process on a daemon thread.
+
+    Cloud Functions reuse warm instances across invocations, and HTTP
+    connection pools are bound to the loop they were opened on; running
+    every invocation on this loop instead of a fresh asyncio.run() loop
+    lets pooled connections and DNS lookups carry over.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="shared-event-loop", daemon=True).start()
+        return _loop
+
+
+def run(coro, timeout: Optional[float] = None):
+    """
+    Run a coroutine on the shared loop and block until it finishes, as a
+    drop-in for asyncio.run() in synchronous entry points. Context
+    variables (such as the current tracing span) are carried over.
+    """
+    loop = get_shared_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run() cannot be called from the shared event loop, await the coroutine instead")
+
+    result: Future = Future()
+
+    def on_done(task: asyncio.Task) -> None:
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def start() -> None:
+        loop.create_task(coro).add_done_callback(on_done)
+
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    return result.result(timeout)
@@ -1,18 +1,21 @@
-from firebase_admin import storage
-from google.cloud import storage as google_storage
 import os
-import requests
+import aiohttp
 from typing import Optional
-import functions_framework
 from datetime import datetime
 import json
+from storage_backend import as_storage, gcs_storage
+from tracing import trace_presentation
+from elevenlabs_client import ElevenLabsClient
+from retry_policy import HTTPStatusError
+from event_loop import run
 
 class KnowledgeBaseUploader:
-    def __init__(self):
-        """Initialize the uploader with ElevenLabs API key."""
+    def __init__(self, storage_client=None):
+        """Initialize the uploader with ElevenLabs API key and a storage backend."""
         self.api_key = os.getenv('ELEVEN_LABS_API_KEY')
-        self.base_url = "https://api.elevenlabs.io"
-        self.bucket = storage.bucket()
+        self.client = ElevenLabsClient(self.api_key)
+        self.base_url = self.client.base_url
+        self.storage = as_storage(storage_client) if storage_client is not None else gcs_storage()
         
     def upload_file(self, file_path: str) -> dict:
         """
@@ -27,32 +30,11 @@ class KnowledgeBaseUploader:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        endpoint = f"{self.base_url}/v1/convai/knowledge-base"
-        
-        headers = {
-            "xi-api-key": self.api_key
-        }
-        
-        # Open and prepare the file for upload
-        with open(file_path, 'rb') as f:
-            files = {
-                'file': (os.path.basename(file_path), f, 'text/plain')
-            }
-            
-            try:
-                response = requests.post(
-                    endpoint,
-                    headers=headers,
-                    files=files
-                )
-                response.raise_for_status()
-                return response.json()
-                
-            except requests.exceptions.RequestException as e:
-                print(f"Error uploading file: {e}")
-                if response.text:
-                    print(f"Response: {response.text}")
-                raise
+        try:
+            return run(self.client.upload_knowledge_base_file(file_path))
+        except (aiohttp.ClientError, HTTPStatusError) as e:
+            print(f"Error uploading file: {e}")
+            raise
 
     def upload_file_from_json(self, json_data: dict) -> dict:
         """
@@ -64,26 +46,10 @@ class KnowledgeBaseUploader:
         Returns:
             Response JSON from the API
         """
-        endpoint = f"{self.base_url}/v1/convai/knowledge-base"
-        
-        headers = {
-            "xi-api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
         try:
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=json_data
-            )
-            response.raise_for_status()
-            return response.json()
-                
-        except requests.exceptions.RequestException as e:
+            return run(self.client.upload_knowledge_base_json(json_data))
+        except (aiohttp.ClientError, HTTPStatusError) as e:
             print(f"Error uploading knowledge base: {e}")
-            if response.text:
-                print(f"Response: {response.text}")
             raise
 
     def create_agent_from_knowledge_base(self, knowledge_base_id: str, name: Optional[str] = None) -> dict:
@@ -97,42 +63,10 @@ class KnowledgeBaseUploader:
         Returns:
             Response JSON from the API containing the created agent details
         """
-        endpoint = f"{self.base_url}/v1/convai/agents/create"
-        
-        headers = {
-            "xi-api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
-        # Prepare the request payload
-        payload = {
-            "name": name or f"Agent for KB {knowledge_base_id}",
-            "conversation_config": {
-                "agent": {
-                    "prompt": {
-                        "knowledge_base": [{
-                            "id": knowledge_base_id,
-                            "type": "file",
-                            "name": "presentation"
-                        }]
-                    }
-                }
-            }
-        }
-        
         try:
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.RequestException as e:
+            return run(self.client.create_agent(knowledge_base_id, name=name))
+        except (aiohttp.ClientError, HTTPStatusError) as e:
             print(f"Error creating agent: {e}")
-            if hasattr(e, 'response') and e.response.text:
-                print(f"Response: {e.response.text}")
             raise
 
 def handle_knowledge_base_upload_from_request(request):
@@ -140,54 +74,50 @@ def handle_knowledge_base_upload_from_request(request):
 
     request_json = request.get_json()
     script_file_path = request_json['script_file_path']  # Path in Cloud Storage
-    handle_knowledge_base_upload(script_file_path, storage_client=storage.bucket("presentable-b5545.firebasestorage.app"))
+    handle_knowledge_base_upload(script_file_path, storage_client=gcs_storage("presentable-b5545.firebasestorage.app"))
 
 def handle_knowledge_base_upload_from_bucket_trigger(event):
     """Cloud Function entry point for knowledge base upload"""
     # Get file path from event
     bucket_name = event.bucket
     file_path = event.name
-    bucket = storage.bucket(bucket_name)
 
-    handle_knowledge_base_upload(file_path, storage_client=bucket)
+    handle_knowledge_base_upload(file_path, storage_client=gcs_storage(bucket_name))
 
 
 def handle_knowledge_base_upload(script_file_path: str, storage_client):
     """Cloud Function entry point for knowledge base upload"""
     try:
-        presentation_id = os.path.splitext(os.path.basename(pdf_path))[0]
-        
-        # Get the script data from Cloud Storage
-        blob = storage_client.blob(script_file_path)
-        json_data = json.loads(blob.download_as_string())
+        storage_client = as_storage(storage_client)
+        # Scripts live at presentations/<presentation_id>/script.json
+        presentation_id = os.path.basename(os.path.dirname(script_file_path))
+        with trace_presentation(presentation_id, name="knowledge_base"):
+            # Get the script data from Cloud Storage
+            json_data = storage_client.read_json(script_file_path)
         
-        # Upload to ElevenLabs
-        uploader = KnowledgeBaseUploader()
-        kb_response = uploader.upload_file_from_json(json_data)
+            # Upload to ElevenLabs
+            uploader = KnowledgeBaseUploader(storage_client)
+            kb_response = uploader.upload_file_from_json(json_data)
         
-        # Create agent if knowledge base upload successful
-        if kb_response and 'id' in kb_response:
-            agent_response = uploader.create_agent_from_knowledge_base(
-                kb_response['id'],
-                name=presentation_id
-            )
+            # Create agent if knowledge base upload successful
+            if kb_response and 'id' in kb_response:
+                agent_response = uploader.create_agent_from_knowledge_base(
+                    kb_response['id'],
+                    name=presentation_id
+                )
             
-            # Store a reference to the original JSON in Cloud Storage
-            reference_path = f"knowledge_base/{kb_response['id']}/source.json"
-            reference_blob = uploader.bucket.blob(reference_path)
-            reference_blob.upload_from_string(
-                json.dumps(json_data),
-                content_type='application/json'
-            )
+                # Store a reference to the original JSON in Cloud Storage
+                reference_path = f"knowledge_base/{kb_response['id']}/source.json"
+                uploader.storage.write_json(reference_path, json_data)
             
-            return {
-                'success': True,
-                'knowledge_base': kb_response,
-                'agent': agent_response,
-                'reference_path': reference_path
-            }, 200
+                return {
+                    'success': True,
+                    'knowledge_base': kb_response,
+                    'agent': agent_response,
+                    'reference_path': reference_path
+                }, 200
             
-        return {'error': 'Failed to upload knowledge base'}, 500
+            return {'error': 'Failed to upload knowledge base'}, 500
         
     except Exception as e:
         return {'error': str(e)}, 500
@@ -0,0 +1,517 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+from concurrency import AdaptiveLimiter, TokenBudget
+from retry_policy import RetryableError
+from tracing import span
+
+_claude_clients = {}  # API key -> AsyncAnthropic
+_claude_clients_lock = threading.Lock()
+
+# Anthropic prompt-caching breakpoint; the prefix up to and including a
+# block marked with it is reused by later requests for about 5 minutes
+EPHEMERAL_CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class TruncatedResponseError(RetryableError):
+    """A response stopped at max_tokens, so its text is incomplete."""
+
+    def __init__(self, message: str, max_tokens: int):
+        super().__init__(message, reason="max_tokens")
+        self.max_tokens = max_tokens
+
+
+def cached_system(*texts: str) -> list:
+    """
+    System prompt as text blocks, each ending in a prompt-caching
+    breakpoint. Put the most widely shared text first: a static prompt,
+    then context shared by the calls for one deck.
+    """
+    return [{"type": "text", "text": text, "cache_control": EPHEMERAL_CACHE_CONTROL} for text in texts]
+
+
+def _system_for_key(system: Union[str, list]):
+    """The system prompt without caching breakpoints, which do not change the response."""
+    if isinstance(system, str):
+        return system
+    blocks = [{k: v for k, v in block.items() if k != "cache_control"} for block in system]
+    if len(blocks) == 1 and set(blocks[0]) == {"type", "text"}:
+        # Same key as the plain-string prompt
+        return blocks[0]["text"]
+    return blocks
+
+
+def make_cache_key(model: str, system: Union[str, list], messages: list) -> str:
+    """
+    Build a content-addressed key for a Claude request.
+
+    The key is a SHA-256 over the model name, the system prompt and the
+    message list (which carries the slide text), so the same deck sent
+    through the same prompt always maps to the same entry.
+    """
+    payload = json.dumps(
+        {"model": model, "system": _system_for_key(system), "messages": messages},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache, bounded by entry count and optional TTL."""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCacheBackend:
+    """
+    Local-directory cache, one JSON file per key.
+
+    Reads touch the file so the oldest mtime is the least recently used
+    entry; writes evict from that end, down to 90% of max_bytes, once the
+    directory grows past max_bytes. Each write goes through its own temp
+    file, so threads and processes writing the same key do not clobber
+    each other's partial file. The directory is only listed when a
+    running estimate of its size (this instance's writes on top of the
+    last listing) passes max_bytes, not on every write.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, ttl_seconds: Optional[float] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._estimated_bytes = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl_seconds is not None and time.time() - entry["created_at"] > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["value"]
+
+    def set(self, key: str, value: str) -> None:
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created_at": time.time(), "value": value}, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            if self._estimated_bytes is None:
+                self._estimated_bytes = self._evict()
+            else:
+                self._estimated_bytes += size
+                if self._estimated_bytes > self.max_bytes:
+                    self._estimated_bytes = self._evict()
+
+    def _evict(self) -> int:
+        """If the directory is past max_bytes, remove least recently used entries; return its size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return total
+        # Trim below max_bytes so the next few writes do not list the directory again
+        target = self.max_bytes * 0.9
+        entries.sort()
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+
+class BucketCacheBackend:
+    """
+    Cache stored as objects under a bucket prefix, shared by every instance.
+
+    Works with any StorageBackend. TTL is checked on read. Each write
+    prunes with probability 1/prune_every, so cleanup does not depend on
+    one instance making many writes (the storage trigger builds a backend
+    per invocation): objects older than the TTL are deleted, then the
+    oldest ones past max_entries. A bucket lifecycle rule on the prefix
+    (see the README) bounds it too.
+    """
+
+    def __init__(
+        self,
+        storage,
+        prefix: str = "cache/claude",
+        max_entries: int = 10000,
+        ttl_seconds: Optional[float] = 30 * 24 * 3600,
+        prune_every: int = 100,
+        seed: Optional[int] = None
+    ):
+        self.storage = storage
+        self.prefix = prefix.rstrip("/")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._random = random.Random(seed)
+
+    def _path(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            entry = self.storage.read_json(path)
+        except Exception:
+            return None
+        if self.ttl_seconds is not None and time.time() - entry["created_at"] > self.ttl_seconds:
+            try:
+                self.storage.delete(path)
+            except Exception:
+                pass
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: str) -> None:
+        self.storage.write_json(self._path(key), {"created_at": time.time(), "value": value})
+        if self._random.random() * self.prune_every < 1:
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete expired entries, then the oldest past max_entries. Returns how many were deleted."""
+        objects = sorted(self.storage.list_objects(f"{self.prefix}/"), key=lambda o: o.updated)
+        # Every write stamps created_at afresh, so updated matches it
+        expired = 0
+        if self.ttl_seconds is not None:
+            cutoff = time.time() - self.ttl_seconds
+            while expired < len(objects) and objects[expired].updated < cutoff:
+                expired += 1
+        stale = objects[:max(expired, len(objects) - self.max_entries)]
+        for stored_object in stale:
+            try:
+                self.storage.delete(stored_object.path)
+            except Exception:
+                pass
+        return len(stale)
+
+
+class ResponseCache:
+    """Wraps a backend and keeps hit/miss counters for reporting."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"Response cache read failed for {key}: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"Response cache write failed for {key}: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        avg_miss_seconds = self.miss_seconds / self.misses if self.misses else 0.0
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_miss_seconds": avg_miss_seconds,
+            "estimated_seconds_saved": avg_miss_seconds * self.hits
+        }
+
+
+class TokenUsage:
+    """
+    Token totals over the Claude calls of one run, including the
+    prompt-cache reads and writes the API reports.
+    """
+
+    FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, usage) -> dict:
+        """Add one response's usage and return it as a dict."""
+        values = {field: getattr(usage, field, None) or 0 for field in self.FIELDS}
+        with self._lock:
+            self.calls += 1
+            for field, value in values.items():
+                self.totals[field] += value
+        return values
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self.totals)
+            calls = self.calls
+        prompt_tokens = totals["input_tokens"] + totals["cache_creation_input_tokens"] + totals["cache_read_input_tokens"]
+        return {
+            "calls": calls,
+            **totals,
+            "cache_read_share": round(totals["cache_read_input_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+        }
+
+
+def get_claude_client(api_key: Optional[str] = None):
+    """
+    AsyncAnthropic client for api_key (ANTHROPIC_API_KEY by default),
+    created on first use and kept for the life of the instance, so warm
+    invocations skip the SDK import and client setup and reuse its
+    connections. Meant for the shared event loop (event_loop.run) its
+    connections are bound to. SDK retries are off; callers retry
+    through retry_policy.RetryPolicy.
+    """
+    api_key = api_key or os.environ.get("ANTHROPIC_API_KEY")
+    with _claude_clients_lock:
+        client = _claude_clients.get(api_key)
+        if client is None:
+            from anthropic import AsyncAnthropic
+            client = AsyncAnthropic(api_key=api_key, max_retries=0)
+            _claude_clients[api_key] = client
+        return client
+
+
+def preload_claude_client() -> None:
+    """
+    Create the get_claude_client() client on a background thread. The
+    anthropic import takes a second or more, which a cold start can
+    overlap with downloading and extracting the PDF.
+    """
+    if os.environ.get("ANTHROPIC_API_KEY") not in _claude_clients:
+        threading.Thread(target=get_claude_client, name="preload-claude-client", daemon=True).start()
+
+
+class BudgetedClaudeClient:
+    """
+    Wraps an AsyncAnthropic client so every messages.create call, from
+    whichever presentation, goes through one concurrency limiter and the
+    shared input/output tokens-per-minute budgets. Other attributes are
+    passed through to the wrapped client.
+
+    Input tokens are charged from an estimate before the call and output
+    tokens as max_tokens; both are settled against the reported usage
+    afterwards.
+    """
+
+    def __init__(
+        self,
+        client,
+        limiter: AdaptiveLimiter,
+        input_budget: Optional[TokenBudget] = None,
+        output_budget: Optional[TokenBudget] = None
+    ):
+        self.client = client
+        self.limiter = limiter
+        self.input_budget = input_budget
+        self.output_budget = output_budget
+        self.messages = _BudgetedMessages(self)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def stats(self) -> dict:
+        limiter_stats = self.limiter.stats()
+        limiter_stats.pop("per_request")
+        return {
+            "limiter": limiter_stats,
+            "input_budget": self.input_budget.stats() if self.input_budget else None,
+            "output_budget": self.output_budget.stats() if self.output_budget else None
+        }
+
+
+class _BudgetedMessages:
+    def __init__(self, owner: BudgetedClaudeClient):
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._owner.client.messages, name)
+
+    async def create(self, **kwargs):
+        owner = self._owner
+        estimated_input = len(json.dumps(
+            [kwargs.get("system"), kwargs.get("messages")], ensure_ascii=False, default=str
+        )) // 4
+        max_tokens = kwargs.get("max_tokens", 0)
+        if owner.input_budget is not None:
+            await owner.input_budget.acquire(estimated_input)
+        if owner.output_budget is not None:
+            await owner.output_budget.acquire(max_tokens)
+
+        async with owner.limiter.slot(units=max_tokens) as slot:
+            try:
+                response = await owner.client.messages.create(**kwargs)
+            except Exception as e:
+                slot.status = getattr(e, "status_code", None)
+                if owner.output_budget is not None:
+                    owner.output_budget.adjust(-max_tokens)
+                raise
+            slot.status = 200
+            usage = getattr(response, "usage", None)
+            output_tokens = getattr(usage, "output_tokens", None) or 0
+            # Latency scales with what was generated, not with the cap
+            slot.units = max(output_tokens, 1)
+
+        if owner.input_budget is not None:
+            actual_input = (getattr(usage, "input_tokens", None) or 0) + \
+                (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            owner.input_budget.adjust(actual_input - estimated_input)
+        if owner.output_budget is not None:
+            owner.output_budget.adjust(output_tokens - max_tokens)
+        return response
+
+
+async def create_message_text(
+    claude_client,
+    response_cache: Optional[ResponseCache],
+    model: str,
+    max_tokens: int,
+    system: Union[str, list],
+    messages: list,
+    is_cacheable: Optional[Callable[[str], bool]] = None,
+    token_usage: Optional[TokenUsage] = None,
+    store: bool = True,
+    refresh: bool = False,
+    cache_key: Optional[str] = None
+) -> str:
+    """
+    Call claude_client.messages.create and return the first text block,
+    serving it from response_cache when the same request was seen before.
+
+    system may be a list of blocks carrying prompt-caching breakpoints
+    (see cached_system); the prompt-cache reads and writes of each call
+    are recorded on its span and added to token_usage when given.
+    Responses rejected by is_cacheable are returned but not stored, so a
+    retry after a validation failure goes back to the model. With
+    store=False nothing is stored, for callers that check the response
+    further before storing it themselves. A response cut off at
+    max_tokens is neither stored nor returned: it raises
+    TruncatedResponseError, which RetryPolicy retries.
+    refresh skips the lookup, for a retry whose cached response was bad.
+    cache_key replaces the key made from the whole request, for callers
+    that leave context out of it (see pdf_processor.narrative_cache_key).
+    """
+    with span("claude.messages", model=model, max_tokens=max_tokens) as call_span:
+        key = None
+        if response_cache is not None:
+            key = cache_key or make_cache_key(model, system, messages)
+        if key is not None and not refresh:
+            cached = await asyncio.to_thread(response_cache.get, key)
+            if cached is not None:
+                call_span.set(cache_hit=True, output_chars=len(cached))
+                return cached
+
+        started = time.monotonic()
+        response = await claude_client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages,
+            system=system
+        )
+        text = response.content[0].text
+        usage = getattr(response, "usage", None)
+        stop_reason = getattr(response, "stop_reason", None)
+        if token_usage is not None:
+            token_usage.record(usage)
+        call_span.set(
+            cache_hit=False,
+            latency_ms=round((time.monotonic() - started) * 1000, 1),
+            input_tokens=getattr(usage, "input_tokens", None),
+            output_tokens=getattr(usage, "output_tokens", None),
+            cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None),
+            cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None),
+            stop_reason=stop_reason,
+            output_chars=len(text)
+        )
+
+        if response_cache is not None:
+            response_cache.miss_seconds += time.monotonic() - started
+        if stop_reason == "max_tokens":
+            call_span.set(cached_response=False)
+            raise TruncatedResponseError(f"Response cut off at max_tokens={max_tokens}", max_tokens)
+        if response_cache is not None:
+            if not store or (is_cacheable is not None and not is_cacheable(text)):
+                call_span.set(cached_response=False)
+                return text
+            await asyncio.to_thread(response_cache.set, key, text)
+        return text
+
@@ -1,14 +1,13 @@
 import os
 from dotenv import load_dotenv
-from firebase_functions import https_fn, storage_fn, options
-from firebase_admin import initialize_app, storage
-import google.cloud.storage
+from firebase_functions import https_fn, scheduler_fn, storage_fn, options
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Firebase app
-app = initialize_app()
+# Everything else is imported inside the handlers, so an instance only
+# loads what its function needs; the Firebase app is initialized on first
+# use by storage_backend.gcs_storage
 
 @https_fn.on_request(region="us-east1")
 def upload_knowledge_base(req: https_fn.Request) -> https_fn.Response:
@@ -23,6 +22,9 @@ def process_tts(req: https_fn.Request) -> https_fn.Response:
     from tts_processor import handle_tts_request
     return handle_tts_request(req)
 
+# The SDK deploys storage triggers without event retries; turn them on for
+# this function at deploy time (see the README). Runs that fail or time
+# out are resumed by resume_stalled_uploads either way (see run_lease.RunLease)
 @storage_fn.on_object_finalized(region="us-east1", timeout_sec=350, memory=options.MemoryOption.GB_4)
 def process_uploaded_file(event: storage_fn.CloudEvent[storage_fn.StorageObjectData]) -> None:
     """Background Cloud Function triggered by a change to a Cloud Storage bucket."""
@@ -36,3 +38,9 @@ def process_uploaded_file(event: storage_fn.CloudEvent[storage_fn.StorageObjectD
         from knowledge_base import handle_knowledge_base_upload_from_bucket_trigger, handle_knowledge_base_upload_from_request
 
         handle_knowledge_base_upload_from_bucket_trigger(event.data)
+
+@scheduler_fn.on_schedule(schedule="every 10 minutes", region="us-east1", timeout_sec=350, memory=options.MemoryOption.GB_4)
+def resume_stalled_uploads(event: scheduler_fn.ScheduledEvent) -> None:
+    """Resume an uploaded PDF whose processing failed or was cut off."""
+    from pdf_processor import resume_stalled_runs
+    resume_stalled_runs()
@@ -0,0 +1,282 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+from tracing import current_span
+
+# MEMORY_BUDGET_MB: memory a presentation run may use before the pipeline
+# starts saving memory, by default the container's cgroup limit.
+# MEMORY_PROFILE_TRACEMALLOC=1 also traces Python allocations per stage and
+# lists the top allocation sites; it slows allocation-heavy code down, so
+# it is meant for profiling runs.
+MEMORY_BUDGET_ENV = "MEMORY_BUDGET_MB"
+TRACEMALLOC_ENV = "MEMORY_PROFILE_TRACEMALLOC"
+
+# Share of the budget in use at which the pipeline starts saving memory
+PRESSURE_THRESHOLD = 0.75
+# Minimum time between two load-shedding steps, so a burst of requests
+# seeing the same pressure does not shed all the way down at once
+SHED_INTERVAL_SECONDS = 2.0
+SAMPLE_INTERVAL_SECONDS = 0.05
+TOP_ALLOCATION_SITES = 5
+MB = 1024 * 1024
+
+_current_monitor = contextvars.ContextVar("current_memory_monitor", default=None)
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def peak_rss(children: bool = False) -> int:
+    """Peak RSS of this process, or of the largest finished child process."""
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _page_size
+    except (OSError, ValueError, IndexError):
+        # No /proc (e.g. macOS): the peak is the closest figure available
+        return peak_rss()
+
+
+def container_memory_limit() -> Optional[int]:
+    """Memory limit of the container from cgroup v2 or v1, None when unlimited."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "unlimited" as a huge number
+        if value.isdigit() and int(value) < 1 << 50:
+            return int(value)
+    return None
+
+
+def memory_budget() -> Optional[int]:
+    value = os.getenv(MEMORY_BUDGET_ENV)
+    if value:
+        return int(float(value) * MB)
+    return container_memory_limit()
+
+
+class StageMemory:
+    """RSS (and traced Python memory) at the start of one stage and the peak while it ran."""
+
+    def __init__(self, name: str, rss: int, traced: Optional[int]):
+        self.name = name
+        self.rss_start = rss
+        self.rss_peak = rss
+        self.traced_start = traced
+        self.traced_peak = traced
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def observe(self, rss: int, traced: Optional[int]) -> None:
+        self.rss_peak = max(self.rss_peak, rss)
+        if traced is not None and self.traced_peak is not None:
+            self.traced_peak = max(self.traced_peak, traced)
+
+    def to_dict(self) -> dict:
+        record = {
+            "rss_start_mb": round(self.rss_start / MB, 1),
+            "rss_peak_mb": round(self.rss_peak / MB, 1),
+            "rss_growth_mb": round((self.rss_peak - self.rss_start) / MB, 1),
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None
+        }
+        if self.traced_peak is not None:
+            record["traced_peak_mb"] = round(self.traced_peak / MB, 1)
+            record["traced_growth_mb"] = round((self.traced_peak - self.traced_start) / MB, 1)
+        return record
+
+
+class MemoryMonitor:
+    """
+    Samples RSS on a background thread for one presentation run and
+    attributes each sample to every stage open at the time. Stages can
+    overlap (script generation and TTS run together), so a stage's peak
+    is the process peak while it ran, and its growth is that peak minus
+    the RSS when it started.
+
+    With a budget, under_pressure() reports when RSS passes
+    PRESSURE_THRESHOLD of it; the pipeline then sheds concurrency or
+    switches to cheaper strategies and records what it did with
+    record_action().
+    """
+
+    def __init__(
+        self,
+        budget_bytes: Optional[int] = None,
+        trace_allocations: bool = False,
+        interval: float = SAMPLE_INTERVAL_SECONDS
+    ):
+        self.budget_bytes = budget_bytes
+        self.trace_allocations = trace_allocations
+        self.interval = interval
+        self.rss_start = current_rss()
+        self.rss_peak = self.rss_start
+        self.stages = []
+        self.actions = []
+        self.top_allocations = []
+        self._open = []
+        self._last_shed = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+        self._started_tracemalloc = False
+
+    def _sample(self) -> int:
+        rss = current_rss()
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        with self._lock:
+            self.rss_peak = max(self.rss_peak, rss)
+            for stage in self._open:
+                stage.observe(rss, traced)
+        return rss
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._sample()
+            self._stopped.wait(self.interval)
+
+    def start(self) -> None:
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self._sample()
+        if tracemalloc.is_tracing() and self.trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            self.top_allocations = [
+                {"site": str(stat.traceback), "size_mb": round(stat.size / MB, 2), "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATION_SITES]
+            ]
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str):
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        record = StageMemory(name, current_rss(), traced)
+        with self._lock:
+            self._open.append(record)
+        try:
+            yield record
+        finally:
+            self._sample()
+            record.seconds = time.perf_counter() - record.started
+            with self._lock:
+                self._open.remove(record)
+                self.stages.append(record)
+
+    def under_pressure(self) -> bool:
+        return self.budget_bytes is not None and self._sample() >= self.budget_bytes * PRESSURE_THRESHOLD
+
+    def should_shed(self) -> bool:
+        """under_pressure(), at most once per SHED_INTERVAL_SECONDS."""
+        now = time.monotonic()
+        if now - self._last_shed < SHED_INTERVAL_SECONDS or not self.under_pressure():
+            return False
+        self._last_shed = now
+        return True
+
+    def record_action(self, action: str) -> None:
+        rss_mb = current_rss() / MB
+        print(f"Memory at {rss_mb:.0f} MB of a {self.budget_bytes / MB:.0f} MB budget: {action}")
+        self.actions.append({"action": action, "rss_mb": round(rss_mb, 1)})
+
+    def report(self) -> dict:
+        stages = {}
+        for record in self.stages:
+            entry = record.to_dict()
+            previous = stages.get(record.name)
+            if previous is not None:
+                # Repeated stages report their worst run
+                entry = max(previous, entry, key=lambda e: e["rss_growth_mb"])
+                entry["count"] = previous.get("count", 1) + 1
+            stages[record.name] = entry
+        report = {
+            "rss_start_mb": round(self.rss_start / MB, 1),
+            "rss_peak_mb": round(self.rss_peak / MB, 1),
+            "children_peak_rss_mb": round(peak_rss(children=True) / MB, 1),
+            "budget_mb": round(self.budget_bytes / MB, 1) if self.budget_bytes else None,
+            "stages": stages,
+            "actions": self.actions
+        }
+        if self.top_allocations:
+            report["top_allocations"] = self.top_allocations
+        return report
+
+
+@contextmanager
+def track_memory(presentation_id: str, budget_bytes: Optional[int] = None, trace_allocations: Optional[bool] = None):
+    """
+    Profile memory for one presentation run. Stages marked with
+    memory_stage() or memory_profiled() inside it are recorded, and the
+    report is printed and set on the current span when it ends.
+    budget_bytes defaults to memory_budget(); trace_allocations to
+    MEMORY_PROFILE_TRACEMALLOC.
+    """
+    if trace_allocations is None:
+        trace_allocations = os.getenv(TRACEMALLOC_ENV) == "1"
+    monitor = MemoryMonitor(budget_bytes or memory_budget(), trace_allocations=trace_allocations)
+    token = _current_monitor.set(monitor)
+    monitor.start()
+    try:
+        yield monitor
+    finally:
+        monitor.stop()
+        _current_monitor.reset(token)
+        report = monitor.report()
+        print(f"Memory profile for {presentation_id}: {json.dumps(report)}")
+        run_span = current_span()
+        if run_span is not None:
+            run_span.set(rss_peak_mb=report["rss_peak_mb"], memory_actions=len(report["actions"]))
+
+
+def current_monitor() -> Optional[MemoryMonitor]:
+    return _current_monitor.get()
+
+
+@contextmanager
+def memory_stage(name: str):
+    """Record the enclosed block as a stage of the current run's memory profile, if one is tracked."""
+    monitor = _current_monitor.get()
+    if monitor is None:
+        yield None
+        return
+    with monitor.stage(name) as record:
+        yield record
+
+
+def memory_profiled(name: str):
+    """Decorator form of memory_stage() for sync functions and coroutines."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with memory_stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with memory_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,84 @@
+import re
+from typing import List, Optional
+
+# Slide <slide_number> (<slide_title>): "<slide_script>"
+# The title match is greedy up to the last "):" on the line so titles
+# containing parentheses survive; the script runs to the next header.
+SLIDE_HEADER = re.compile(r'^[ \t]*\**Slide[ \t]+(\d+)[ \t]*\((.*)\)[ \t]*:\**[ \t]*["“]', re.MULTILINE)
+CLOSING_QUOTES = ('"', '”')
+
+
+class NarrativeParseError(ValueError):
+    """Raised when narrative text does not follow the slide script grammar."""
+
+
+def parse_narrative(text: str, expected_slide_numbers: Optional[List[int]] = None) -> dict:
+    """
+    Parse generate_narrative_batch output into the {"slides": [...]} structure
+    that convert_to_json_batch would otherwise ask Claude to produce.
+
+    Args:
+        text: Narrative text in the 'Slide X (Title): "Script"' format
+        expected_slide_numbers: Slide numbers this batch was generated for.
+            The narrative must contain exactly that many slides, which are
+            numbered from this list.
+
+    Returns:
+        Dictionary with a "slides" list of slide/title/script entries
+
+    Raises:
+        NarrativeParseError: If the text cannot be parsed unambiguously
+    """
+    headers = list(SLIDE_HEADER.finditer(text))
+    if not headers:
+        raise NarrativeParseError("No slide headers found")
+
+    slides = []
+    for position, header in enumerate(headers):
+        end = headers[position + 1].start() if position + 1 < len(headers) else len(text)
+        body = text[header.end():end].rstrip()
+        if not body.endswith(CLOSING_QUOTES):
+            raise NarrativeParseError(f"Script for slide {header.group(1)} is not closed with a quote")
+        script = body[:-1].replace("\\n", "\n").strip()
+        title = header.group(2).strip()
+        if not title:
+            raise NarrativeParseError(f"Empty title for slide {header.group(1)}")
+        if not script:
+            raise NarrativeParseError(f"Empty script for slide {header.group(1)}")
+        slides.append({
+            "slide": int(header.group(1)),
+            "title": title,
+            "script": script
+        })
+
+    if expected_slide_numbers is not None:
+        if len(slides) != len(expected_slide_numbers):
+            raise NarrativeParseError(
+                f"Expected {len(expected_slide_numbers)} slides, found {len(slides)}"
+            )
+        for slide, slide_number in zip(slides, expected_slide_numbers):
+            slide["slide"] = slide_number
+
+    return {"slides": slides}
+
+
+class ParseStats:
+    """Counts how often the local parser handled a batch without Claude."""
+
+    def __init__(self):
+        self.parsed = 0
+        self.fallback = 0
+
+    def record(self, success: bool) -> None:
+        if success:
+            self.parsed += 1
+        else:
+            self.fallback += 1
+
+    def stats(self) -> dict:
+        total = self.parsed + self.fallback
+        return {
+            "parsed": self.parsed,
+            "fallback": self.fallback,
+            "success_rate": self.parsed / total if total else 0.0
+        }
@@ -0,0 +1,218 @@
+import hashlib
+import io
+import json
+import math
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+
+import PyPDF2
+
+from memory_profile import current_monitor, memory_stage
+from tracing import bind_context, span
+
+# Below this many uncached pages, extracting in-process beats pool start-up
+MIN_PAGES_FOR_POOL = 16
+CACHE_IO_THREADS = 16
+# Every worker process holds its own copy of the PDF and the reader, so the
+# pool stays small even where many CPUs are available
+MAX_POOL_WORKERS = 4
+
+_worker_reader = None
+_worker_mmap = None
+
+
+def _open_reader(source):
+    """
+    Open a PdfReader over bytes or a file path. Files are memory-mapped
+    rather than read into a buffer or copied to /tmp.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return PyPDF2.PdfReader(io.BytesIO(source)), None
+    with open(source, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PyPDF2.PdfReader(mapped), mapped
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may run on: its affinity mask, further limited by a
+    cgroup v2 or v1 CPU quota. os.cpu_count() reports the host's CPUs,
+    which in a container can be many times the instance's share.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    for quota_path, period_path in (
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    ):
+        try:
+            with open(quota_path) as f:
+                values = f.read().split()
+            if period_path is not None:
+                with open(period_path) as f:
+                    values.append(f.read().strip())
+            quota, period = int(values[0]), int(values[1])
+        except (OSError, ValueError, IndexError):
+            # Missing, or "max" / -1 for no quota
+            continue
+        if quota > 0 and period > 0:
+            cpus = min(cpus, max(1, math.ceil(quota / period)))
+            break
+    return max(1, cpus)
+
+
+def _init_worker(source) -> None:
+    global _worker_reader, _worker_mmap
+    _worker_reader, _worker_mmap = _open_reader(source)
+
+
+def _extract_pages(page_indices: List[int]) -> List[str]:
+    return [_worker_reader.pages[i].extract_text() for i in page_indices]
+
+
+def _canonical(obj, depth: int = 0) -> str:
+    """
+    Stable text form of a PDF object. Indirect references are resolved
+    (their repr embeds the reader's id) and streams are reduced to a hash.
+    """
+    if depth > 8:
+        return "..."
+    if isinstance(obj, PyPDF2.generic.IndirectObject):
+        obj = obj.get_object()
+    if isinstance(obj, PyPDF2.generic.StreamObject):
+        return f"stream:{hashlib.sha256(obj.get_data()).hexdigest()}"
+    if isinstance(obj, dict):
+        items = ",".join(f"{key}={_canonical(obj[key], depth + 1)}" for key in sorted(obj.keys()))
+        return "{" + items + "}"
+    if isinstance(obj, list):
+        return "[" + ",".join(_canonical(item, depth + 1) for item in obj) + "]"
+    return str(obj)
+
+
+def _page_fingerprint(page) -> str:
+    """
+    Hash what determines a page's extracted text: its content stream and
+    the fonts it references (name, encoding and ToUnicode map). Object ids
+    are left out so the same page in another PDF has the same fingerprint.
+    """
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+
+    resources = page.get("/Resources")
+    fonts = resources.get_object().get("/Font") if resources is not None else None
+    if fonts is not None:
+        fonts = fonts.get_object()
+        for name in sorted(fonts.keys()):
+            font = fonts[name].get_object()
+            digest.update(str(name).encode("utf-8"))
+            for key in ("/BaseFont", "/Encoding", "/ToUnicode"):
+                digest.update(_canonical(font.get(key)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _extract_uncached(source, reader, page_indices: List[int], max_workers: Optional[int]) -> List[str]:
+    if len(page_indices) < MIN_PAGES_FOR_POOL:
+        with span("pdf.extract_pages", pages=len(page_indices), workers=1):
+            return [reader.pages[i].extract_text() for i in page_indices]
+
+    workers = max_workers or min(available_cpus(), MAX_POOL_WORKERS)
+    # Every worker is a separate interpreter with its own copy of the reader
+    monitor = current_monitor()
+    if monitor is not None and workers > 1 and monitor.under_pressure():
+        workers = max(1, workers // 2)
+        monitor.record_action(f"PDF extraction limited to {workers} worker processes")
+    chunk_size = max(1, -(-len(page_indices) // (workers * 4)))
+    chunks = [page_indices[i:i + chunk_size] for i in range(0, len(page_indices), chunk_size)]
+    # spawn rather than fork: the parent may already hold gRPC/HTTP threads
+    with span("pdf.extract_pages", pages=len(page_indices), workers=workers, chunks=len(chunks)):
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(source,)
+        ) as pool:
+            return [text for chunk_texts in pool.map(_extract_pages, chunks) for text in chunk_texts]
+
+
+def extract_page_texts(source, text_cache=None, max_workers: Optional[int] = None) -> List[str]:
+    """
+    Extract the text of every page of a PDF.
+
+    Args:
+        source: PDF content as bytes, or a path to a local PDF file
+        text_cache: Optional ResponseCache for extracted text. The whole
+            document and each page are cached by content hash, so
+            re-uploads and pages shared between decks are not extracted again.
+        max_workers: Process pool size for uncached pages, defaults to the
+            CPUs available to the container, at most MAX_POOL_WORKERS
+
+    Returns:
+        List of page texts, one per page in order
+    """
+    with span("pdf.extract", source_bytes=len(source) if isinstance(source, (bytes, bytearray, memoryview)) else None) as extract_span, \
+            memory_stage("pdf.extract"):
+        texts = _extract_page_texts(source, text_cache, max_workers, extract_span)
+        extract_span.set(pages=len(texts), chars=sum(len(text) for text in texts))
+        return texts
+
+
+def _extract_page_texts(source, text_cache, max_workers: Optional[int], extract_span) -> List[str]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        document_key = f"document_{hashlib.sha256(source).hexdigest()}"
+    else:
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        document_key = f"document_{digest.hexdigest()}"
+
+    if text_cache is not None:
+        cached_document = text_cache.get(document_key)
+        if cached_document is not None:
+            extract_span.set(document_cache_hit=True)
+            return json.loads(cached_document)
+
+    reader, mapped = _open_reader(source)
+    try:
+        page_count = len(reader.pages)
+        texts = [None] * page_count
+        page_keys = [f"page_{_page_fingerprint(reader.pages[i])}" for i in range(page_count)]
+
+        if text_cache is not None:
+            with ThreadPoolExecutor(max_workers=CACHE_IO_THREADS) as io_pool:
+                for i, cached_text in enumerate(io_pool.map(bind_context(text_cache.get), page_keys)):
+                    texts[i] = cached_text
+
+        missing = [i for i in range(page_count) if texts[i] is None]
+        extract_span.set(document_cache_hit=False, page_cache_hits=page_count - len(missing))
+        if missing:
+            extracted = _extract_uncached(source, reader, missing, max_workers)
+            for i, text in zip(missing, extracted):
+                texts[i] = text or ""
+            if text_cache is not None:
+                with ThreadPoolExecutor(max_workers=CACHE_IO_THREADS) as io_pool:
+                    list(io_pool.map(bind_context(lambda i: text_cache.set(page_keys[i], texts[i])), missing))
+    finally:
+        del reader
+        if mapped is not None:
+            mapped.close()
+
+    if text_cache is not None:
+        text_cache.set(document_key, json.dumps(texts, ensure_ascii=False))
+    return texts
+
+
+def extract_slides(source, text_cache=None, max_workers: Optional[int] = None) -> List[str]:
+    """Text of every non-empty page, which is what the pipeline treats as a slide."""
+    return [
+        text
+        for text in extract_page_texts(source, text_cache=text_cache, max_workers=max_workers)
+        if text.strip()
+    ]
@@ -1,35 +1,60 @@
-from firebase_admin import storage
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import asyncio
 from datetime import datetime
 import json
 import os
+import time
 import traceback
-import PyPDF2
-from anthropic import AsyncAnthropic
 import argparse
 import aiohttp
-from pydub import AudioSegment
 import io
+from types import SimpleNamespace
 from dotenv import load_dotenv
+from llm_cache import (
+    BucketCacheBackend, DiskCacheBackend, ResponseCache, TokenUsage, TruncatedResponseError, cached_system,
+    create_message_text, get_claude_client, make_cache_key, preload_claude_client
+)
+from pdf_extract import extract_slides
+from tts_cache import CONTEXT_HASH_CHARS, SegmentAudioStore, make_segment_key
+from concurrency import AdaptiveLimiter, RequestSlot
+from retry_policy import HTTPStatusError, RetryableError, RetryPolicy, classify
+from memory_profile import current_monitor, memory_profiled, memory_stage, track_memory
+from audio_assembly import (
+    AUDIO_FORMATS, HLS_CONTENT_TYPE, Mp3Chunker, StreamingMp3Writer, StreamingWavWriter, build_timing_index,
+    export_segment, render_hls_playlist, transcode_wav_file
+)
+from narrative_parser import NarrativeParseError, ParseStats, parse_narrative
+from storage_backend import CheckpointWriter, LocalStorage, RunManifest, StorageNotFoundError, as_storage, gcs_storage
+from tracing import span, trace_presentation, traced
+from script_stream import ReadyParagraph, ScriptStream
+from elevenlabs_client import ElevenLabsClient
+from event_loop import run
+from run_lease import RunInProgressError, RunLease, stalled_runs
+from slide_batching import batch_id_for, json_max_tokens_for, plan_batches, retry_max_tokens
 
 load_dotenv()
 
-async def generate_narrative_batch(
-    pdf_text: list[str],  # List of text content from 3 slides
-    start_slide_num: int,
-    claude_client,  # Anthropic API client
-    storage_client,
-    presentation_id: str
-) -> bool:
-    """
-    Generates narrative content for a batch of 3 slides and saves to storage.
-    Returns True if successful, False if needs retry.
-    """
-    SYSTEM_PROMPT = """
+# Format of the generated audio files, see process_audio
+DEFAULT_AUDIO_FORMAT = os.getenv("AUDIO_OUTPUT_FORMAT", "wav")
+# Length of the progressively published HLS chunks, 0 to turn publishing off
+DEFAULT_STREAM_CHUNK_SECONDS = float(os.getenv("AUDIO_STREAM_CHUNK_SECONDS", "6"))
+
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+# Claude JSON conversions of one narrative that may return invalid output
+# before the batch goes back to have its narrative regenerated. Transport
+# errors get the retry policy's usual attempts.
+JSON_MAX_ATTEMPTS = 2
+# Retry reasons for output that failed validation or was cut off, which
+# regenerating the narrative can fix
+INVALID_OUTPUT_REASONS = ("invalid_json", "max_tokens")
+
+# System prompts are identical for every batch of every deck and are sent
+# with prompt-caching breakpoints (see llm_cache.cached_system); anything
+# that varies per batch goes in the user message
+SYSTEM_PROMPT = """
     You are a distinguished professor teaching medicine to residents at Harvard. You are known for your friendly tone and uncanny ability to make complex concepts entertaining and memorable while teaching. You have wonderful reviews from all of your students for your precise yet engaging teaching style.
 
-    Your task is to generate a presentation script from lecture slides. Process exactly 3 slides at a time, following this exact format for each slide:
+    Your task is to generate a presentation script from lecture slides. Process exactly the slides you are given, following this exact format for each slide:
 
     Slide <slide_number> (<slide_title>): "<slide_script>"
 
@@ -41,95 +66,13 @@ async def generate_narrative_batch(
     2. Use straight quotes (") not curly quotes
     3. Keep paragraph breaks within the script using \n
     4. Never break the slide format with additional text between slides
-    5. Never ask if you should continue - just process exactly 3 slides and stop
+    5. Never ask if you should continue - just process exactly the slides you are given and stop
     6. Maintain your engaging professorial tone while following these strict formatting requirements
 
     Remember to bring your friendly, engaging teaching style to each slide while maintaining this exact formatting structure.
     """
 
-    try:
-        # Prepare metadata
-        batch_id = f"batch_{start_slide_num}_slides_{start_slide_num}-{start_slide_num+2}"
-        metadata = {
-            "batch_metadata": {
-                "batch_id": batch_id,
-                "slide_range": {
-                    "start": start_slide_num,
-                    "end": start_slide_num + 2
-                },
-                "status": {
-                    "narrative": {
-                        "state": "in_progress",
-                        "attempts": 0,
-                        "last_updated": datetime.utcnow().isoformat()
-                    },
-                    "json": {
-                        "state": "pending",
-                        "validation": "pending",
-                        "attempts": 0,
-                        "last_updated": None
-                    }
-                }
-            }
-        }
-
-        # Call Claude with system prompt and slide content
-        narrative_response = await claude_client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4096,
-            messages=[{
-                "role": "user",
-                "content": f"Generate scripts for these 3 slides:\n\n{pdf_text}"
-            }],
-            system=SYSTEM_PROMPT
-        )
-
-        # Save narrative to storage
-        storage_path = f"presentations/{presentation_id}/intermediate_outputs/narrative/{batch_id}.txt"
-        target_blob = storage_client.blob(storage_path)
-        print(narrative_response.content[0].text)
-        target_blob.upload_from_string(narrative_response.content[0].text)
-        print(f"uploaded to {storage_path}")
-        # Update metadata
-        metadata["batch_metadata"]["status"]["narrative"].update({
-            "state": "completed",
-            "last_updated": datetime.utcnow().isoformat()
-        })
-        metadata_path = f"{storage_path}.metadata.json"
-        metadata_blob = storage_client.blob(metadata_path)
-        metadata_blob.upload_from_string(json.dumps(metadata))
-
-        return True
-
-    except Exception as e:
-        print(traceback.format_exc())
-        # Update metadata with failure
-        metadata["batch_metadata"]["status"]["narrative"].update({
-            "state": "failed",
-            "attempts": metadata["batch_metadata"]["status"]["narrative"]["attempts"] + 1,
-            "last_updated": datetime.utcnow().isoformat(),
-            "error": str(e)
-        })
-        metadata_path = f"{storage_path}.metadata.json"
-        metadata_blob = storage_client.blob(metadata_path)
-        metadata_blob.upload_from_string(json.dumps(metadata))
-        return False
-
-async def convert_to_json_batch(
-    narrative_text: str,
-    batch_id: str,
-    claude_client,
-    storage_client,
-    presentation_id: str
-) -> bool:
-    """
-    Converts narrative batch to JSON format and validates the output.
-    Returns True if successful, False if needs retry.
-    """
-    # Extract start slide number from batch_id
-    start_slide_num = int(batch_id.split("_")[1])
-    
-    JSON_CONVERSION_PROMPT = """
+JSON_CONVERSION_PROMPT = """
     Your task is to convert the following slide scripts into a strictly formatted JSON array. You must follow these validation rules exactly.
 
     Required format:
@@ -158,259 +101,576 @@ async def convert_to_json_batch(
 
     Return only valid JSON with no additional text or commentary.
     """
+
+# Characters of each slide's first line that go into the deck outline
+OUTLINE_LINE_CHARS = 120
+
+def build_deck_outline(pdf_slides: List[str]) -> str:
+    """
+    One line per slide of the whole deck. It is sent after SYSTEM_PROMPT
+    as a second cached block, so every batch of a deck shares the same
+    cacheable prefix and knows where its slides sit in the lecture.
+    """
+    lines = []
+    for n, text in enumerate(pdf_slides, start=1):
+        first_line = next((line.strip() for line in text.splitlines() if line.strip()), "")
+        lines.append(f"Slide {n}: {' '.join(first_line.split())[:OUTLINE_LINE_CHARS]}")
+    return (
+        "Outline of the whole lecture, one line per slide, for context only. "
+        "Only write scripts for the slides in the request.\n\n" + "\n".join(lines)
+    )
+
+def narrative_request(pdf_text: List[str], max_tokens: int = 4096, deck_outline: Optional[str] = None) -> dict:
+    """
+    Messages API parameters for a narrative batch, shared by the
+    synchronous calls and the bulk Message Batches submissions.
+    """
+    slide_count = f"{len(pdf_text)} slide{'' if len(pdf_text) == 1 else 's'}"
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": max_tokens,
+        "messages": [{
+            "role": "user",
+            "content": f"Generate scripts for these {slide_count}:\n\n{pdf_text}"
+        }],
+        "system": cached_system(SYSTEM_PROMPT, deck_outline) if deck_outline else cached_system(SYSTEM_PROMPT)
+    }
+
+def narrative_cache_key(request: dict) -> str:
+    """
+    Response-cache key of a narrative_request. Narratives are only stored
+    under it once they have been converted to valid JSON.
+    The deck outline is left out: it changes whenever any slide does, and
+    keying on it would regenerate every batch's narrative, and so its
+    audio, after a one-slide edit. A batch whose own slides are unchanged
+    keeps its narrative even if the slides around it were edited.
+    """
+    return make_cache_key(request["model"], request["system"][:1], request["messages"])
+
+def validate_script_json(json_data: dict, slide_count: Optional[int] = None) -> None:
+    """
+    Validates the {"slides": [...]} structure produced for a batch, and
+    that it holds slide_count slides when given.
+    Raises AssertionError describing the first problem found.
+    """
+    assert "slides" in json_data, "Missing 'slides' key"
+    assert isinstance(json_data["slides"], list), "'slides' must be an array"
+    if slide_count is not None:
+        assert len(json_data["slides"]) == slide_count, \
+            f"Expected {slide_count} slides, got {len(json_data['slides'])}"
+
+    for slide in json_data["slides"]:
+        assert all(k in slide for k in ["slide", "title", "script"]), "Missing required fields"
+        assert isinstance(slide["slide"], int), "Slide number must be integer"
+        assert isinstance(slide["title"], str) and slide["title"], "Invalid title"
+        assert isinstance(slide["script"], str) and slide["script"], "Invalid script"
+
+def is_valid_script_json(text: str, slide_count: Optional[int] = None) -> bool:
+    """Returns True if text parses as JSON and passes validate_script_json."""
     try:
-        # Initialize metadata
-        metadata = {
-            "batch_metadata": {
-                "batch_id": batch_id,
-                "status": {
-                    "json": {
-                        "state": "in_progress",
-                        "validation": "pending",
-                        "attempts": 0,
-                        "last_updated": datetime.utcnow().isoformat()
-                    }
-                }
-            }
-        }
-        
-        metadata_path = f"presentations/{presentation_id}/intermediate_outputs/narrative/{batch_id}.txt.metadata.json"
-        
-        # Try to load existing metadata if it exists
-        try:
-            metadata_blob = storage_client.blob(metadata_path)
-            existing_metadata = json.loads(metadata_blob.download_as_string().decode('utf-8'))
-            metadata["batch_metadata"]["status"]["json"]["attempts"] = existing_metadata["batch_metadata"]["status"]["json"]["attempts"]
-        except Exception:
-            # If metadata doesn't exist or can't be loaded, use the default initialized above
-            pass
+        validate_script_json(json.loads(text), slide_count)
+        return True
+    except (json.JSONDecodeError, AssertionError, TypeError):
+        return False
+
+async def generate_narrative_batch(
+    pdf_text: list[str],  # List of text content from the batch's slides
+    start_slide_num: int,
+    claude_client,  # Anthropic API client
+    checkpoints: CheckpointWriter,
+    presentation_id: str,
+    run_manifest: RunManifest,
+    response_cache: Optional[ResponseCache] = None,
+    max_tokens: int = 4096,
+    deck_outline: Optional[str] = None,
+    token_usage: Optional[TokenUsage] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    refresh: bool = False
+) -> Optional[str]:
+    """
+    Generates narrative content for a batch of slides.
+    max_tokens is sized by the caller from the batch's expected length; a
+    narrative cut off there is retried with twice the room.
+    SYSTEM_PROMPT and deck_outline (see build_deck_outline) are sent as
+    prompt-cached system blocks.
+    The narrative is checkpointed to storage in the background and batch
+    state is recorded in run_manifest.
+    Identical requests are served from response_cache when one is given,
+    unless refresh is set because the earlier narrative did not convert.
+    The narrative is not stored there: the caller stores it under
+    narrative_cache_key once it has converted.
+    Transient API errors are retried by retry_policy.
+    Returns the narrative text if successful, None if it failed.
+    """
+    batch_id = batch_id_for(start_slide_num - 1, len(pdf_text))
+    run_manifest.set_batch_info(batch_id, slide_range={
+        "start": start_slide_num,
+        "end": start_slide_num + len(pdf_text) - 1
+    })
+    retry_policy = retry_policy or RetryPolicy()
+    limit = max_tokens
 
+    async def attempt_narrative() -> str:
+        nonlocal limit
+        attempts = run_manifest.get_status(batch_id, "narrative").get("attempts", 0) + 1
+        run_manifest.update_status(batch_id, "narrative", state="in_progress", attempts=attempts)
+        # Call Claude with system prompt and slide content
+        with span("claude.narrative", batch_id=batch_id, attempt=attempts):
+            request = narrative_request(pdf_text, limit, deck_outline)
+            try:
+                return await create_message_text(
+                    claude_client,
+                    response_cache,
+                    **request,
+                    token_usage=token_usage,
+                    store=False,
+                    refresh=refresh,
+                    cache_key=narrative_cache_key(request)
+                )
+            except TruncatedResponseError:
+                limit = retry_max_tokens(limit)
+                raise
+
+    try:
+        narrative_text = await retry_policy.call("claude.narrative", attempt_narrative)
+
+        # Checkpoint narrative to storage
+        storage_path = f"presentations/{presentation_id}/intermediate_outputs/narrative/{batch_id}.txt"
+        print(narrative_text)
+        await checkpoints.write_text(storage_path, narrative_text)
+        run_manifest.update_status(batch_id, "narrative", state="completed", error=None)
+
+        return narrative_text
+
+    except Exception as e:
+        print(traceback.format_exc())
+        run_manifest.update_status(batch_id, "narrative", state="failed", error=str(e))
+        return None
+
+async def convert_to_json_batch(
+    narrative_text: str,
+    batch_id: str,
+    claude_client,
+    checkpoints: CheckpointWriter,
+    presentation_id: str,
+    run_manifest: RunManifest,
+    response_cache: Optional[ResponseCache] = None,
+    max_tokens: Optional[int] = None,
+    token_usage: Optional[TokenUsage] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    slide_count: Optional[int] = None
+) -> Optional[dict]:
+    """
+    Converts narrative batch to JSON format and validates the output,
+    including that it has slide_count slides when given.
+    max_tokens defaults to a limit sized from the narrative's length
+    (see slide_batching.json_max_tokens_for); output cut off there counts
+    as invalid and is retried with twice the room.
+    The JSON is checkpointed to storage in the background and batch state
+    is recorded in run_manifest.
+    Only responses that pass validation are stored in response_cache.
+    retry_policy retries transient API errors as it does any call, and
+    output that fails validation up to JSON_MAX_ATTEMPTS times.
+    Returns the validated JSON if successful, or None if the output was
+    still invalid, so the caller regenerates the narrative. Any other
+    error is raised.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    limit = max_tokens or json_max_tokens_for(narrative_text)
+
+    async def attempt_conversion() -> dict:
+        nonlocal limit
+        attempts = run_manifest.get_status(batch_id, "json").get("attempts", 0) + 1
+        run_manifest.update_status(batch_id, "json", state="in_progress", validation="pending", method="llm", attempts=attempts)
         # Call Claude for JSON conversion
-        json_response = await claude_client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4096,
-            messages=[{
-                "role": "user",
-                "content": f"Convert this to JSON:\n\n{narrative_text}"
-            }],
-            system=JSON_CONVERSION_PROMPT
-        )
+        with span("claude.json", batch_id=batch_id, attempt=attempts):
+            try:
+                json_text = await create_message_text(
+                    claude_client,
+                    response_cache,
+                    model=CLAUDE_MODEL,
+                    max_tokens=limit,
+                    messages=[{
+                        "role": "user",
+                        "content": f"Convert this to JSON:\n\n{narrative_text}"
+                    }],
+                    system=cached_system(JSON_CONVERSION_PROMPT),
+                    is_cacheable=lambda text: is_valid_script_json(text, slide_count),
+                    token_usage=token_usage
+                )
+            except TruncatedResponseError:
+                limit = retry_max_tokens(limit)
+                raise
 
-        # Validate JSON structure
+        # Validate JSON structure; invalid output is worth another sample
         try:
-            json_data = json.loads(json_response.content[0].text)
-            
-            # Basic validation
-            assert "slides" in json_data, "Missing 'slides' key"
-            assert isinstance(json_data["slides"], list), "'slides' must be an array"
-            
-            for slide in json_data["slides"]:
-                assert all(k in slide for k in ["slide", "title", "script"]), "Missing required fields"
-                assert isinstance(slide["slide"], int), "Slide number must be integer"
-                assert isinstance(slide["title"], str) and slide["title"], "Invalid title"
-                assert isinstance(slide["script"], str) and slide["script"], "Invalid script"
-
-            # Save validated JSON
-            json_path = f"presentations/{presentation_id}/intermediate_outputs/json/{batch_id}.json"
-            json_blob = storage_client.blob(json_path)
-            json_blob.upload_from_string(json.dumps(json_data, ensure_ascii=False, indent=2))
-
-            # Update metadata
-            metadata["batch_metadata"]["status"]["json"].update({
-                "state": "completed",
-                "validation": "passed",
-                "last_updated": datetime.utcnow().isoformat()
-            })
-            metadata_blob = storage_client.blob(metadata_path)
-            metadata_blob.upload_from_string(json.dumps(metadata))
+            json_data = json.loads(json_text)
+            validate_script_json(json_data, slide_count)
+        except (json.JSONDecodeError, AssertionError) as e:
+            raise RetryableError(f"JSON validation failed: {str(e)}", reason="invalid_json")
+        return json_data
 
-            return True
+    try:
+        json_data = await retry_policy.call(
+            "claude.json",
+            attempt_conversion,
+            reason_attempts={reason: JSON_MAX_ATTEMPTS for reason in INVALID_OUTPUT_REASONS}
+        )
 
-        except (json.JSONDecodeError, AssertionError) as e:
-            raise ValueError(f"JSON validation failed: {str(e)}")
+        # Checkpoint validated JSON
+        json_path = f"presentations/{presentation_id}/intermediate_outputs/json/{batch_id}.json"
+        await checkpoints.write_json(json_path, json_data, indent=2)
+        run_manifest.update_status(batch_id, "json", state="completed", validation="passed", error=None)
+        return json_data
 
     except Exception as e:
-        # Update metadata with failure
-        metadata["batch_metadata"]["status"]["json"].update({
-            "state": "failed",
-            "validation": "failed",
-            "attempts": metadata["batch_metadata"]["status"]["json"]["attempts"] + 1,
-            "last_updated": datetime.utcnow().isoformat(),
-            "error": str(e)
-        })
-        metadata_blob = storage_client.blob(metadata_path)
-        metadata_blob.upload_from_string(json.dumps(metadata))
-        return False
+        run_manifest.update_status(batch_id, "json", state="failed", validation="failed", error=str(e))
+        if classify(e)[1] not in INVALID_OUTPUT_REASONS:
+            # Regenerating the narrative will not get past e.g. a rejected
+            # request or a provider that is still down
+            raise
+        return None
 
-async def process_presentation(
+async def parse_narrative_batch(
+    narrative_text: str,
+    batch_id: str,
+    expected_slide_numbers: List[int],
+    checkpoints: CheckpointWriter,
+    presentation_id: str,
+    run_manifest: RunManifest
+) -> Optional[dict]:
+    """
+    Converts narrative batch to JSON with the local parser instead of Claude.
+    Saves the JSON and records state the same way convert_to_json_batch does.
+    Returns the validated JSON if successful, None if the LLM conversion should be used.
+    """
+    with span("parse.narrative", batch_id=batch_id) as parse_span:
+        try:
+            json_data = parse_narrative(narrative_text, expected_slide_numbers)
+            validate_script_json(json_data, len(expected_slide_numbers))
+            parse_span.set(parsed=True)
+        except (NarrativeParseError, AssertionError) as e:
+            parse_span.set(parsed=False, reason=str(e))
+            print(f"Local parser could not handle {batch_id}, falling back to Claude: {e}")
+            return None
+
+    # Checkpoint validated JSON
+    json_path = f"presentations/{presentation_id}/intermediate_outputs/json/{batch_id}.json"
+    await checkpoints.write_json(json_path, json_data, indent=2)
+    run_manifest.update_status(batch_id, "json", state="completed", validation="passed", method="parser", error=None)
+    return json_data
+
+@traced("script.generate")
+@memory_profiled("script.generate")
+async def generate_script(
     presentation_id: str,
     pdf_slides: List[str],  # List of text content from all slides
     claude_client,
-    storage_client
-) -> Optional[str]:
+    storage_client,
+    response_cache: Optional[ResponseCache] = None,
+    narrative_concurrency: int = 5,
+    json_concurrency: int = 5,
+    script_stream: Optional[ScriptStream] = None,
+    source_generation: Optional[str] = None,
+    fixed_batch_size: Optional[int] = None,
+    deck_context: bool = True,
+    prepared_narratives: Optional[Dict[int, str]] = None,
+    retry_policy: Optional[RetryPolicy] = None
+) -> Optional[dict]:
     """
-    Main orchestration function for processing slides and generating the final script.
-    Returns the path to the final script.json if successful, None if failed.
+    Generates the presentation script for all slides.
+    Claude responses are reused from response_cache when one is given.
+
+    Batches flow through a two-stage pipeline: narrative workers feed a queue
+    that JSON conversion workers drain, each stage with its own concurrency
+    limit. Narratives are converted with the local parser when they follow
+    the slide grammar and with Claude otherwise. Claude calls are retried
+    by retry_policy (see retry_policy.RetryPolicy; one is created for the
+    run when not given), and a batch whose JSON conversion keeps failing
+    is sent back to the narrative stage to be regenerated, bypassing
+    response_cache, up to 2 times while the policy's retry budget lasts.
+    Narratives are only stored in response_cache once they have converted.
+
+    Stage outputs are handed over in memory. Intermediate files and
+    script.json are written as background checkpoints, which are drained
+    before returning, and batch state goes into a run manifest.
+    Each validated batch is also pushed to script_stream when one is given,
+    so audio synthesis can start before the whole script is done; the
+    stream is closed on success and failed otherwise.
+
+    When source_generation identifies the uploaded PDF, batches that an
+    earlier run over the same generation completed are loaded from their
+    checkpoints instead of being regenerated, and batches whose narrative
+    was saved resume at JSON conversion. Only failed work is redone.
+    Slides are packed into batches by estimated token counts (see
+    slide_batching.plan_batches), and each Claude call's max_tokens is
+    sized for its batch; fixed_batch_size gives fixed-length batches.
+    With deck_context, narrative calls also get an outline of the whole
+    deck as a shared prompt-cached block. The outline is not part of the
+    narrative cache key (see narrative_cache_key).
+    prepared_narratives maps a batch's first slide index to a narrative
+    generated elsewhere (the bulk Message Batches path); those batches
+    start at JSON conversion and the rest are generated as usual.
+    Returns the final script if successful, None if failed.
     """
-    
-    async def process_batch(start_idx: int, batch_slides: List[str]) -> bool:
-        batch_id = f"batch_{start_idx+1}_slides_{start_idx+1}-{start_idx+3}"
-        
-        # Step 1: Generate narrative with retries
-        narrative_success = False
-        for attempt in range(2):  # Try narrative generation twice
-            narrative_success = await generate_narrative_batch(
-                pdf_text=batch_slides,
-                start_slide_num=start_idx + 1,
-                claude_client=claude_client,
-                storage_client=storage_client,
-                presentation_id=presentation_id
-            )
-            if narrative_success:
-                break
-        
-        if not narrative_success:
-            print(f"Failed to generate narrative for batch {batch_id} after 2 attempts")
-            return False
-
-        # Get narrative text for JSON conversion
-        narrative_path = f"presentations/{presentation_id}/intermediate_outputs/narrative/{batch_id}.txt"
-        blob = storage_client.blob(narrative_path)
-        narrative_text = blob.download_as_string().decode('utf-8')
-
-        # Step 2: Convert to JSON with retries
-        json_success = False
-        for attempt in range(2):  # Try JSON conversion twice
-            json_success = await convert_to_json_batch(
-                narrative_text=narrative_text,
-                batch_id=batch_id,
-                claude_client=claude_client,
-                storage_client=storage_client,
-                presentation_id=presentation_id
-            )
-            if json_success:
-                break
+    MAX_REGENERATIONS = 2
 
-        if not json_success:
-            # Try regenerating both narrative and JSON
-            for attempt in range(2):
-                narrative_success = await generate_narrative_batch(
+    storage = as_storage(storage_client)
+    checkpoints = CheckpointWriter(storage)
+    run_manifest = RunManifest(storage, presentation_id, source_generation=source_generation)
+    await asyncio.to_thread(run_manifest.load)
+
+    planned_batches = plan_batches(pdf_slides, fixed_size=fixed_batch_size)
+    batches = [(batch.start_idx, batch.slides) for batch in planned_batches]
+    batch_max_tokens = {batch.start_idx: batch.max_tokens for batch in planned_batches}
+    print(f"Planned {len(batches)} batches for {len(pdf_slides)} slides: "
+          f"{[len(batch.slides) for batch in planned_batches]}")
+    deck_outline = build_deck_outline(pdf_slides) if deck_context else None
+    token_usage = TokenUsage()
+    retry_policy = retry_policy or RetryPolicy()
+    if script_stream is not None:
+        script_stream.expect_batches([start_idx for start_idx, _ in batches])
+    narrative_queue = asyncio.Queue()
+    json_queue = asyncio.Queue()
+    batch_results = {}  # start_idx -> validated slides, or None if the batch failed
+    all_finished = asyncio.Event()
+    parse_stats = ParseStats()
+
+    def finish_batch(start_idx: int, slides: Optional[list]) -> None:
+        batch_results[start_idx] = slides
+        if slides is not None and script_stream is not None:
+            script_stream.add_batch(start_idx, slides)
+        if len(batch_results) == len(batches):
+            all_finished.set()
+
+    async def narrative_worker() -> None:
+        while True:
+            start_idx, batch_slides, regeneration = await narrative_queue.get()
+            batch_id = batch_id_for(start_idx, len(batch_slides))
+            try:
+                narrative_text = await generate_narrative_batch(
                     pdf_text=batch_slides,
                     start_slide_num=start_idx + 1,
                     claude_client=claude_client,
-                    storage_client=storage_client,
-                    presentation_id=presentation_id
+                    checkpoints=checkpoints,
+                    presentation_id=presentation_id,
+                    run_manifest=run_manifest,
+                    response_cache=response_cache,
+                    max_tokens=batch_max_tokens[start_idx],
+                    deck_outline=deck_outline,
+                    token_usage=token_usage,
+                    retry_policy=retry_policy,
+                    refresh=regeneration > 0
                 )
-                if narrative_success:
-                    narrative_text = blob.download_as_string().decode('utf-8')
-                    json_success = await convert_to_json_batch(
+
+                if narrative_text is not None:
+                    json_queue.put_nowait((start_idx, batch_slides, regeneration, narrative_text))
+                else:
+                    print(f"Failed to generate narrative for batch {batch_id}")
+                    finish_batch(start_idx, None)
+            except Exception:
+                print(traceback.format_exc())
+                finish_batch(start_idx, None)
+            finally:
+                narrative_queue.task_done()
+
+    async def json_worker() -> None:
+        while True:
+            start_idx, batch_slides, regeneration, narrative_text = await json_queue.get()
+            batch_id = batch_id_for(start_idx, len(batch_slides))
+            try:
+                json_data = await parse_narrative_batch(
+                    narrative_text=narrative_text,
+                    batch_id=batch_id,
+                    expected_slide_numbers=list(range(start_idx + 1, start_idx + 1 + len(batch_slides))),
+                    checkpoints=checkpoints,
+                    presentation_id=presentation_id,
+                    run_manifest=run_manifest
+                )
+                parse_stats.record(json_data is not None)
+
+                if json_data is None:
+                    # Fall back to the Claude JSON conversion
+                    json_data = await convert_to_json_batch(
                         narrative_text=narrative_text,
                         batch_id=batch_id,
                         claude_client=claude_client,
-                        storage_client=storage_client,
-                        presentation_id=presentation_id
+                        checkpoints=checkpoints,
+                        presentation_id=presentation_id,
+                        run_manifest=run_manifest,
+                        response_cache=response_cache,
+                        token_usage=token_usage,
+                        retry_policy=retry_policy,
+                        slide_count=len(batch_slides)
                     )
-                    if json_success:
-                        break
 
-        if not json_success:
-            print(f"Failed to process batch {batch_id} after all retry attempts")
-            return False
+                if json_data is not None:
+                    if response_cache is not None:
+                        # Only a narrative that converted is worth serving again
+                        request = narrative_request(batch_slides, batch_max_tokens[start_idx], deck_outline)
+                        await asyncio.to_thread(response_cache.set, narrative_cache_key(request), narrative_text)
+                    finish_batch(start_idx, json_data["slides"])
+                elif regeneration < MAX_REGENERATIONS and retry_policy.allow_retry("script.regenerate", "invalid_json"):
+                    # Try regenerating both narrative and JSON
+                    narrative_queue.put_nowait((start_idx, batch_slides, regeneration + 1))
+                else:
+                    print(f"Failed to process batch {batch_id} after all retry attempts")
+                    finish_batch(start_idx, None)
+            except Exception:
+                print(traceback.format_exc())
+                finish_batch(start_idx, None)
+            finally:
+                json_queue.task_done()
 
-        return True
+    async def load_checkpoint(start_idx: int, batch_slides: List[str]) -> Tuple[Optional[str], object]:
+        """The furthest stage an earlier run completed for a batch, and its output."""
+        batch_id = batch_id_for(start_idx, len(batch_slides))
+        base_path = f"presentations/{presentation_id}/intermediate_outputs"
+        if run_manifest.get_status(batch_id, "json").get("state") == "completed":
+            try:
+                json_data = await asyncio.to_thread(storage.read_json, f"{base_path}/json/{batch_id}.json")
+                validate_script_json(json_data, len(batch_slides))
+                return "json", json_data["slides"]
+            except (StorageNotFoundError, json.JSONDecodeError, AssertionError) as e:
+                print(f"Checkpoint for {batch_id} is unusable, regenerating: {e}")
+        if run_manifest.get_status(batch_id, "narrative").get("state") == "completed":
+            try:
+                return "narrative", await asyncio.to_thread(storage.read_text, f"{base_path}/narrative/{batch_id}.txt")
+            except StorageNotFoundError:
+                pass
+        return None, None
 
-    # Create directory structure
-    base_path = f"presentations/{presentation_id}"
-    intermediate_path = f"{base_path}/intermediate_outputs"
-    narrative_path = f"{intermediate_path}/narrative"
-    json_path = f"{intermediate_path}/json"
-    
-    # Process batches of 3 slides with some parallelization
-    batch_results = []
-    for i in range(0, len(pdf_slides), 3):
-        batch_slides = pdf_slides[i:i+3]
-        # Allow up to 5 batches to process concurrently
-        if len(batch_results) >= 5:
-            # Wait for the earliest batch to complete before starting new one
-            await batch_results.pop(0)
-        
-        batch_results.append(asyncio.create_task(process_batch(i, batch_slides)))
+    checkpoints_found = await asyncio.gather(*[load_checkpoint(start_idx, batch_slides) for start_idx, batch_slides in batches])
+    resumed = {"json": 0, "narrative": 0, "prepared": 0}
+    if not batches:
+        all_finished.set()
+    for (start_idx, batch_slides), (stage, output) in zip(batches, checkpoints_found):
+        if stage is None and prepared_narratives and start_idx in prepared_narratives:
+            stage, output = "prepared", prepared_narratives[start_idx]
+            batch_id = batch_id_for(start_idx, len(batch_slides))
+            await checkpoints.write_text(
+                f"presentations/{presentation_id}/intermediate_outputs/narrative/{batch_id}.txt", output
+            )
+            run_manifest.update_status(batch_id, "narrative", state="completed", method="message_batch", error=None)
+        if stage == "json":
+            finish_batch(start_idx, output)
+        elif stage in ("narrative", "prepared"):
+            json_queue.put_nowait((start_idx, batch_slides, 0, output))
+        else:
+            narrative_queue.put_nowait((start_idx, batch_slides, 0))
+        if stage is not None:
+            resumed[stage] += 1
+    if resumed["prepared"]:
+        print(f"Using {resumed['prepared']} prepared narratives of {len(batches)} batches")
+    if resumed["json"] or resumed["narrative"]:
+        print(f"Resumed from earlier run: {resumed['json']} batches complete, "
+              f"{resumed['narrative']} at JSON conversion, of {len(batches)}")
 
-    # Wait for remaining batches
-    remaining_results = await asyncio.gather(*batch_results)
-    if not all(remaining_results):
-        return None
+    run_manifest.start()
+    workers = [asyncio.create_task(narrative_worker()) for _ in range(narrative_concurrency)]
+    workers += [asyncio.create_task(json_worker()) for _ in range(json_concurrency)]
+    try:
+        await all_finished.wait()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
 
-    # Combine all JSON batches into final script
-    final_slides = []
-    for i in range(0, len(pdf_slides), 3):
-        batch_id = f"batch_{i+1}_slides_{i+1}-{i+3}"
-        json_batch_path = f"presentations/{presentation_id}/intermediate_outputs/json/{batch_id}.json"
-        blob = storage_client.blob(json_batch_path)
-        batch_json = json.loads(blob.download_as_bytes())
-        final_slides.extend(batch_json["slides"])
-
-    final_script = {
-        "slides": final_slides
-    }
+    try:
+        print(f"Narrative parser: {json.dumps(parse_stats.stats())}")
+        print(f"Claude token usage: {json.dumps(token_usage.stats())}")
+        print(f"Retry policy: {json.dumps(retry_policy.stats())}")
+        failed_batches = [start_idx + 1 for start_idx, slides in sorted(batch_results.items()) if slides is None]
+        if failed_batches:
+            print(f"Failed batches starting at slides: {failed_batches}")
+            return None
+        if script_stream is not None:
+            script_stream.close()
+
+        # Combine all batches into final script
+        final_script = {
+            "slides": [slide for start_idx, _ in batches for slide in batch_results[start_idx]]
+        }
 
-    # Save final script
-    final_path = f"{base_path}/script.json"
-    final_blob = storage_client.blob(final_path)
-    final_blob.upload_from_string(json.dumps(final_script, ensure_ascii=False, indent=2))
+        # Save final script
+        final_path = f"presentations/{presentation_id}/script.json"
+        await checkpoints.write_json(final_path, final_script, indent=2)
+    finally:
+        if script_stream is not None and not script_stream.closed:
+            script_stream.fail()
+        failed_paths = await checkpoints.drain()
+        await run_manifest.close()
 
-    return final_path
+    if final_path in failed_paths:
+        print(f"Failed to save {final_path}")
+        return None
+    return final_script
+
+async def process_presentation(
+    presentation_id: str,
+    pdf_slides: List[str],  # List of text content from all slides
+    claude_client,
+    storage_client,
+    response_cache: Optional[ResponseCache] = None,
+    prepared_narratives: Optional[Dict[int, str]] = None,
+    retry_policy: Optional[RetryPolicy] = None
+) -> Optional[str]:
+    """
+    Main orchestration function for processing slides and generating the final script.
+    See generate_script for how batches are processed.
+    Returns the path to the final script.json if successful, None if failed.
+    """
+    final_script = await generate_script(
+        presentation_id=presentation_id,
+        pdf_slides=pdf_slides,
+        claude_client=claude_client,
+        storage_client=storage_client,
+        response_cache=response_cache,
+        prepared_narratives=prepared_narratives,
+        retry_policy=retry_policy
+    )
+    if final_script is None:
+        return None
+    return f"presentations/{presentation_id}/script.json"
 
-async def process_local_pdf(pdf_path: str) -> Optional[str]:
+async def process_local_pdf(pdf_path: str, storage_client=None) -> Optional[str]:
     """
     Process a local PDF file without using Cloud Storage.
+    Outputs go to storage_client, by default a LocalStorage next to the PDF.
     Returns the path to the generated script.json file if successful.
     """
     try:
         # Extract presentation ID from filename
         presentation_id = os.path.splitext(os.path.basename(pdf_path))[0]
-        pdf_slides = []
-        
-        # Extract text from PDF
-        with open(pdf_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            # Extract text from each page/slide
-            for page in pdf_reader.pages:
-                slide_text = page.extract_text()
-                if slide_text.strip():  # Only add non-empty slides
-                    pdf_slides.append(slide_text)
-        
-        # Initialize Claude client
-        claude_client = AsyncAnthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
-        bucket_name = "presentable-b5545.firebasestorage.app"
-        # Create a simple storage client for local files
-        bucket = storage.bucket(bucket_name)
+        with trace_presentation(presentation_id, source="local"), track_memory(presentation_id):
+            # Extract text from the memory-mapped PDF, one non-empty page per slide
+            text_cache = ResponseCache(DiskCacheBackend(os.path.join(os.path.dirname(pdf_path), ".pdf_text_cache")))
+            pdf_slides = await asyncio.to_thread(extract_slides, pdf_path, text_cache)
         
-        # Copy PDF to presentations folder
-        # presentation_path = f"presentations/{presentation_id}/input.pdf"
-        # await bucket.copy_blob(
-        #     source_blob=f"uploads/{presentation_id}.pdf",
-        #     destination_blob=presentation_path
-        # )
+            # Initialize Claude client; retries are left to RetryPolicy
+            claude_client = get_claude_client()
+            # Create a simple storage client for local files
+            if storage_client is None:
+                storage_client = LocalStorage(os.path.join(os.path.dirname(os.path.abspath(pdf_path)), "output"))
+            response_cache = ResponseCache(DiskCacheBackend(os.path.join(os.path.dirname(pdf_path), ".claude_cache")))
+            # An unchanged file resumes whatever an interrupted run left behind
+            st = os.stat(pdf_path)
         
-        # Process the presentation
-        # final_path = await process_presentation(
-        #     presentation_id=presentation_id,
-        #     pdf_slides=pdf_slides,
-        #     claude_client=claude_client,
-        #     storage_client=bucket
-        # )
-
-        audio_path = await process_audio(
-            presentation_id=presentation_id,
-            storage_client=bucket
-        )
-        
-        if final_path:
-            print(f"Successfully processed PDF. Output saved to: gs://presentable-b5545.firebasestorage.app/{final_path}")
-        else:
-            print("Failed to process PDF")
+            # Process the presentation, synthesizing audio as batches complete
+            final_script, audio_path = await generate_script_and_audio(
+                presentation_id=presentation_id,
+                pdf_slides=pdf_slides,
+                claude_client=claude_client,
+                storage_client=storage_client,
+                response_cache=response_cache,
+                source_generation=f"{st.st_size}-{st.st_mtime_ns}"
+            )
+            final_path = f"presentations/{presentation_id}/script.json" if final_script else None
+
+            if final_path:
+                print(f"Successfully processed PDF. Output saved to: {final_path}, audio: {audio_path}")
+            else:
+                print("Failed to process PDF")
         
         return final_path
     
@@ -419,125 +679,513 @@ async def process_local_pdf(pdf_path: str) -> Optional[str]:
         traceback.print_exc()
         return None
 
-async def process_audio(presentation_id: str, storage_client) -> Optional[str]:
+async def generate_script_and_audio(
+    presentation_id: str,
+    pdf_slides: List[str],  # List of text content from all slides
+    claude_client,
+    storage_client,
+    response_cache: Optional[ResponseCache] = None,
+    context_chars: int = CONTEXT_HASH_CHARS,
+    context_sentences: Optional[int] = None,
+    source_generation: Optional[str] = None,
+    output_format: str = DEFAULT_AUDIO_FORMAT,
+    fixed_batch_size: Optional[int] = None,
+    tts_limiter: Optional[AdaptiveLimiter] = None,
+    retry_policy: Optional[RetryPolicy] = None
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Runs script generation and audio synthesis together in one event loop.
+    TTS requests for a batch's slides are queued as soon as the batch is
+    validated, so for long decks the total time approaches the slower of
+    the two stages rather than their sum. See process_audio for the
+    context window, output_format and tts_limiter options and
+    generate_script for source_generation and fixed_batch_size.
+    Both stages draw on one retry_policy, so they share its retry budget.
+    Returns (final script, audio directory), either None on failure.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    script_stream = ScriptStream(context_chars=context_chars, context_sentences=context_sentences)
+    audio_task = asyncio.create_task(process_audio(
+        presentation_id=presentation_id,
+        storage_client=storage_client,
+        script_stream=script_stream,
+        output_format=output_format,
+        tts_limiter=tts_limiter,
+        retry_policy=retry_policy
+    ))
+    try:
+        final_script = await generate_script(
+            presentation_id=presentation_id,
+            pdf_slides=pdf_slides,
+            claude_client=claude_client,
+            storage_client=storage_client,
+            response_cache=response_cache,
+            script_stream=script_stream,
+            source_generation=source_generation,
+            fixed_batch_size=fixed_batch_size,
+            retry_policy=retry_policy
+        )
+    finally:
+        if not script_stream.closed:
+            script_stream.fail()
+    audio_path = await audio_task
+    return final_script, audio_path
+
+@traced("audio.process")
+async def process_audio(
+    presentation_id: str,
+    storage_client,
+    script_data: Optional[dict] = None,
+    script_stream: Optional[ScriptStream] = None,
+    context_chars: int = CONTEXT_HASH_CHARS,
+    context_sentences: Optional[int] = None,
+    output_format: str = DEFAULT_AUDIO_FORMAT,
+    stream_chunk_seconds: float = DEFAULT_STREAM_CHUNK_SECONDS,
+    tts_limiter: Optional[AdaptiveLimiter] = None,
+    retry_policy: Optional[RetryPolicy] = None
+) -> Optional[str]:
     """
     Process audio for all slides in parallel using ElevenLabs API.
-    Loads the script.json from Cloud Storage and generates audio files.
+    Takes slides from script_stream as generate_script validates them, or
+    uses script_data when the caller already has the whole script in
+    memory, otherwise loads the script.json from Cloud Storage, and
+    generates audio files.
+    Each request carries the last/next context_chars characters of the
+    neighbouring scripts as previous_text/next_text, or the nearest
+    context_sentences sentences when that is set (a given script_stream
+    keeps its own settings).
+    output_format picks the segment_<i> and combined_audio files written:
+    "mp3" stores ElevenLabs' MP3 as is and joins the frames without
+    decoding; "wav", "flac" and "opus" decode every segment with ffmpeg.
+    A timing.json next to them records the combined file's path and
+    format, which can differ from output_format (see below), and each
+    slide's sample and byte range in it (see audio_assembly.build_timing_index).
+    Segments are written and appended to the combined file in script
+    order while synthesis is still running, and dropped from memory once
+    that and the stream below have taken them, so only segments that
+    finished ahead of an earlier one are held.
+    The MP3 segments finished so far in script order are also cut into
+    stream_chunk_seconds chunks under
+    audio/stream/ with an HLS playlist.m3u8 that is rewritten at most once
+    per chunk length, so playback can start long before the whole deck is
+    done.
+    Pass tts_limiter to share one ElevenLabs concurrency limit between
+    presentations processed together. TTS requests are retried by
+    retry_policy (a new RetryPolicy when not given).
+    Inside memory_profile.track_memory, TTS and assembly memory are
+    recorded as stages, and when memory nears the run's budget the TTS
+    concurrency is shed, and if that is so when assembly starts the
+    combined file is written as mp3.
     Returns the path to the directory containing generated audio files.
     """
     try:
+        if output_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unsupported audio format {output_format!r}, expected one of {sorted(AUDIO_FORMATS)}")
+        audio_options = AUDIO_FORMATS[output_format]
+
         # Load environment variables
         xi_api_key = os.getenv("YOUR_XI_API_KEY")
         if not xi_api_key:
             raise ValueError("ElevenLabs API key not found in environment variables")
+        elevenlabs = ElevenLabsClient(xi_api_key)
 
-        # Load the script data from Cloud Storage
+        storage = as_storage(storage_client)
+        checkpoints = CheckpointWriter(storage, max_pending=4)
         base_path = f"presentations/{presentation_id}"
         script_path = f"{base_path}/script.json"
-        script_blob = storage_client.blob(script_path)
         
-        if not script_blob.exists():
-            raise ValueError(f"Script not found at {script_path}")
-            
-        script_content = script_blob.download_as_text()
-        script_data = json.loads(script_content)
-
-        # Extract scripts from slides, excluding any with should_skip=true
-        paragraphs = [
-            slide['script'] 
-            for slide in script_data['slides'] 
-            if not slide.get('should_skip', False)
-        ]
+        if script_stream is None:
+            if script_data is None:
+                # Load the script data from Cloud Storage
+                try:
+                    script_data = await asyncio.to_thread(storage.read_json, script_path)
+                except StorageNotFoundError:
+                    raise ValueError(f"Script not found at {script_path}")
+            script_stream = ScriptStream.from_script(
+                script_data, context_chars=context_chars, context_sentences=context_sentences
+            )
 
         voice_id = "JBFqnCBsd6RMkjVDRZzb"  # Default voice ID
+        model_id = "eleven_multilingual_v2"
         audio_base_path = f"{base_path}/audio"
+        segment_store = SegmentAudioStore(storage, audio_base_path)
+        # Starts at the old fixed group size of 5 and adapts to ElevenLabs' responses
+        if tts_limiter is None:
+            tts_limiter = AdaptiveLimiter(initial_limit=5, max_limit=10)
+        retry_policy = retry_policy or RetryPolicy()
 
         async def process_paragraph(
             session: aiohttp.ClientSession, 
-            paragraph: str, 
-            index: int, 
-            total: int
-        ) -> Tuple[int, bytes]:
-            """Process a single paragraph and return its index and audio content."""
-            is_last_paragraph = index == total - 1
-            is_first_paragraph = index == 0
-            
-            async with session.post(
-                f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream",
-                json={
-                    "text": paragraph,
-                    "model_id": "eleven_multilingual_v2",
-                    "previous_text": None if is_first_paragraph else " ".join(paragraphs[:index]),
-                    "next_text": None if is_last_paragraph else " ".join(paragraphs[index + 1:])
-                },
-                headers={"xi-api-key": xi_api_key}
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    print(f"Error encountered, status: {response.status}, content: {error_text}")
-                    raise Exception(f"Failed to process paragraph {index + 1}")
-                    
-                print(f"Successfully converted paragraph {index + 1}/{total}")
-                content = await response.read()
-                return index, content
+            paragraph: ReadyParagraph
+        ) -> Tuple[tuple, bytes]:
+            """
+            Process a single paragraph and return its position and audio content.
+            Audio already synthesized for the same text and context is reused,
+            and failed requests are retried by retry_policy, outside the
+            limiter slot so a backoff does not hold one.
+            """
+            slide_label = paragraph.slide
+            with span("tts.request", slide=slide_label, chars=len(paragraph.text)) as tts_span:
+                cache_key = make_segment_key(
+                    paragraph.text, voice_id, model_id, paragraph.previous_text, paragraph.next_text
+                )
+                cached_content = await asyncio.to_thread(segment_store.get, cache_key)
+                if cached_content is not None:
+                    tts_span.set(cache_hit=True, bytes=len(cached_content))
+                    print(f"Reused cached audio for slide {slide_label}")
+                    return paragraph.position, cached_content
+                
+                async def synthesize() -> Tuple[bytes, RequestSlot]:
+                    async with tts_limiter.slot(label=slide_label, units=len(paragraph.text)) as slot:
+                        # Fewer requests in flight means fewer response buffers
+                        # held at once; requests still queued see the lower limit
+                        monitor = current_monitor()
+                        if monitor is not None and tts_limiter.max_limit > tts_limiter.min_limit and monitor.should_shed():
+                            tts_limiter.shed()
+                            monitor.record_action(f"TTS concurrency capped at {tts_limiter.max_limit}")
+                        async with session.post(
+                            elevenlabs.url(f"/v1/text-to-speech/{voice_id}/stream"),
+                            json={
+                                "text": paragraph.text,
+                                "model_id": model_id,
+                                "previous_text": paragraph.previous_text,
+                                "next_text": paragraph.next_text
+                            },
+                            headers=elevenlabs.headers()
+                        ) as response:
+                            slot.status = response.status
+                            tts_span.set(cache_hit=False, status=response.status, queue_wait_ms=round(slot.queue_wait * 1000, 1))
+                            if response.status != 200:
+                                error_text = await response.text()
+                                print(f"Error encountered, status: {response.status}, content: {error_text}")
+                                raise HTTPStatusError(
+                                    f"Failed to process slide {slide_label}", response.status, response.headers
+                                )
+                        
+                            # Read the stream chunk by chunk to time the first audio byte
+                            chunks = []
+                            async for chunk in response.content.iter_any():
+                                if not chunks:
+                                    tts_span.set(ttfb_ms=round((time.monotonic() - slot.started_at) * 1000, 1))
+                                chunks.append(chunk)
+                            content = b"".join(chunks)
+                            del chunks
+                    return content, slot
+
+                content, slot = await retry_policy.call("elevenlabs.tts", synthesize)
+                tts_span.set(bytes=len(content), service_ms=round(slot.service_time * 1000, 1))
+                print(f"Successfully converted slide {slide_label} "
+                      f"(queued {slot.queue_wait:.2f}s, service {slot.service_time:.2f}s)")
+
+                await asyncio.to_thread(segment_store.put, cache_key, content)
+                return paragraph.position, content
+
+        async def publish_stream(
+            finished: dict,
+            progress: asyncio.Event,
+            tts_done: asyncio.Event,
+            release: Callable[[tuple, str], None]
+        ) -> Optional[str]:
+            """
+            Append finished segments to the HLS stream in script order,
+            stopping at the first one that is not done yet, and release
+            each one once it is chunked.
+            Players reload an EVENT playlist about once per target duration
+            (RFC 8216 section 6.3.4), so the playlist is rewritten at most
+            that often; every rewrite is another object write, and with it
+            another storage trigger invocation.
+            Returns the playlist path once every segment is published.
+            """
+            stream_path = f"{audio_base_path}/stream"
+            playlist_path = f"{stream_path}/playlist.m3u8"
+            chunker = Mp3Chunker(stream_chunk_seconds)
+            chunk_names, durations = [], []
+            listed = 0  # chunks in the playlist last written
+            listed_at = None
+
+            async def write_chunk(chunk: Tuple[bytes, float]) -> None:
+                name = f"chunk_{len(chunk_names):05d}.mp3"
+                with span("audio.stream_chunk", chunk=len(chunk_names), bytes=len(chunk[0]), seconds=round(chunk[1], 3)):
+                    await asyncio.to_thread(storage.write_bytes, f"{stream_path}/{name}", chunk[0], "audio/mpeg")
+                chunk_names.append(name)
+                durations.append(chunk[1])
+
+            async def write_playlist(ended: bool) -> None:
+                nonlocal listed, listed_at
+                playlist = render_hls_playlist(chunk_names, durations, stream_chunk_seconds, ended)
+                await asyncio.to_thread(storage.write_text, playlist_path, playlist, HLS_CONTENT_TYPE)
+                listed, listed_at = len(chunk_names), time.monotonic()
+
+            def playlist_due_in() -> Optional[float]:
+                """Seconds until unlisted chunks should be listed, None if there are none."""
+                if listed == len(chunk_names):
+                    return None
+                if listed_at is None:
+                    # The first chunk is listed at once so playback can start
+                    return 0.0
+                return listed_at + stream_chunk_seconds - time.monotonic()
+
+            try:
+                published = 0
+                while True:
+                    order = script_stream.settled_positions()
+                    while published < len(order) and order[published] in finished:
+                        for chunk in chunker.add(finished[order[published]]):
+                            await write_chunk(chunk)
+                        release(order[published], "stream")
+                        published += 1
+                    if script_stream.complete and published == len(order):
+                        break
+                    if script_stream.failed or tts_done.is_set():
+                        return None
+                    due_in = playlist_due_in()
+                    if due_in is not None and due_in <= 0:
+                        await write_playlist(ended=False)
+                        due_in = None
+                    try:
+                        await asyncio.wait_for(progress.wait(), timeout=due_in)
+                    except asyncio.TimeoutError:
+                        pass
+                    progress.clear()
+
+                last_chunk = chunker.flush()
+                if last_chunk is not None:
+                    await write_chunk(last_chunk)
+                if chunk_names:
+                    await write_playlist(ended=True)
+                print(f"Published {len(chunk_names)} stream chunks to {playlist_path}")
+                return playlist_path
+            except Exception as e:
+                # The stream is a preview; the combined file is still written
+                print(f"Error publishing audio stream: {e}")
+                return None
+
+        async def assemble_combined(
+            finished: dict,
+            progress: asyncio.Event,
+            tts_done: asyncio.Event,
+            release: Callable[[tuple, str], None]
+        ) -> Optional[Tuple[str, object, dict]]:
+            """
+            Write each finished segment and append it to the combined file in
+            script order while the rest are still being synthesized, so only
+            segments that finished out of order wait in memory.
+            Returns (combined file path, its writer, paragraph index ->
+            (start frame, end frame, first byte, last byte)) once every
+            segment is appended, None if a segment or the script failed.
+            """
+            with memory_stage("audio.assemble"):
+                return await assemble_in_order(finished, progress, tts_done, release)
+
+        async def assemble_in_order(
+            finished: dict,
+            progress: asyncio.Event,
+            tts_done: asyncio.Event,
+            release: Callable[[tuple, str], None]
+        ) -> Optional[Tuple[str, object, dict]]:
+            nonlocal output_format, audio_options
+            spans = {}
+            combined_writer = None
+            assembled = 0
+            try:
+                while True:
+                    order = script_stream.settled_positions()
+                    while assembled < len(order) and order[assembled] in finished:
+                        position, i = order[assembled], assembled
+                        content = finished[position]
+                        if combined_writer is None:
+                            monitor = current_monitor()
+                            if output_format != "mp3" and monitor is not None and monitor.under_pressure():
+                                # Decoding holds a decoded segment, the WAV being built and,
+                                # for flac/opus, an ffmpeg process on top of the downloaded
+                                # MP3s; passing the MP3 frames through needs none of them
+                                monitor.record_action(f"writing mp3 instead of {output_format}")
+                                output_format = "mp3"
+                                audio_options = AUDIO_FORMATS[output_format]
+                            combined_writer = StreamingMp3Writer() if output_format == "mp3" else StreamingWavWriter()
+                        segment_path = f"{audio_base_path}/segment_{i}.{audio_options['extension']}"
+
+                        if output_format == "mp3":
+                            # ElevenLabs already returns MP3: keep each segment as is and
+                            # copy its frames into the combined file, no ffmpeg involved
+                            await checkpoints.write_bytes(segment_path, content, content_type=audio_options["content_type"])
+                            with span("audio.append", paragraph=i, bytes=len(content), format="mp3"):
+                                byte_start = combined_writer.bytes_written
+                                start_frame = await asyncio.to_thread(combined_writer.append, content)
+                            spans[i] = (start_frame, combined_writer.frames_written, byte_start, combined_writer.bytes_written - 1)
+                        else:
+                            # Decode one segment at a time and stream its frames into the
+                            # combined file, so peak memory is a single decoded segment.
+                            # pydub is only needed here, so it is not imported at startup
+                            from pydub import AudioSegment
+                            with span("audio.decode", paragraph=i, bytes=len(content)) as decode_span:
+                                segment = await asyncio.to_thread(AudioSegment.from_mp3, io.BytesIO(content))
+                                decode_span.set(duration_ms=len(segment))
+                            with span("audio.encode", paragraph=i, format=output_format) as encode_span:
+                                audio_data = await asyncio.to_thread(export_segment, segment, output_format)
+                                encode_span.set(bytes=len(audio_data))
+                            await checkpoints.write_bytes(segment_path, audio_data, content_type=audio_options["content_type"])
+                            with span("audio.append", paragraph=i):
+                                byte_start = combined_writer.bytes_written
+                                start_frame = await asyncio.to_thread(combined_writer.append, segment)
+                            # Byte offsets only carry over to the uncompressed file
+                            spans[i] = (start_frame, combined_writer.frames_written) + (
+                                (byte_start, combined_writer.bytes_written - 1) if output_format == "wav" else (None, None)
+                            )
+                            del segment, audio_data
+                        del content
+                        release(position, "file")
+                        assembled += 1
+                    if script_stream.complete and assembled == len(order):
+                        break
+                    if script_stream.failed or tts_done.is_set():
+                        return None
+                    await progress.wait()
+                    progress.clear()
+
+                final_path = f"{audio_base_path}/combined_audio.{audio_options['extension']}"
+                if combined_writer is None:
+                    combined_writer = StreamingMp3Writer() if output_format == "mp3" else StreamingWavWriter()
+                # Patch the WAV header and upload the combined audio in chunks
+                combined_writer.close()
+                if output_format in ("mp3", "wav"):
+                    await asyncio.to_thread(
+                        storage.write_file, final_path, combined_writer.path, content_type=audio_options["content_type"]
+                    )
+                else:
+                    with span("audio.encode", paragraph="combined", format=output_format):
+                        encoded_path = await asyncio.to_thread(transcode_wav_file, combined_writer.path, output_format)
+                    try:
+                        await asyncio.to_thread(
+                            storage.write_file, final_path, encoded_path, content_type=audio_options["content_type"]
+                        )
+                    finally:
+                        os.remove(encoded_path)
+                return final_path, combined_writer, spans
+            finally:
+                if combined_writer is not None:
+                    combined_writer.cleanup()
 
         async def main_audio_processing():
-            async with aiohttp.ClientSession() as session:
-                # Create tasks for all paragraphs
-                tasks = [
-                    process_paragraph(session, paragraph, i, len(paragraphs))
-                    for i, paragraph in enumerate(paragraphs)
-                ]
-                
-                # Process up to 5 paragraphs concurrently
-                segment_results = []
-                for batch in range(0, len(tasks), 5):
-                    batch_tasks = tasks[batch:batch + 5]
-                    batch_results = await asyncio.gather(*batch_tasks, return_exceptions=True)
-                    segment_results.extend(batch_results)
-                
-                # Check for any errors
-                for result in segment_results:
-                    if isinstance(result, Exception):
-                        print(f"Error processing paragraph: {result}")
+            # Pooled session shared across runs on a warm instance
+            session = await elevenlabs.session()
+
+            # Segments wait in finished until the stream publisher and the
+            # combined file have both taken them
+            finished, needed_by = {}, {}
+            stream_progress, assembly_progress, tts_done = asyncio.Event(), asyncio.Event(), asyncio.Event()
+            consumers = {"stream", "file"} if stream_chunk_seconds else {"file"}
+
+            def notify() -> None:
+                stream_progress.set()
+                assembly_progress.set()
+
+            def release(position: tuple, consumer: str) -> None:
+                readers = needed_by.get(position)
+                if readers is None:
+                    return
+                readers.discard(consumer)
+                if not readers:
+                    del finished[position], needed_by[position]
+
+            async def synthesize_into_finished(paragraph: ReadyParagraph) -> tuple:
+                position, content = await process_paragraph(session, paragraph)
+                finished[position] = content
+                needed_by[position] = set(consumers)
+                return position
+
+            def on_publisher_done(task: asyncio.Task) -> None:
+                # A stream that stopped early no longer needs the segments it skipped
+                consumers.discard("stream")
+                for position in list(needed_by):
+                    release(position, "stream")
+
+            publisher = None
+            if stream_chunk_seconds:
+                publisher = asyncio.create_task(publish_stream(finished, stream_progress, tts_done, release))
+                publisher.add_done_callback(on_publisher_done)
+            assembler = asyncio.create_task(assemble_combined(finished, assembly_progress, tts_done, release))
+
+            # Each paragraph is queued as soon as its script and context are
+            # known; tts_limiter starts the next one as soon as any in-flight
+            # request finishes. The tasks only return positions, so a
+            # segment's bytes go once both consumers have read them.
+            with memory_stage("audio.tts"):
+                tts_tasks = []
+                try:
+                    while True:
+                        for paragraph in script_stream.take_ready():
+                            task = asyncio.create_task(synthesize_into_finished(paragraph))
+                            task.add_done_callback(lambda _: notify())
+                            tts_tasks.append(task)
+                        notify()
+                        if script_stream.closed:
+                            break
+                        await script_stream.wait_for_update()
+
+                    if script_stream.failed:
+                        for task in tts_tasks:
+                            task.cancel()
+                        await asyncio.gather(*tts_tasks, assembler, return_exceptions=True)
+                        print("Script generation failed, abandoning audio")
                         return None
 
-                # Sort segments by index and process audio
-                sorted_results = sorted(segment_results, key=lambda x: x[0])
-                
-                # Convert to audio segments and combine
-                segments = []
-                for i, content in sorted_results:
-                    segment = AudioSegment.from_mp3(io.BytesIO(content))
-                    segments.append(segment)
-                    
-                    # Save individual segment to storage
-                    segment_path = f"{audio_base_path}/segment_{i}.wav"
-                    segment_blob = storage_client.blob(segment_path)
-                    
-                    # Export to bytes
-                    audio_data = io.BytesIO()
-                    segment.export(audio_data, format="wav")
-                    audio_data.seek(0)
-                    segment_blob.upload_from_file(audio_data, content_type="audio/wav")
-                
-                # Combine all segments
-                final_segment = segments[0]
-                for segment in segments[1:]:
-                    final_segment = final_segment + segment
-                
-                # Save combined audio to storage
-                final_path = f"{audio_base_path}/combined_audio.wav"
-                final_blob = storage_client.blob(final_path)
-                
-                # Export to bytes
-                final_audio_data = io.BytesIO()
-                final_segment.export(final_audio_data, format="wav")
-                final_audio_data.seek(0)
-                final_blob.upload_from_file(final_audio_data, content_type="audio/wav")
-                
-                print(f"Successfully generated audio files in {audio_base_path}")
-                return audio_base_path
+                    segment_results = await asyncio.gather(*tts_tasks, return_exceptions=True)
+                    del tts_tasks
+                finally:
+                    tts_done.set()
+                    notify()
+                    if publisher is not None:
+                        await publisher
+
+            tts_stats = tts_limiter.stats()
+            tts_stats.pop("per_request")
+            print(f"TTS scheduler: {json.dumps(tts_stats)}")
+            print(f"Retry policy: {json.dumps(retry_policy.stats())}")
+
+            # Check for any errors
+            for result in segment_results:
+                if isinstance(result, Exception):
+                    print(f"Error processing paragraph: {result}")
+                    await asyncio.gather(assembler, return_exceptions=True)
+                    return None
+
+            assembled = await assembler
+            if assembled is None:
+                return None
+            final_path, combined_writer, spans = assembled
+            paragraph_index = {position: i for i, position in enumerate(script_stream.paragraph_positions())}
+
+            # Slide -> offsets index, so a player can start at any slide with
+            # a range request instead of fetching everything before it
+            frame_rate = combined_writer.frame_rate
+            timing_path = f"{audio_base_path}/timing.json"
+            await asyncio.to_thread(storage.write_json, timing_path, {
+                "presentation_id": presentation_id,
+                "audio_path": final_path,
+                "format": output_format,
+                "content_type": audio_options["content_type"],
+                "sample_rate": frame_rate,
+                "total_samples": combined_writer.frames_written,
+                "duration_ms": round(combined_writer.frames_written * 1000 / frame_rate) if frame_rate else 0,
+                "slides": build_timing_index(
+                    [
+                        (None if position is None else paragraph_index[position], slide)
+                        for position, slide in script_stream.slide_positions()
+                    ],
+                    spans,
+                    frame_rate
+                )
+            })
+            
+            failed_paths = await checkpoints.drain()
+            if failed_paths:
+                print(f"Failed to save audio segments: {failed_paths}")
+                return None
+            
+            print(f"TTS segment cache: {json.dumps(segment_store.stats())}")
+            print(f"Successfully generated audio files in {audio_base_path}")
+            return audio_base_path
 
         return await main_audio_processing()
 
@@ -547,7 +1195,19 @@ async def process_audio(presentation_id: str, storage_client) -> Optional[str]:
         return None
 
 def on_pdf_uploaded(event):
-    """Background Cloud Function to be triggered by Cloud Storage."""
+    """
+    Background Cloud Function to be triggered by Cloud Storage.
+
+    Storage triggers are delivered at least once, so each run is keyed by
+    the object generation: duplicate deliveries of a completed run are
+    dropped, and a later attempt after a failure or timeout picks up the
+    completed batches and audio segments of the earlier one. Failures are
+    marked on the lease and raised, so the event is redelivered where
+    retries are turned on for the trigger; either way resume_stalled_runs
+    picks the run up again. A delivery that finds the run held by another
+    invocation returns and leaves it to that invocation or the sweep.
+    """
+    lease = None
     try:
         # Get file path from event
         bucket_name = event.bucket
@@ -558,88 +1218,130 @@ def on_pdf_uploaded(event):
             print(f"Skipping file {file_path} - not a PDF in uploads directory")
             return
         
-        # Get bucket and blob
-        bucket = storage.bucket(bucket_name)
-        pdf_blob = bucket.blob(file_path)
-        
-        # Download PDF to temp file
-        temp_pdf_path = f"/tmp/{os.path.basename(file_path)}"
-        pdf_blob.download_to_filename(temp_pdf_path)
+        # On a cold start the Claude SDK loads while the PDF is downloaded and extracted
+        preload_claude_client()
+
+        # Get bucket
+        storage_client = gcs_storage(bucket_name)
         
         # Process PDF to JSON
         presentation_id = os.path.splitext(os.path.basename(file_path))[0]
-        pdf_slides = []  # List of text content from all slides
-        
-        # Extract text from PDF
-        with open(temp_pdf_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            # Extract text from each page/slide
-            for page in pdf_reader.pages:
-                slide_text = page.extract_text()
-                if slide_text.strip():  # Only add non-empty slides
-                    pdf_slides.append(slide_text)
+        generation = getattr(event, 'generation', None)
+        if generation is not None:
+            generation = str(generation)
+            lease = RunLease(
+                storage_client, presentation_id, generation, source={"bucket": bucket_name, "name": file_path}
+            )
+            if not lease.acquire():
+                return
+        with trace_presentation(presentation_id, source="storage_trigger", file_path=file_path, generation=generation), \
+                track_memory(presentation_id):
+            # Extract text straight from the downloaded bytes, pages in parallel,
+            # reusing text already extracted from identical pages
+            pdf_bytes = storage_client.read_bytes(file_path)
+            text_cache = ResponseCache(BucketCacheBackend(storage_client, prefix="cache/pdf_text"))
+            pdf_slides = extract_slides(pdf_bytes, text_cache=text_cache)  # List of text content from all slides
+            del pdf_bytes
+            print(f"PDF text cache: {json.dumps(text_cache.stats())}")
         
-        # Initialize clients
-        claude_client = AsyncAnthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
-        storage_client = bucket  # Use the bucket as storage client
+            # Clients are cached per instance; retries are left to RetryPolicy
+            claude_client = get_claude_client()
+            response_cache = ResponseCache(BucketCacheBackend(storage_client))
         
-        # Call process_presentation function
-        final_path = asyncio.run(process_presentation(
-            presentation_id=presentation_id,
-            pdf_slides=pdf_slides,
-            claude_client=claude_client,
-            storage_client=storage_client
-        ))
+            # Generate the script and its audio in one event loop, starting TTS
+            # for each batch of slides as soon as it is validated
+            final_script, audio_path = run(generate_script_and_audio(
+                presentation_id=presentation_id,
+                pdf_slides=pdf_slides,
+                claude_client=claude_client,
+                storage_client=storage_client,
+                response_cache=response_cache,
+                source_generation=generation
+            ))
+            print(f"Claude response cache: {json.dumps(response_cache.stats())}")
 
-        if final_path is None:
-            print(f"Failed to process presentation json {presentation_id}")
-            return
-        # call proccess audio function
-        audio_path = asyncio.run(process_audio(
-            presentation_id=presentation_id,
-            storage_client=storage_client
-        ))
-        
-        if audio_path is None:
-            print(f"Failed to process presentation audio {presentation_id}")
-            return
+            # Raised rather than returned, so the event is retried and the
+            # next attempt resumes; the handler below marks the lease failed
+            if final_script is None:
+                raise RuntimeError(f"Failed to process presentation json {presentation_id}")
+            final_path = f"presentations/{presentation_id}/script.json"
         
-        # # Upload JSON to a new location
-        # json_blob = bucket.blob(final_path)
+            if audio_path is None:
+                raise RuntimeError(f"Failed to process presentation audio {presentation_id}")
         
-        # json_blob.upload_from_string(
-        #     json.dumps({"slides": []}),  # Replace with actual JSON data
-        #     content_type='application/json'
-        # )
+            # # Upload JSON to a new location
+            # json_blob = bucket.blob(final_path)
         
-        # Clean up temp file
-        os.remove(temp_pdf_path)
+            # json_blob.upload_from_string(
+            #     json.dumps({"slides": []}),  # Replace with actual JSON data
+            #     content_type='application/json'
+            # )
         
-        # Update metadata in original PDF blob
-        pdf_blob.metadata = {
-            'processed': 'true',
-            'json_path': final_path,
-            'audio_path': audio_path,
-            'processed_at': datetime.now().isoformat()
-        }
-        pdf_blob.patch()
+            # Under memory pressure the combined file is written as mp3
+            # whatever the configured format, so record the file actually written
+            timing_path = f"{audio_path}/timing.json"
+            timing = storage_client.read_json(timing_path)
+
+            # Update metadata in original PDF blob
+            storage_client.set_metadata(file_path, {
+                'processed': 'true',
+                'json_path': final_path,
+                'audio_path': audio_path,
+                'combined_audio_path': timing['audio_path'],
+                'audio_format': timing['format'],
+                'timing_path': timing_path,
+                'processed_at': datetime.now().isoformat()
+            })
+            if lease:
+                lease.complete(json_path=final_path, audio_path=audio_path, combined_audio_path=timing['audio_path'])
         
-        return {
-            'success': True,
-            'message': f'Successfully processed PDF and created presentation {presentation_id}',
-            'presentation_id': presentation_id
-        }
+            return {
+                'success': True,
+                'message': f'Successfully processed PDF and created presentation {presentation_id}',
+                'presentation_id': presentation_id
+            }
         
+    except RunInProgressError as e:
+        print(f"{e}, leaving it to the holder or the resume sweep")
+        return
     except Exception as e:
         print(f'Error processing PDF: {str(e)}')
         traceback.print_exc()
+        if lease and lease.record:
+            try:
+                lease.fail(str(e))
+            except Exception:
+                traceback.print_exc()
         raise
 
+def resume_stalled_runs(bucket_name: Optional[str] = None, max_runs: int = 1) -> int:
+    """
+    Scheduled sweep that resumes up to max_runs uploads whose run failed
+    or whose invocation died, oldest first, through on_pdf_uploaded.
+    Storage triggers are not redelivered unless retries are turned on
+    for them, so this is what finishes those runs; RunLease keeps a run
+    from being taken over while it is still in progress and gives up
+    after its max_attempts. One run can take the whole function timeout,
+    hence the small default. Returns the number of runs attempted.
+    """
+    storage_client = gcs_storage(bucket_name)
+    attempted = 0
+    for entry in stalled_runs(storage_client)[:max_runs]:
+        print(f"Resuming stalled run of {entry['name']} (generation {entry['generation']})")
+        attempted += 1
+        try:
+            on_pdf_uploaded(SimpleNamespace(
+                bucket=entry.get("bucket", bucket_name), name=entry["name"], generation=entry["generation"]
+            ))
+        except Exception:
+            # Already marked failed on the lease; the next sweep retries it
+            traceback.print_exc()
+    return attempted
+
 def main():
     
     from dotenv import load_dotenv
-    from firebase_admin import initialize_app, storage
+    from firebase_admin import initialize_app
     
     # Initialize Firebase app
     app = initialize_app()
@@ -655,7 +1357,7 @@ def main():
         print("Error: ANTHROPIC_API_KEY environment variable not set")
         return
     
-    asyncio.run(process_local_pdf(PDF_PATH))
+    run(process_local_pdf(PDF_PATH))
 
 if __name__ == '__main__':
     main()
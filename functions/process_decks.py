@@ -0,0 +1,203 @@
+"""
+Process many PDFs at once: script, audio and optionally the knowledge
+base for every deck in a directory or manifest, writing the usual
+presentations/<id>/ layout under --output-dir.
+
+Decks run concurrently but share one Claude client and one ElevenLabs
+connection pool, behind global limits: a Claude concurrency limit and
+input/output tokens-per-minute budgets, and an ElevenLabs concurrency
+limit. Adding decks therefore queues work instead of multiplying the
+request rate.
+
+Usage (from the functions directory):
+    python process_decks.py ../assets/presentations --output-dir ../output
+    python process_decks.py decks.txt --deck-concurrency 4 --claude-output-tpm 16000
+
+A manifest is a text file with one PDF path per line (# starts a
+comment) or a JSON list of paths; relative paths are resolved against
+the manifest's directory.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from contextlib import nullcontext
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from concurrency import AdaptiveLimiter, TokenBudget
+from elevenlabs_client import ElevenLabsClient
+from event_loop import run
+from llm_cache import BudgetedClaudeClient, DiskCacheBackend, ResponseCache, get_claude_client
+from memory_profile import track_memory
+from pdf_extract import extract_slides
+from pdf_processor import DEFAULT_AUDIO_FORMAT, generate_script, generate_script_and_audio
+from retry_policy import RetryPolicy
+from storage_backend import LocalStorage
+from tracing import trace_presentation
+
+
+def find_pdfs(source: str) -> List[str]:
+    """PDF paths from a directory (non-recursive) or a manifest file."""
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.pdf")))
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        content = f.read()
+    if source.endswith(".json"):
+        entries = json.loads(content)
+    else:
+        entries = [line.strip() for line in content.splitlines()]
+        entries = [line for line in entries if line and not line.startswith("#")]
+    return [os.path.normpath(os.path.join(base_dir, entry)) for entry in entries]
+
+
+async def upload_knowledge_base(elevenlabs: ElevenLabsClient, storage, presentation_id: str, script: dict) -> str:
+    """Same upload and agent creation as handle_knowledge_base_upload, on the shared session."""
+    kb_response = await elevenlabs.upload_knowledge_base_json(script)
+    await elevenlabs.create_agent(kb_response["id"], name=presentation_id)
+    reference_path = f"knowledge_base/{kb_response['id']}/source.json"
+    await asyncio.to_thread(storage.write_json, reference_path, script)
+    return kb_response["id"]
+
+
+async def process_decks(pdf_paths: List[str], args) -> List[dict]:
+    """Process every PDF, at most args.deck_concurrency at a time, and return one result per deck."""
+    storage = LocalStorage(args.output_dir)
+    response_cache = ResponseCache(DiskCacheBackend(os.path.join(args.output_dir, ".claude_cache")))
+    claude_client = BudgetedClaudeClient(
+        get_claude_client(),
+        AdaptiveLimiter(initial_limit=min(5, args.claude_concurrency), max_limit=args.claude_concurrency),
+        input_budget=TokenBudget(args.claude_input_tpm) if args.claude_input_tpm else None,
+        output_budget=TokenBudget(args.claude_output_tpm) if args.claude_output_tpm else None
+    )
+    tts_limiter = AdaptiveLimiter(initial_limit=min(5, args.tts_concurrency), max_limit=args.tts_concurrency)
+    # One policy for the whole run, so a provider's retry-after pauses every deck
+    retry_policy = RetryPolicy()
+    elevenlabs = ElevenLabsClient(os.getenv("ELEVEN_LABS_API_KEY"), retry_policy=retry_policy)
+    deck_slots = asyncio.Semaphore(args.deck_concurrency)
+    # Monitors sample the whole process's RSS, and shedding lowers the shared
+    # TTS limiter, so concurrent decks share the run's monitor. A deck gets its
+    # own profile only when decks run one at a time.
+    per_deck_memory = args.deck_concurrency == 1
+
+    async def process_one(pdf_path: str) -> dict:
+        presentation_id = os.path.splitext(os.path.basename(pdf_path))[0]
+        result = {"presentation_id": presentation_id, "pdf": pdf_path, "slides": 0, "ok": False}
+        async with deck_slots:
+            started = time.monotonic()
+            memory = None
+            try:
+                with trace_presentation(presentation_id, source="process_decks"), \
+                        (track_memory(presentation_id) if per_deck_memory else nullcontext()) as memory:
+                    text_cache = ResponseCache(DiskCacheBackend(os.path.join(os.path.dirname(pdf_path), ".pdf_text_cache")))
+                    pdf_slides = await asyncio.to_thread(extract_slides, pdf_path, text_cache)
+                    result["slides"] = len(pdf_slides)
+                    st = os.stat(pdf_path)
+                    options = dict(
+                        presentation_id=presentation_id,
+                        pdf_slides=pdf_slides,
+                        claude_client=claude_client,
+                        storage_client=storage,
+                        response_cache=response_cache,
+                        source_generation=f"{st.st_size}-{st.st_mtime_ns}",
+                        retry_policy=retry_policy
+                    )
+                    if args.skip_audio:
+                        script = await generate_script(**options)
+                        audio_path = None
+                    else:
+                        script, audio_path = await generate_script_and_audio(
+                            **options, output_format=args.audio_format, tts_limiter=tts_limiter
+                        )
+                    result["script_path"] = f"presentations/{presentation_id}/script.json" if script else None
+                    result["audio_path"] = audio_path
+                    result["ok"] = script is not None and (args.skip_audio or audio_path is not None)
+                    if result["ok"] and args.knowledge_base:
+                        result["knowledge_base_id"] = await upload_knowledge_base(elevenlabs, storage, presentation_id, script)
+            except Exception as e:
+                traceback.print_exc()
+                result["error"] = str(e)
+                result["ok"] = False
+            result["seconds"] = round(time.monotonic() - started, 2)
+            if memory is not None:
+                result["memory"] = memory.report()
+                # What this deck shed was for its own memory; the next deck starts at the full limit
+                tts_limiter.max_limit = args.tts_concurrency
+            print(f"{presentation_id}: {'ok' if result['ok'] else 'failed'}, {result['slides']} slides "
+                  f"in {result['seconds']:.1f}s", file=sys.stderr)
+            return result
+
+    with track_memory("process_decks run"):
+        results = await asyncio.gather(*[process_one(pdf_path) for pdf_path in pdf_paths])
+    tts_stats = tts_limiter.stats()
+    tts_stats.pop("per_request")
+    print(f"Shared limits: claude {json.dumps(claude_client.stats())}, tts {json.dumps(tts_stats)}, "
+          f"retries {json.dumps(retry_policy.stats())}", file=sys.stderr)
+    return results
+
+
+def summarize(results: List[dict], wall_seconds: float) -> dict:
+    succeeded = [r for r in results if r["ok"]]
+    slides = sum(r["slides"] for r in succeeded)
+    minutes = wall_seconds / 60 if wall_seconds else 0
+    return {
+        "decks": len(results),
+        "succeeded": len(succeeded),
+        "failed": [r["presentation_id"] for r in results if not r["ok"]],
+        "slides": slides,
+        "wall_seconds": round(wall_seconds, 2),
+        "decks_per_minute": round(len(succeeded) / minutes, 2) if minutes else None,
+        "slides_per_minute": round(slides / minutes, 1) if minutes else None
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Process a directory or manifest of PDFs concurrently")
+    parser.add_argument("source", help="Directory of PDFs, or a manifest listing PDF paths")
+    parser.add_argument("--output-dir", default="output", help="Root of the presentations/ output tree")
+    parser.add_argument("--deck-concurrency", type=int, default=3, help="Decks in progress at once")
+    parser.add_argument("--claude-concurrency", type=int, default=8, help="Claude requests in flight across all decks")
+    parser.add_argument("--claude-input-tpm", type=int, default=80000,
+                        help="Claude input tokens per minute across all decks, 0 for no limit")
+    parser.add_argument("--claude-output-tpm", type=int, default=16000,
+                        help="Claude output tokens per minute across all decks, 0 for no limit")
+    parser.add_argument("--tts-concurrency", type=int, default=10, help="ElevenLabs requests in flight across all decks")
+    parser.add_argument("--audio-format", default=DEFAULT_AUDIO_FORMAT, choices=["mp3", "wav", "flac", "opus"])
+    parser.add_argument("--skip-audio", action="store_true", help="Only generate scripts")
+    parser.add_argument("--knowledge-base", action="store_true",
+                        help="Also upload each script to the ElevenLabs knowledge base and create an agent")
+    parser.add_argument("--report", help="Write per-deck results and the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    pdf_paths = find_pdfs(args.source)
+    if not pdf_paths:
+        print(f"No PDFs found in {args.source}", file=sys.stderr)
+        return 1
+    if not os.environ.get("ANTHROPIC_API_KEY"):
+        print("Error: ANTHROPIC_API_KEY environment variable not set", file=sys.stderr)
+        return 1
+
+    started = time.monotonic()
+    results = run(process_decks(pdf_paths, args))
+    summary = summarize(results, time.monotonic() - started)
+    print(f"Processed {summary['succeeded']}/{summary['decks']} decks, {summary['slides']} slides "
+          f"in {summary['wall_seconds']:.1f}s: {summary['decks_per_minute']} decks/min, "
+          f"{summary['slides_per_minute']} slides/min")
+    if summary["failed"]:
+        print(f"Failed: {', '.join(summary['failed'])}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"summary": summary, "decks": results}, f, indent=2)
+    return 0 if not summary["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+import asyncio
+import email.utils
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import aiohttp
+
+from tracing import span
+
+T = TypeVar("T")
+
+# Request timeout, conflict and rate limit; every 5xx (including
+# Anthropic's 529 overloaded) is retryable as well
+RETRYABLE_STATUSES = {408, 409, 429}
+
+DEFAULT_MAX_ATTEMPTS = 4
+BASE_DELAY_SECONDS = 1.0
+MAX_DELAY_SECONDS = 30.0
+# A provider asking us to wait longer than this is treated as a failure
+# rather than parking the run past the function timeout
+MAX_RETRY_AFTER_SECONDS = 120.0
+
+# Anthropic rate-limit resources that come with -remaining/-reset headers
+ANTHROPIC_RATE_LIMITS = ("requests", "tokens", "input-tokens", "output-tokens")
+
+
+class RetryableError(Exception):
+    """
+    Failure worth another attempt that has no HTTP status, such as model
+    output that did not validate. reason labels it in the retry metrics.
+    """
+
+    def __init__(self, message: str, reason: str = "retryable"):
+        super().__init__(message)
+        self.reason = reason
+
+
+class HTTPStatusError(Exception):
+    """Error response from a provider, keeping the headers that say when to retry."""
+
+    def __init__(self, message: str, status: int, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _error_status_and_headers(exc: BaseException) -> Tuple[Optional[int], object]:
+    """Status code and response headers of an SDK, aiohttp or HTTPStatusError error."""
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    headers = getattr(exc, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+    return status, headers
+
+
+def _header(headers, name: str) -> Optional[str]:
+    if not headers:
+        return None
+    # httpx and aiohttp headers are case-insensitive; plain dicts are not
+    value = headers.get(name)
+    if value is None and isinstance(headers, dict):
+        value = next((v for k, v in headers.items() if k.lower() == name), None)
+    return value
+
+
+def classify(exc: BaseException) -> Tuple[bool, str]:
+    """(whether exc is worth retrying, a short reason for the metrics)."""
+    if isinstance(exc, RetryableError):
+        return True, exc.reason
+    status, headers = _error_status_and_headers(exc)
+    if isinstance(status, int):
+        should_retry = _header(headers, "x-should-retry")
+        if should_retry in ("true", "false"):
+            return should_retry == "true", str(status)
+        return status in RETRYABLE_STATUSES or status >= 500, str(status)
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True, "timeout"
+    if isinstance(exc, (ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True, "connection"
+    # Only look at SDK errors when the SDK is loaded, so TTS-only callers
+    # never import it
+    anthropic = sys.modules.get("anthropic")
+    if anthropic is not None:
+        if isinstance(exc, anthropic.APITimeoutError):
+            return True, "timeout"
+        if isinstance(exc, anthropic.APIConnectionError):
+            return True, "connection"
+    return False, type(exc).__name__
+
+
+def retry_after_seconds(headers, now: Optional[float] = None) -> Optional[float]:
+    """
+    How long the provider asked us to wait: retry-after-ms, retry-after
+    (seconds or an HTTP date), or the reset time of an exhausted
+    Anthropic rate limit. None when the headers say nothing.
+    """
+    now = time.time() if now is None else now
+    waits = []
+    retry_after_ms = _header(headers, "retry-after-ms")
+    if retry_after_ms:
+        try:
+            waits.append(float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = _header(headers, "retry-after")
+    if retry_after:
+        try:
+            waits.append(float(retry_after))
+        except ValueError:
+            try:
+                waits.append(email.utils.parsedate_to_datetime(retry_after).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    for resource in ANTHROPIC_RATE_LIMITS:
+        if _header(headers, f"anthropic-ratelimit-{resource}-remaining") != "0":
+            continue
+        reset = _header(headers, f"anthropic-ratelimit-{resource}-reset")
+        try:
+            reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            continue
+        if reset_at.tzinfo is None:
+            reset_at = reset_at.replace(tzinfo=timezone.utc)
+        waits.append(reset_at.timestamp() - now)
+    return max(0.0, max(waits)) if waits else None
+
+
+class RetryBudget:
+    """
+    Retries allowed for one run: min_retries to start with, plus ratio
+    for every call made. During a provider outage retries stop once the
+    budget is spent instead of multiplying the load on it.
+    """
+
+    def __init__(self, min_retries: int = 10, ratio: float = 0.2):
+        self.balance = float(min_retries)
+        self.ratio = ratio
+
+    def on_call(self) -> None:
+        self.balance += self.ratio
+
+    def try_spend(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Retries provider calls with exponential backoff and full jitter (a
+    uniform delay up to base_delay * 2^(attempt-1), capped at max_delay).
+
+    Errors are split by classify(): rate limits, 5xx, timeouts, dropped
+    connections and RetryableError are retried, anything else is raised
+    at once. A retry-after or rate-limit reset from the provider is a
+    floor on the delay, and also holds back every other call to the
+    same provider (the part of the operation name before the first dot)
+    until it has passed, so a burst of 429s becomes a pause rather than
+    a burst of retries. Retries come out of a shared RetryBudget, and
+    each decision is counted in stats() and traced as a retry.backoff span.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = BASE_DELAY_SECONDS,
+        max_delay: float = MAX_DELAY_SECONDS,
+        max_retry_after: float = MAX_RETRY_AFTER_SECONDS,
+        budget: Optional[RetryBudget] = None,
+        seed: Optional[int] = None
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget or RetryBudget()
+        self._random = random.Random(seed)
+        self._resume_at = {}  # provider -> monotonic time its retry-after ends
+        self.calls = 0
+        self.retries = 0
+        self.recovered = 0
+        self.fatal = 0
+        self.exhausted = 0
+        self.budget_denied = 0
+        self.backoff_seconds = 0.0
+        self.paused_seconds = 0.0
+        self.reasons = {}
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter delay before attempt + 1."""
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def allow_retry(self, operation: str, reason: str) -> bool:
+        """
+        Spend one retry from the budget for work retried outside call(),
+        such as regenerating a batch, and count it.
+        """
+        if not self.budget.try_spend():
+            self.budget_denied += 1
+            print(f"Retry budget spent, not retrying {operation} after {reason}")
+            return False
+        self.retries += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return True
+
+    async def _wait_for_provider(self, provider: str) -> None:
+        delay = self._resume_at.get(provider, 0.0) - time.monotonic()
+        if delay > 0:
+            # Spread the callers released together by the same retry-after
+            delay += self._random.uniform(0, self.base_delay)
+            self.paused_seconds += delay
+            await asyncio.sleep(delay)
+
+    async def call(
+        self,
+        operation: str,
+        func: Callable[[], Awaitable[T]],
+        max_attempts: Optional[int] = None,
+        reason_attempts: Optional[Dict[str, int]] = None
+    ) -> T:
+        """
+        Await func() until it succeeds, retrying as described above.
+        reason_attempts caps the attempts that may fail for a given
+        reason below max_attempts, e.g. {"invalid_json": 2} so that bad
+        output is not resampled as often as a dropped connection is retried.
+        Raises the last error once it is fatal, attempts or the budget
+        run out, or the provider asks for a wait over max_retry_after.
+        """
+        max_attempts = max_attempts or self.max_attempts
+        reason_attempts = reason_attempts or {}
+        provider = operation.split(".", 1)[0]
+        self.calls += 1
+        self.budget.on_call()
+        attempt = 1
+        failures = {}  # reason -> attempts that failed with it
+        while True:
+            await self._wait_for_provider(provider)
+            try:
+                result = await func()
+            except Exception as e:
+                retryable, reason = classify(e)
+                if not retryable:
+                    self.fatal += 1
+                    raise
+                _, headers = _error_status_and_headers(e)
+                retry_after = retry_after_seconds(headers)
+                failures[reason] = failures.get(reason, 0) + 1
+                if (attempt >= max_attempts or failures[reason] >= reason_attempts.get(reason, max_attempts)
+                        or (retry_after or 0) > self.max_retry_after):
+                    self.exhausted += 1
+                    raise
+                if not self.allow_retry(operation, reason):
+                    raise
+
+                delay = self.backoff(attempt)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                    resume_at = time.monotonic() + retry_after
+                    self._resume_at[provider] = max(self._resume_at.get(provider, 0.0), resume_at)
+                print(f"Retrying {operation} after {reason} in {delay:.2f}s (attempt {attempt + 1}/{max_attempts})")
+                with span("retry.backoff", operation=operation, attempt=attempt, reason=reason,
+                          delay_ms=round(delay * 1000, 1), retry_after=retry_after):
+                    self.backoff_seconds += delay
+                    await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                if attempt > 1:
+                    self.recovered += 1
+                return result
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "recovered": self.recovered,
+            "fatal": self.fatal,
+            "exhausted": self.exhausted,
+            "budget_denied": self.budget_denied,
+            "backoff_seconds": round(self.backoff_seconds, 2),
+            "paused_seconds": round(self.paused_seconds, 2),
+            "reasons": dict(self.reasons)
+        }
@@ -0,0 +1,144 @@
+import json
+import time
+from typing import List, Optional
+
+from storage_backend import StorageBackend, StorageNotFoundError
+
+# A bit longer than the 350 s function timeout: a "running" marker older
+# than this belongs to an invocation that was killed, not one in flight
+DEFAULT_LEASE_SECONDS = 420
+# Deliveries of one generation that may run before a failing upload is
+# given up on, rather than retried for as long as the trigger retries
+DEFAULT_MAX_ATTEMPTS = 5
+# One entry per run that has not completed, so the resume sweep lists a
+# short prefix instead of every presentation's files
+PENDING_PREFIX = "runs/pending/"
+
+
+class RunInProgressError(Exception):
+    """
+    Another delivery of the same generation holds the run. If the holder
+    was killed (timeout, out of memory), a redelivery or the resume sweep
+    (see stalled_runs) finds its marker stale and takes over.
+    """
+
+
+class RunLease:
+    """
+    Marker at presentations/<id>/runs/<generation>.json that deduplicates
+    storage trigger deliveries for one uploaded object generation.
+
+    The first delivery creates the marker atomically and runs. Later
+    deliveries skip once it completed, raise RunInProgressError while it
+    is running, and take over a run that failed or whose invocation died,
+    resuming from the batches and audio segments that run already
+    produced. Takeover replaces the marker only if it is still the
+    generation that was read, so of two deliveries racing for it one wins.
+
+    Until the run completes or is given up, an entry under PENDING_PREFIX
+    records source (the uploaded object's bucket and name), so a run the
+    trigger did not redeliver can still be resumed from it.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        presentation_id: str,
+        generation: str,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        source: Optional[dict] = None
+    ):
+        self.storage = storage
+        self.presentation_id = presentation_id
+        self.generation = str(generation)
+        self.path = f"presentations/{presentation_id}/runs/{self.generation}.json"
+        self.pending_path = f"{PENDING_PREFIX}{presentation_id}/{self.generation}.json"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.source = source or {}
+        self.record = None
+
+    def _write(self, record: dict) -> None:
+        self.record = record
+        self.storage.write_json(self.path, record)
+
+    def acquire(self) -> bool:
+        """
+        Claim the run for this invocation. Returns False when the run
+        already completed or has used up max_attempts, and raises
+        RunInProgressError when another delivery is running it.
+        """
+        record = {
+            "generation": self.generation,
+            "state": "running",
+            "attempts": 1,
+            "started_at": time.time()
+        }
+        if self.storage.create_if_absent(self.path, json.dumps(record).encode("utf-8"), content_type="application/json"):
+            self.record = record
+            self.storage.write_json(self.pending_path, {
+                **self.source,
+                "presentation_id": self.presentation_id,
+                "generation": self.generation,
+                "marker_path": self.path
+            })
+            return True
+
+        try:
+            data, marker_generation = self.storage.read_with_generation(self.path)
+        except StorageNotFoundError:
+            raise RunInProgressError(f"Run marker {self.path} was deleted while claiming it")
+        existing = json.loads(data)
+
+        state = existing.get("state")
+        age = time.time() - existing.get("started_at", 0)
+        attempts = existing.get("attempts", 1)
+        if state == "completed":
+            print(f"Run for generation {self.generation} already completed, skipping duplicate event")
+            self.storage.delete(self.pending_path)
+            return False
+        if state == "running" and age < self.lease_seconds:
+            raise RunInProgressError(f"Run for generation {self.generation} is in progress ({age:.0f}s)")
+        if attempts >= self.max_attempts:
+            print(f"Run for generation {self.generation} {state} after {attempts} attempts, giving up")
+            self.storage.delete(self.pending_path)
+            return False
+
+        record = {**existing, **record, "attempts": attempts + 1}
+        payload = json.dumps(record).encode("utf-8")
+        if not self.storage.replace_if_generation(self.path, payload, marker_generation, content_type="application/json"):
+            raise RunInProgressError(f"Another delivery took over the run for generation {self.generation}")
+        print(f"Resuming {state} run for generation {self.generation} (attempt {attempts + 1})")
+        self.record = record
+        return True
+
+    def complete(self, **info) -> None:
+        self._write({**self.record, **info, "state": "completed", "completed_at": time.time()})
+        self.storage.delete(self.pending_path)
+
+    def fail(self, error: Optional[str] = None) -> None:
+        self._write({**self.record, "state": "failed", "error": error, "failed_at": time.time()})
+
+
+def stalled_runs(storage: StorageBackend, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[dict]:
+    """
+    Pending entries of runs that failed or whose invocation died, oldest
+    first. Entries of runs that completed or whose marker is gone are
+    removed; runs still inside their lease are left alone.
+    """
+    stalled = []
+    for stored in sorted(storage.list_objects(PENDING_PREFIX), key=lambda stored: stored.updated):
+        entry = storage.read_json(stored.path)
+        try:
+            marker = storage.read_json(entry["marker_path"])
+        except StorageNotFoundError:
+            storage.delete(stored.path)
+            continue
+        if marker.get("state") == "completed":
+            storage.delete(stored.path)
+            continue
+        if marker.get("state") == "running" and time.time() - marker.get("started_at", 0) < lease_seconds:
+            continue
+        stalled.append(entry)
+    return stalled
@@ -0,0 +1,187 @@
+import asyncio
+import re
+from collections import namedtuple
+from typing import Hashable, List, Optional
+
+from tts_cache import CONTEXT_HASH_CHARS
+
+# position is (batch number, offset in batch), which orders paragraphs even
+# when a batch comes back with a different slide count than it was sent with
+ReadyParagraph = namedtuple("ReadyParagraph", ["position", "slide", "text", "previous_text", "next_text"])
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+
+class ScriptStream:
+    """
+    Hands validated script batches from generate_script to process_audio
+    while the rest of the deck is still being written.
+
+    A paragraph becomes ready for TTS once the text ElevenLabs gets as its
+    context is known: the last context_chars characters before it and the
+    first context_chars after it, or the nearest context_sentences
+    sentences on each side when that is set. Only the scripts inside the
+    window are visited, so building every paragraph's context is linear in
+    the deck size rather than quadratic.
+    """
+
+    def __init__(self, context_chars: int = CONTEXT_HASH_CHARS, context_sentences: Optional[int] = None):
+        self.context_chars = context_chars
+        self.context_sentences = context_sentences
+        self._batch_numbers = {}
+        self._batches: List[Optional[list]] = []
+        self._batch_slides: List[Optional[list]] = []
+        self._dispatched = set()
+        self._changed = asyncio.Event()
+        self.closed = False
+        self.failed = False
+
+    @classmethod
+    def from_script(
+        cls,
+        script_data: dict,
+        context_chars: int = CONTEXT_HASH_CHARS,
+        context_sentences: Optional[int] = None
+    ) -> "ScriptStream":
+        """A stream that already holds a complete script."""
+        stream = cls(context_chars=context_chars, context_sentences=context_sentences)
+        stream.expect_batches([0])
+        stream.add_batch(0, script_data["slides"])
+        stream.close()
+        return stream
+
+    def expect_batches(self, batch_keys: List[Hashable]) -> None:
+        """Declare the batches that make up the script, in script order."""
+        self._batch_numbers = {key: n for n, key in enumerate(batch_keys)}
+        self._batches = [None] * len(batch_keys)
+        self._batch_slides = [None] * len(batch_keys)
+
+    def add_batch(self, batch_key: Hashable, slides: list) -> None:
+        self._batch_slides[self._batch_numbers[batch_key]] = list(slides)
+        self._batches[self._batch_numbers[batch_key]] = [
+            None if slide.get("should_skip", False) else slide
+            for slide in slides
+        ]
+        self._changed.set()
+
+    def close(self) -> None:
+        """No more batches are coming; every paragraph is now ready."""
+        self.closed = True
+        self._changed.set()
+
+    def fail(self) -> None:
+        """Script generation failed, so the audio will not be completed."""
+        self.failed = True
+        self.closed = True
+        self._changed.set()
+
+    @property
+    def complete(self) -> bool:
+        return self.closed and not self.failed and all(batch is not None for batch in self._batches)
+
+    async def wait_for_update(self) -> None:
+        await self._changed.wait()
+        self._changed.clear()
+
+    def _covered(self, text: str) -> int:
+        if self.context_sentences:
+            return len(SENTENCE_BREAK.split(text.strip()))
+        return len(text) + 1  # plus the joining space
+
+    def _window_size(self) -> int:
+        return self.context_sentences if self.context_sentences else self.context_chars + 1
+
+    def _trim(self, texts: List[str], step: int) -> Optional[str]:
+        """Join the scripts collected on one side and cut them to the window."""
+        if not texts:
+            return None
+        if step < 0:
+            joined = " ".join(reversed(texts))
+            if self.context_sentences:
+                return " ".join(SENTENCE_BREAK.split(joined.strip())[-self.context_sentences:])
+            return joined[-self.context_chars:]
+        joined = " ".join(texts)
+        if self.context_sentences:
+            return " ".join(SENTENCE_BREAK.split(joined.strip())[:self.context_sentences])
+        return joined[:self.context_chars]
+
+    def _context(self, batch_number: int, offset: int, step: int) -> Optional[List[str]]:
+        """
+        Scripts on one side of a slide until the window is covered, or
+        None if a batch needed for that is still pending.
+        """
+        texts = []
+        covered = 0
+        b, i = batch_number, offset + step
+        while 0 <= b < len(self._batches):
+            batch = self._batches[b]
+            if batch is None:
+                return None
+            while 0 <= i < len(batch):
+                if batch[i] is not None:
+                    texts.append(batch[i]["script"])
+                    covered += self._covered(batch[i]["script"])
+                    if covered >= self._window_size():
+                        return texts
+                i += step
+            b += step
+            if 0 <= b < len(self._batches) and self._batches[b] is not None:
+                i = 0 if step > 0 else len(self._batches[b]) - 1
+            else:
+                i = None
+        return texts
+
+    def take_ready(self) -> List[ReadyParagraph]:
+        """Paragraphs whose context is now known and that were not handed out before."""
+        ready = []
+        for b, batch in enumerate(self._batches):
+            if batch is None:
+                continue
+            for i, slide in enumerate(batch):
+                if slide is None or (b, i) in self._dispatched:
+                    continue
+                before = self._context(b, i, -1)
+                after = self._context(b, i, 1)
+                if before is None or after is None:
+                    continue
+                self._dispatched.add((b, i))
+                ready.append(ReadyParagraph(
+                    position=(b, i),
+                    slide=slide.get("slide"),
+                    text=slide["script"],
+                    previous_text=self._trim(before, -1),
+                    next_text=self._trim(after, 1)
+                ))
+        return ready
+
+    def paragraph_positions(self) -> List[tuple]:
+        """Positions of all non-skipped slides in script order, once complete."""
+        return [
+            (b, i)
+            for b, batch in enumerate(self._batches)
+            for i, slide in enumerate(batch or [])
+            if slide is not None
+        ]
+
+    def slide_positions(self) -> List[tuple]:
+        """
+        (position, slide) for every slide in script order once complete,
+        with a position of None for slides marked should_skip.
+        """
+        return [
+            (None if slide.get("should_skip", False) else (b, i), slide)
+            for b, slides in enumerate(self._batch_slides)
+            for i, slide in enumerate(slides or [])
+        ]
+
+    def settled_positions(self) -> List[tuple]:
+        """
+        Positions of non-skipped slides in script order, up to the first
+        batch that has not arrived yet; nothing can be inserted before them.
+        """
+        positions = []
+        for b, batch in enumerate(self._batches):
+            if batch is None:
+                break
+            positions.extend((b, i) for i, slide in enumerate(batch) if slide is not None)
+        return positions
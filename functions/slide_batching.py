@@ -0,0 +1,104 @@
+import math
+from collections import namedtuple
+from typing import List, Optional
+
+# Rough token estimate for slide text and scripts; no tokenizer is needed to
+# decide how to pack slides, only a consistent measure of size
+CHARS_PER_TOKEN = 4
+# A narrated slide runs to roughly this many tokens however little is on it,
+# plus a share of its own text for dense slides
+SCRIPT_BASE_TOKENS = 150
+SCRIPT_TOKENS_PER_INPUT_TOKEN = 0.6
+
+# Packing limits. The output budget keeps each call short enough that one
+# slow batch does not hold up the deck, while near-empty slides share a call
+MAX_BATCH_SLIDES = 8
+MAX_BATCH_INPUT_TOKENS = 3000
+MAX_BATCH_OUTPUT_TOKENS = 1600
+
+# max_tokens for a batch is its estimate times this, within the model's limits
+MAX_TOKENS_HEADROOM = 1.75
+MIN_MAX_TOKENS = 1024
+MODEL_MAX_TOKENS = 8192
+# The JSON form of a narrative is longer than the narrative: escaped quotes
+# and line breaks, and the slide/title fields of every slide
+JSON_TOKENS_PER_NARRATIVE_TOKEN = 1.3
+
+SlideBatch = namedtuple("SlideBatch", ["start_idx", "slides", "input_tokens", "output_tokens", "max_tokens"])
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_script_tokens(slide_text: str) -> int:
+    """Expected length of the narration generated for one slide."""
+    return SCRIPT_BASE_TOKENS + math.ceil(SCRIPT_TOKENS_PER_INPUT_TOKEN * estimate_tokens(slide_text))
+
+
+def max_tokens_for(output_tokens: int) -> int:
+    return max(MIN_MAX_TOKENS, min(MODEL_MAX_TOKENS, math.ceil(output_tokens * MAX_TOKENS_HEADROOM)))
+
+
+def json_max_tokens_for(narrative_text: str) -> int:
+    """max_tokens for converting a narrative to script JSON, sized from the narrative itself."""
+    return max_tokens_for(math.ceil(estimate_tokens(narrative_text) * JSON_TOKENS_PER_NARRATIVE_TOKEN))
+
+
+def retry_max_tokens(max_tokens: int) -> int:
+    """max_tokens for the next attempt after a response was cut off at max_tokens."""
+    return min(MODEL_MAX_TOKENS, max_tokens * 2)
+
+
+def plan_batches(
+    pdf_slides: List[str],
+    max_slides: int = MAX_BATCH_SLIDES,
+    max_input_tokens: int = MAX_BATCH_INPUT_TOKENS,
+    max_output_tokens: int = MAX_BATCH_OUTPUT_TOKENS,
+    fixed_size: Optional[int] = None
+) -> List[SlideBatch]:
+    """
+    Split the deck into consecutive batches for script generation.
+
+    Slides are packed greedily until the next one would push the batch
+    past max_slides or its estimated input or output tokens past the
+    limits, so a run of title slides goes out in one call and a dense
+    slide gets a call to itself. Each batch's max_tokens is sized from
+    its own output estimate. fixed_size gives the old fixed-length
+    batches instead (with max_tokens still sized per batch).
+    """
+    batches = []
+    start = 0
+    while start < len(pdf_slides):
+        end = start
+        input_tokens = output_tokens = 0
+        while end < len(pdf_slides):
+            slide_input = estimate_tokens(pdf_slides[end])
+            slide_output = estimate_script_tokens(pdf_slides[end])
+            if fixed_size is not None:
+                full = end - start >= fixed_size
+            else:
+                full = end > start and (
+                    end - start >= max_slides
+                    or input_tokens + slide_input > max_input_tokens
+                    or output_tokens + slide_output > max_output_tokens
+                )
+            if full:
+                break
+            input_tokens += slide_input
+            output_tokens += slide_output
+            end += 1
+        batches.append(SlideBatch(
+            start_idx=start,
+            slides=pdf_slides[start:end],
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            max_tokens=max_tokens_for(output_tokens)
+        ))
+        start = end
+    return batches
+
+
+def batch_id_for(start_idx: int, slide_count: int) -> str:
+    """Storage and manifest name of the batch covering slides start_idx+1 .. start_idx+slide_count."""
+    return f"batch_{start_idx+1}_slides_{start_idx+1}-{start_idx+slide_count}"
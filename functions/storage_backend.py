@@ -0,0 +1,530 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from tracing import span
+
+StoredObject = namedtuple("StoredObject", ["path", "size", "updated"])
+
+
+class StorageNotFoundError(FileNotFoundError):
+    """Raised when reading a path that does not exist in the backend."""
+
+
+class StorageBackend:
+    """
+    Minimal object-store interface used by the pipeline stages.
+
+    Paths are bucket-relative ("presentations/<id>/script.json"). The
+    GCS implementation wraps a firebase_admin bucket; the local and
+    in-memory ones let the pipeline and benchmarks run offline.
+    """
+
+    def read_bytes(self, path: str) -> bytes:
+        raise NotImplementedError
+
+    def write_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def write_file(self, path: str, local_path: str, content_type: Optional[str] = None) -> None:
+        with open(local_path, "rb") as f:
+            self.write_bytes(path, f.read(), content_type=content_type)
+
+    def create_if_absent(self, path: str, data: bytes, content_type: Optional[str] = None) -> bool:
+        """Write path only if nothing is there yet; returns False if it already existed."""
+        raise NotImplementedError
+
+    def read_with_generation(self, path: str) -> Tuple[bytes, str]:
+        """Contents of path and an opaque generation for replace_if_generation."""
+        raise NotImplementedError
+
+    def replace_if_generation(self, path: str, data: bytes, generation: str, content_type: Optional[str] = None) -> bool:
+        """
+        Write path only if it is still at generation, i.e. nobody wrote it
+        since it was read; returns False if it changed or was deleted.
+        """
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, path: str) -> None:
+        raise NotImplementedError
+
+    def list_objects(self, prefix: str) -> List[StoredObject]:
+        raise NotImplementedError
+
+    def set_metadata(self, path: str, metadata: dict) -> None:
+        raise NotImplementedError
+
+    def read_text(self, path: str) -> str:
+        return self.read_bytes(path).decode("utf-8")
+
+    def write_text(self, path: str, text: str, content_type: str = "text/plain") -> None:
+        self.write_bytes(path, text.encode("utf-8"), content_type=content_type)
+
+    def read_json(self, path: str):
+        return json.loads(self.read_bytes(path))
+
+    def write_json(self, path: str, data, indent: Optional[int] = None) -> None:
+        self.write_bytes(
+            path,
+            json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8"),
+            content_type="application/json"
+        )
+
+
+class GCSStorage(StorageBackend):
+    """Storage backed by a firebase_admin / google.cloud.storage bucket."""
+
+    # Resumable uploads need a multiple of 256 KiB
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def read_bytes(self, path: str) -> bytes:
+        from google.api_core.exceptions import NotFound
+        with span("storage.read", backend="gcs", path=path) as read_span:
+            try:
+                data = self.bucket.blob(path).download_as_bytes()
+            except NotFound as e:
+                read_span.set(found=False)
+                raise StorageNotFoundError(path) from e
+            read_span.set(bytes=len(data))
+            return data
+
+    def write_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> None:
+        with span("storage.write", backend="gcs", path=path, bytes=len(data)):
+            self.bucket.blob(path).upload_from_string(data, content_type=content_type)
+
+    def write_file(self, path: str, local_path: str, content_type: Optional[str] = None) -> None:
+        with span("storage.write", backend="gcs", path=path, bytes=os.path.getsize(local_path), resumable=True):
+            blob = self.bucket.blob(path)
+            blob.chunk_size = self.UPLOAD_CHUNK_SIZE
+            blob.upload_from_filename(local_path, content_type=content_type)
+
+    def create_if_absent(self, path: str, data: bytes, content_type: Optional[str] = None) -> bool:
+        from google.api_core.exceptions import PreconditionFailed
+        try:
+            # Generation 0 means "no live object", so GCS rejects the write
+            # atomically if another writer got there first
+            self.bucket.blob(path).upload_from_string(data, content_type=content_type, if_generation_match=0)
+            return True
+        except PreconditionFailed:
+            return False
+
+    def read_with_generation(self, path: str) -> Tuple[bytes, str]:
+        from google.api_core.exceptions import NotFound
+        blob = self.bucket.blob(path)
+        try:
+            data = blob.download_as_bytes()
+        except NotFound as e:
+            raise StorageNotFoundError(path) from e
+        # Set from the download response, so it is the generation just read
+        return data, str(blob.generation)
+
+    def replace_if_generation(self, path: str, data: bytes, generation: str, content_type: Optional[str] = None) -> bool:
+        from google.api_core.exceptions import PreconditionFailed
+        try:
+            self.bucket.blob(path).upload_from_string(data, content_type=content_type, if_generation_match=int(generation))
+            return True
+        except PreconditionFailed:
+            return False
+
+    def exists(self, path: str) -> bool:
+        return self.bucket.blob(path).exists()
+
+    def delete(self, path: str) -> None:
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(path).delete()
+        except NotFound:
+            pass
+
+    def list_objects(self, prefix: str) -> List[StoredObject]:
+        return [
+            StoredObject(blob.name, blob.size or 0, blob.updated.timestamp() if blob.updated else 0.0)
+            for blob in self.bucket.list_blobs(prefix=prefix)
+        ]
+
+    def set_metadata(self, path: str, metadata: dict) -> None:
+        blob = self.bucket.blob(path)
+        blob.metadata = metadata
+        blob.patch()
+
+
+class LocalStorage(StorageBackend):
+    """Storage rooted at a local directory, mirroring the bucket layout."""
+
+    METADATA_DIR = ".metadata"
+
+    def __init__(self, root: str):
+        self.root = root
+        self._replace_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _full_path(self, path: str) -> str:
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        if not full_path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Path escapes storage root: {path}")
+        return full_path
+
+    def read_bytes(self, path: str) -> bytes:
+        with span("storage.read", backend="local", path=path) as read_span:
+            try:
+                with open(self._full_path(path), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError as e:
+                read_span.set(found=False)
+                raise StorageNotFoundError(path) from e
+            read_span.set(bytes=len(data))
+            return data
+
+    def write_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> None:
+        with span("storage.write", backend="local", path=path, bytes=len(data)):
+            full_path = self._full_path(path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            tmp_path = f"{full_path}.tmp{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, full_path)
+
+    def write_file(self, path: str, local_path: str, content_type: Optional[str] = None) -> None:
+        with span("storage.write", backend="local", path=path, bytes=os.path.getsize(local_path)):
+            full_path = self._full_path(path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            shutil.copyfile(local_path, full_path)
+
+    def create_if_absent(self, path: str, data: bytes, content_type: Optional[str] = None) -> bool:
+        full_path = self._full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            fd = os.open(full_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return True
+
+    @staticmethod
+    def _generation(stat: os.stat_result) -> str:
+        # write_bytes replaces the file, so every write gets a new inode
+        return f"{stat.st_ino}-{stat.st_mtime_ns}"
+
+    def read_with_generation(self, path: str) -> Tuple[bytes, str]:
+        with self._replace_lock:
+            try:
+                with open(self._full_path(path), "rb") as f:
+                    return f.read(), self._generation(os.fstat(f.fileno()))
+            except FileNotFoundError as e:
+                raise StorageNotFoundError(path) from e
+
+    def replace_if_generation(self, path: str, data: bytes, generation: str, content_type: Optional[str] = None) -> bool:
+        # Only atomic between writers in this process, which is all the
+        # local runs need
+        with self._replace_lock:
+            try:
+                if self._generation(os.stat(self._full_path(path))) != generation:
+                    return False
+            except FileNotFoundError:
+                return False
+            self.write_bytes(path, data, content_type=content_type)
+            return True
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(self._full_path(path))
+
+    def delete(self, path: str) -> None:
+        try:
+            os.remove(self._full_path(path))
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, prefix: str) -> List[StoredObject]:
+        objects = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d != self.METADATA_DIR]
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                path = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                if path.startswith(prefix):
+                    stat = os.stat(full_path)
+                    objects.append(StoredObject(path, stat.st_size, stat.st_mtime))
+        return objects
+
+    def set_metadata(self, path: str, metadata: dict) -> None:
+        self.write_json(f"{self.METADATA_DIR}/{path}.json", metadata)
+
+
+class MemoryStorage(StorageBackend):
+    """In-process storage, mostly for tests and benchmarks."""
+
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.generations = {}
+        self._next_generation = 0
+        self._lock = threading.Lock()
+
+    def _store(self, path: str, data: bytes) -> None:
+        self.objects[path] = (bytes(data), time.time())
+        self._next_generation += 1
+        self.generations[path] = str(self._next_generation)
+
+    def read_bytes(self, path: str) -> bytes:
+        with self._lock:
+            if path not in self.objects:
+                raise StorageNotFoundError(path)
+            return self.objects[path][0]
+
+    def write_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> None:
+        with self._lock:
+            self._store(path, data)
+
+    def create_if_absent(self, path: str, data: bytes, content_type: Optional[str] = None) -> bool:
+        with self._lock:
+            if path in self.objects:
+                return False
+            self._store(path, data)
+            return True
+
+    def read_with_generation(self, path: str) -> Tuple[bytes, str]:
+        with self._lock:
+            if path not in self.objects:
+                raise StorageNotFoundError(path)
+            return self.objects[path][0], self.generations[path]
+
+    def replace_if_generation(self, path: str, data: bytes, generation: str, content_type: Optional[str] = None) -> bool:
+        with self._lock:
+            if path not in self.objects or self.generations[path] != generation:
+                return False
+            self._store(path, data)
+            return True
+
+    def exists(self, path: str) -> bool:
+        with self._lock:
+            return path in self.objects
+
+    def delete(self, path: str) -> None:
+        with self._lock:
+            self.objects.pop(path, None)
+            self.generations.pop(path, None)
+
+    def list_objects(self, prefix: str) -> List[StoredObject]:
+        with self._lock:
+            return [
+                StoredObject(path, len(data), updated)
+                for path, (data, updated) in self.objects.items()
+                if path.startswith(prefix)
+            ]
+
+    def set_metadata(self, path: str, metadata: dict) -> None:
+        with self._lock:
+            self.metadata[path] = dict(metadata)
+
+
+def as_storage(storage_client) -> StorageBackend:
+    """Wrap a raw bucket in GCSStorage; pass StorageBackend instances through."""
+    if isinstance(storage_client, StorageBackend):
+        return storage_client
+    return GCSStorage(storage_client)
+
+
+_gcs_storages = {}  # bucket name (None for the default bucket) -> GCSStorage
+
+
+def gcs_storage(bucket_name: Optional[str] = None) -> GCSStorage:
+    """
+    GCSStorage for a Firebase Storage bucket, created on first use and
+    kept for the life of the instance so warm invocations reuse its
+    client. Initializes the default Firebase app if nothing has yet;
+    firebase_admin and google.cloud.storage are only imported here.
+    """
+    storage = _gcs_storages.get(bucket_name)
+    if storage is None:
+        import firebase_admin
+        from firebase_admin import storage as firebase_storage
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app()
+        storage = GCSStorage(firebase_storage.bucket(bucket_name))
+        _gcs_storages[bucket_name] = storage
+    return storage
+
+
+class RunManifest:
+    """
+    Per-presentation record of batch state, written behind the pipeline.
+
+    Stages update the in-memory manifest, which replaces the per-batch
+    .metadata.json blobs. The manifest is written to
+    presentations/<id>/run_manifest.json at most once per flush_interval
+    while it has changes, and once more on close().
+
+    source_generation identifies the uploaded PDF the batches were made
+    from; load() only adopts an earlier manifest for the same generation.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        presentation_id: str,
+        flush_interval: float = 5.0,
+        source_generation: Optional[str] = None
+    ):
+        self.storage = storage
+        self.presentation_id = presentation_id
+        self.path = f"presentations/{presentation_id}/run_manifest.json"
+        self.flush_interval = flush_interval
+        self.source_generation = source_generation
+        self.data = {
+            "presentation_id": presentation_id,
+            "source_generation": source_generation,
+            "updated_at": None,
+            "batches": {}
+        }
+        self.writes = 0
+        self._dirty = False
+        self._flush_task = None
+        self._stopped = None
+
+    def load(self) -> int:
+        """
+        Adopt the batch state left by an earlier run over the same source
+        generation, so a re-run can skip what already completed.
+        Returns the number of batches adopted.
+        """
+        if self.source_generation is None:
+            return 0
+        try:
+            existing = self.storage.read_json(self.path)
+        except StorageNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Could not read run manifest {self.path}, starting fresh: {e}")
+            return 0
+        if existing.get("source_generation") != self.source_generation:
+            return 0
+        self.data["batches"] = existing.get("batches", {})
+        return len(self.data["batches"])
+
+    def batch(self, batch_id: str) -> dict:
+        """Return the mutable record for batch_id, creating it if needed."""
+        return self.data["batches"].setdefault(batch_id, {"batch_id": batch_id, "status": {}})
+
+    def get_status(self, batch_id: str, stage: str) -> dict:
+        return self.batch(batch_id)["status"].get(stage, {})
+
+    def update_status(self, batch_id: str, stage: str, **fields) -> None:
+        status = self.batch(batch_id)["status"].setdefault(stage, {})
+        status.update(fields)
+        status["last_updated"] = datetime.utcnow().isoformat()
+        self._dirty = True
+
+    def set_batch_info(self, batch_id: str, **fields) -> None:
+        self.batch(batch_id).update(fields)
+        self._dirty = True
+
+    def _snapshot(self) -> Optional[bytes]:
+        if not self._dirty:
+            return None
+        self._dirty = False
+        self.data["updated_at"] = datetime.utcnow().isoformat()
+        return json.dumps(self.data, ensure_ascii=False).encode("utf-8")
+
+    def _write(self, payload: bytes) -> None:
+        try:
+            self.storage.write_bytes(self.path, payload, content_type="application/json")
+            self.writes += 1
+        except Exception as e:
+            self._dirty = True
+            print(f"Failed to write run manifest {self.path}: {e}")
+
+    def flush(self) -> None:
+        """Write the manifest if it changed since the last flush."""
+        payload = self._snapshot()
+        if payload is not None:
+            self._write(payload)
+
+    async def flush_async(self) -> None:
+        """Like flush(), with the storage write off the event loop."""
+        payload = self._snapshot()
+        if payload is not None:
+            await asyncio.to_thread(self._write, payload)
+
+    async def _flush_periodically(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush_async()
+
+    def start(self) -> None:
+        """Start flushing in the background of the running event loop."""
+        if self._flush_task is None:
+            self._stopped = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """Stop background flushing and write any outstanding changes."""
+        if self._flush_task is not None:
+            self._stopped.set()
+            await self._flush_task
+            self._flush_task = None
+        await self.flush_async()
+
+
+class CheckpointWriter:
+    """
+    Writes stage outputs to storage in the background.
+
+    Stages hand their outputs to the next stage in memory; these writes
+    only make them durable. Callers wait only when max_pending writes are
+    already in flight, and drain() waits for everything outstanding.
+    """
+
+    def __init__(self, storage: StorageBackend, max_pending: int = 16):
+        self.storage = storage
+        self.max_pending = max_pending
+        self.writes = 0
+        self.failed_paths = []
+        self._pending = set()
+
+    async def _write(self, write_fn, path: str, *args, **kwargs) -> None:
+        try:
+            await asyncio.to_thread(write_fn, path, *args, **kwargs)
+            self.writes += 1
+        except Exception as e:
+            print(f"Checkpoint write failed for {path}: {e}")
+            self.failed_paths.append(path)
+
+    async def submit(self, write_fn, path: str, *args, **kwargs) -> None:
+        while len(self._pending) >= self.max_pending:
+            await asyncio.wait(self._pending, return_when=asyncio.FIRST_COMPLETED)
+        task = asyncio.create_task(self._write(write_fn, path, *args, **kwargs))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def write_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> None:
+        await self.submit(self.storage.write_bytes, path, data, content_type=content_type)
+
+    async def write_text(self, path: str, text: str, content_type: str = "text/plain") -> None:
+        await self.submit(self.storage.write_text, path, text, content_type=content_type)
+
+    async def write_json(self, path: str, data, indent: Optional[int] = None) -> None:
+        await self.submit(self.storage.write_json, path, data, indent=indent)
+
+    async def drain(self) -> List[str]:
+        """Wait for all outstanding writes; returns the paths that failed."""
+        while self._pending:
+            await asyncio.gather(*list(self._pending))
+        return list(self.failed_paths)
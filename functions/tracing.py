@@ -0,0 +1,227 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+# TRACE_OUTPUT: "stdout" (default, one JSON object per line, which Cloud
+# Logging ingests as structured entries), "off", or a file path to append to.
+# TRACE_OTEL=1 also exports every span through the OpenTelemetry SDK when
+# opentelemetry is installed and a tracer provider has been configured.
+TRACE_OUTPUT_ENV = "TRACE_OUTPUT"
+TRACE_OTEL_ENV = "TRACE_OTEL"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_run = contextvars.ContextVar("current_run", default=None)
+
+_sink_lock = threading.Lock()
+_sink = None
+_sink_target = None
+_otel_tracer = None
+_otel_checked = False
+
+
+def _write_line(record: dict) -> None:
+    global _sink, _sink_target
+    target = os.getenv(TRACE_OUTPUT_ENV, "stdout")
+    if target == "off":
+        return
+    line = json.dumps(record, default=str, ensure_ascii=False)
+    with _sink_lock:
+        if target == "stdout":
+            sys.stdout.write(line + "\n")
+            return
+        if _sink_target != target:
+            if _sink is not None:
+                _sink.close()
+            _sink = open(target, "a", encoding="utf-8")
+            _sink_target = target
+        _sink.write(line + "\n")
+        _sink.flush()
+
+
+def _get_otel_tracer():
+    """OpenTelemetry tracer when TRACE_OTEL is set and the API is importable."""
+    global _otel_tracer, _otel_checked
+    if not _otel_checked:
+        _otel_checked = True
+        if os.getenv(TRACE_OTEL_ENV) == "1":
+            try:
+                from opentelemetry import trace as otel_trace
+                _otel_tracer = otel_trace.get_tracer("present-ai.pipeline")
+            except ImportError:
+                print("TRACE_OTEL is set but opentelemetry is not installed, exporting JSON lines only")
+    return _otel_tracer
+
+
+class RunSummary:
+    """Total time and count per span name for one presentation run."""
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            count, total = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (count + 1, total + seconds)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                name: {"count": count, "total_ms": round(total * 1000, 1)}
+                for name, (count, total) in sorted(self.totals.items(), key=lambda item: -item[1][1])
+            }
+
+
+class Span:
+    """
+    One timed operation. Attributes can be added while it is open with
+    set(); it is emitted as a JSON line when it ends.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.presentation_id = attributes.pop("presentation_id", None) or (parent.presentation_id if parent else None)
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self._otel_span = None
+
+        tracer = _get_otel_tracer()
+        if tracer is not None:
+            from opentelemetry import trace as otel_trace
+            parent_context = None
+            if parent is not None and parent._otel_span is not None:
+                parent_context = otel_trace.set_span_in_context(parent._otel_span)
+            self._otel_span = tracer.start_span(name, context=parent_context)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        self.duration = self.elapsed
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+        record = {
+            "type": "span",
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "presentation_id": self.presentation_id,
+            "start": round(self.start_time, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": "error" if self.error else "ok",
+            "attributes": self.attributes
+        }
+        if self.error:
+            record["error"] = self.error
+        _write_line(record)
+
+        run = _current_run.get()
+        if run is not None:
+            run.add(self.name, self.duration)
+
+        if self._otel_span is not None:
+            if self.presentation_id:
+                self._otel_span.set_attribute("presentation_id", self.presentation_id)
+            for key, value in self.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    self._otel_span.set_attribute(key, value)
+            if self.error:
+                from opentelemetry.trace import Status, StatusCode
+                self._otel_span.set_status(Status(StatusCode.ERROR, self.error))
+            self._otel_span.end()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a child of the current span. Works the same
+    in sync code, coroutines and asyncio.to_thread calls, since the current
+    span is a context variable.
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    else:
+        current.end()
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace_presentation(presentation_id: str, name: str = "pipeline", **attributes):
+    """
+    Root span for processing one presentation. Every span opened inside it
+    carries presentation_id, and a per-stage time breakdown is emitted as
+    a summary line when it ends.
+    """
+    run = RunSummary()
+    run_token = _current_run.set(run)
+    try:
+        with span(name, presentation_id=presentation_id, **attributes) as root:
+            yield root
+    finally:
+        _current_run.reset(run_token)
+        _write_line({
+            "type": "summary",
+            "presentation_id": presentation_id,
+            "duration_ms": round(root.duration * 1000, 3) if root.duration is not None else None,
+            "stages": run.to_dict()
+        })
+
+
+def traced(name: str):
+    """Decorator form of span() for sync functions and coroutines."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def bind_context(func):
+    """
+    Wrap func to run in a copy of the caller's context, for thread pools
+    that (unlike asyncio.to_thread) do not carry context variables over.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
@@ -0,0 +1,76 @@
+import hashlib
+import json
+from typing import Optional
+
+# Default prosody context window in characters on each side of a paragraph.
+# Only this much neighbouring text is sent to ElevenLabs and hashed into the
+# segment key, so editing one slide invalidates that slide and its
+# neighbours rather than every segment in the deck.
+CONTEXT_HASH_CHARS = 1000
+
+
+def _hash_text(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_segment_key(
+    text: str,
+    voice_id: str,
+    model_id: str,
+    previous_text: Optional[str],
+    next_text: Optional[str]
+) -> str:
+    """
+    Build the content address of a synthesized paragraph from its text,
+    voice, model and a hash of the context sent with it. Callers pass the
+    bounded context window, so keys from the default 1000-character window
+    match those of earlier runs.
+    """
+    payload = json.dumps({
+        "text": text,
+        "voice_id": voice_id,
+        "model_id": model_id,
+        "previous": _hash_text(previous_text),
+        "next": _hash_text(next_text)
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SegmentAudioStore:
+    """
+    Content-addressed MP3 store for TTS output under <audio_base_path>/cache/.
+
+    Entries are immutable: a key always maps to the audio ElevenLabs
+    returned for that exact input, so a hit can be reused as-is.
+    """
+
+    def __init__(self, storage, audio_base_path: str):
+        self.storage = storage
+        self.cache_path = f"{audio_base_path}/cache"
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return f"{self.cache_path}/{key}.mp3"
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            content = self.storage.read_bytes(self._path(key))
+        except Exception:
+            content = None
+        if content:
+            self.hits += 1
+            return content
+        self.misses += 1
+        return None
+
+    def put(self, key: str, content: bytes) -> None:
+        try:
+            self.storage.write_bytes(self._path(key), content, content_type="audio/mpeg")
+        except Exception as e:
+            print(f"Failed to cache audio segment {key}: {e}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,12 +1,21 @@
 import os
-import requests
+import sys
 from typing import Optional
 
+import aiohttp
+
+# Share the pooled ElevenLabs client with the Cloud Functions code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+from elevenlabs_client import ElevenLabsClient  # noqa: E402
+from retry_policy import HTTPStatusError  # noqa: E402
+from event_loop import run  # noqa: E402
+
 class KnowledgeBaseUploader:
     def __init__(self, api_key: str):
         """Initialize the uploader with ElevenLabs API key."""
         self.api_key = api_key
-        self.base_url = "https://api.elevenlabs.io"
+        self.client = ElevenLabsClient(api_key)
+        self.base_url = self.client.base_url
         
     def upload_file(self, file_path: str) -> dict:
         """
@@ -21,32 +30,11 @@ class KnowledgeBaseUploader:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        endpoint = f"{self.base_url}/v1/convai/knowledge-base"
-        
-        headers = {
-            "xi-api-key": self.api_key
-        }
-        
-        # Open and prepare the file for upload
-        with open(file_path, 'rb') as f:
-            files = {
-                'file': (os.path.basename(file_path), f, 'text/plain')
-            }
-            
-            try:
-                response = requests.post(
-                    endpoint,
-                    headers=headers,
-                    files=files
-                )
-                response.raise_for_status()
-                return response.json()
-                
-            except requests.exceptions.RequestException as e:
-                print(f"Error uploading file: {e}")
-                if response.text:
-                    print(f"Response: {response.text}")
-                raise
+        try:
+            return run(self.client.upload_knowledge_base_file(file_path))
+        except (aiohttp.ClientError, HTTPStatusError) as e:
+            print(f"Error uploading file: {e}")
+            raise
 
     def create_agent_from_knowledge_base(self, knowledge_base_id: str, name: Optional[str] = None) -> dict:
         """
@@ -59,42 +47,10 @@ class KnowledgeBaseUploader:
         Returns:
             Response JSON from the API containing the created agent details
         """
-        endpoint = f"{self.base_url}/v1/convai/agents/create"
-        
-        headers = {
-            "xi-api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
-        # Prepare the request payload
-        payload = {
-            "name": name or f"Agent for KB {knowledge_base_id}",
-            "conversation_config": {
-                "agent": {
-                    "prompt": {
-                        "knowledge_base": [{
-                            "id": knowledge_base_id,
-                            "type": "file",
-                            "name": "presentation"
-                        }]
-                    }
-                }
-            }
-        }
-        
         try:
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.RequestException as e:
+            return run(self.client.create_agent(knowledge_base_id, name=name))
+        except (aiohttp.ClientError, HTTPStatusError) as e:
             print(f"Error creating agent: {e}")
-            if hasattr(e, 'response') and e.response.text:
-                print(f"Response: {e.response.text}")
             raise
 
 